@@ -3,20 +3,91 @@
 基于用户画像和分析结果，生成个性化的高质量内容
 """
 
-from typing import Dict, List, Optional, Any, Union
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple, Union
+from dataclasses import dataclass, asdict, replace
 from datetime import datetime
+from collections import OrderedDict
+from functools import cached_property
+from types import MappingProxyType
 import asyncio
-import json
+import hashlib
+import io
+import re
+import time
+import uuid
 
+from app.agents.llm_cache import LLMResponseCache
 from app.agents.llm_manager import AgentLLMCaller, ModelProvider
 from app.agents.llamaindex_manager import LlamaIndexManager
 from app.prompts.content_generator_prompts import get_content_generator_prompt
-from app.prompts import PromptManager
+from app.prompts import PromptManager, PromptTemplate
+from app.config.settings import settings
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
 
-@dataclass
+# 用户上下文缓存配置：同一用户在批次内或短时间内重复出现时直接复用检索结果
+USER_CONTEXT_CACHE_TTL = 300  # 秒
+USER_CONTEXT_CACHE_SIZE = 256
+
+# 批次级静态输入（品牌指南、限制条件）的序列化缓存大小
+STATIC_INPUT_CACHE_SIZE = 256
+
+# 生成结果缓存大小：相同请求（用户画像、类型、主题、要求、品牌指南均一致）在TTL内直接复用
+GENERATED_CONTENT_CACHE_SIZE = 512
+
+# 按预估输出长度分档的输出token上限：每次调用按所在档位设置max_tokens，
+# 合并生成时同档请求才打包，避免短文案与长文案混在一包中按最长者预留输出
+OUTPUT_TOKEN_BUCKETS = (1024, 2048, 4096)
+
+# 合并生成单次调用的输出token上限，包大小不超过 上限 // 档位
+PACKED_MAX_OUTPUT_TOKENS = 8192
+
+# 按预估提示词长度分档，与输出档位组成请求形状键，同形状的请求一起调度
+PROMPT_TOKEN_BUCKETS = (256, 512, 1024, 2048)
+
+# 匹配中文和英文的话题标签（Unicode模式下\w已覆盖中文字符，无需单独列出CJK区间）
+_HASHTAG_RE = re.compile(r'#(\w+)')
+
+# 各平台的内容限制配置（只读，模块加载时构建一次）
+PLATFORM_OPTIMIZATIONS = MappingProxyType({
+    "xhs": MappingProxyType({
+        "max_chars": 1000,
+        "hashtag_limit": 10,
+        "visual_priority": "high",
+        "tone": "friendly"
+    }),
+    "weibo": MappingProxyType({
+        "max_chars": 2000,
+        "hashtag_limit": 20,
+        "trending_focus": True,
+        "tone": "casual"
+    }),
+    "douyin": MappingProxyType({
+        "max_chars": 500,
+        "hashtag_limit": 5,
+        "video_first": True,
+        "tone": "entertaining"
+    })
+})
+
+# 内容中没有话题标签时使用的默认标签
+DEFAULT_HASHTAGS = ("内容分享", "生活记录", "今日分享")
+
+# 触发限流时的重试配置
+RATE_LIMIT_MAX_RETRIES = 3
+RATE_LIMIT_BASE_DELAY = 1.0  # 秒
+
+
+def _round_up_to_bucket(estimate: int, buckets: Tuple[int, ...]) -> int:
+    """向上取到不小于估计值的最小档位，超出最大档位时取最大档位"""
+    for bucket in buckets:
+        if estimate <= bucket:
+            return bucket
+    return buckets[-1]
+
+
+@dataclass(slots=True)
 class ContentGenerationRequest:
     """内容生成请求"""
     user_profile: Dict[str, Any]
@@ -28,7 +99,7 @@ class ContentGenerationRequest:
     constraints: Optional[Dict[str, Any]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class GeneratedContent:
     """生成的内容结果"""
     content_id: str
@@ -43,7 +114,7 @@ class GeneratedContent:
     ai_explanation: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ContentStrategy:
     """内容策略配置"""
     tone: str  # "professional", "casual", "humorous", "inspiring", etc.
@@ -59,8 +130,22 @@ class ContentGeneratorAgent:
     def __init__(self, preferred_model_provider: Optional[ModelProvider] = None):
         self.name = "ContentGeneratorAgent"
         self.llm_caller = AgentLLMCaller(self.name, preferred_model_provider)
-        self.llamaindex_manager = LlamaIndexManager()
-        self.prompt_manager = PromptManager()
+        # llamaindex_manager / prompt_manager 在首次使用时才构建，见下方cached_property
+        
+        # 用户语义检索结果缓存 (user_id -> (写入时间, 检索结果))
+        self._ctx_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._ctx_locks: Dict[str, asyncio.Lock] = {}
+        
+        # 品牌指南/限制条件序列化缓存 (id(对象) -> (对象, JSON字符串))
+        self._json_cache: "OrderedDict[int, Tuple[Any, str]]" = OrderedDict()
+        
+        # 批量生成结果缓存 (请求哈希 -> GeneratedContent)，TTL沿用 settings.LLM_CACHE_TTL
+        self._content_cache = LLMResponseCache(GENERATED_CONTENT_CACHE_SIZE)
+        self.content_cache_hits = 0
+        self.content_cache_misses = 0
+        
+        # 限制批量生成时的LLM并发数，避免压垮模型服务触发限流
+        self._concurrency = asyncio.Semaphore(settings.CONTENT_GEN_CONCURRENCY)
         
         # 内容类型映射
         self.content_type_mapping = {
@@ -73,36 +158,119 @@ class ContentGeneratorAgent:
         
         logger.info("ContentGeneratorAgent initialized")
     
+    @cached_property
+    def llamaindex_manager(self) -> LlamaIndexManager:
+        """LlamaIndex管理器，首次访问时获取进程级单例（需配置嵌入模型和索引目录）"""
+        return LlamaIndexManager.instance()
+    
+    @cached_property
+    def prompt_manager(self) -> PromptManager:
+        """提示词管理器，首次访问时构建"""
+        return PromptManager()
+    
     async def generate_content(
         self, 
         request: ContentGenerationRequest
     ) -> GeneratedContent:
         """生成个性化内容"""
+        return GeneratedContent(**await self.generate_content_dict(request))
+    
+    async def generate_content_dict(
+        self, 
+        request: ContentGenerationRequest
+    ) -> Dict[str, Any]:
+        """生成个性化内容，以字段字典形式返回，供直接序列化的调用方跳过数据类构造"""
         try:
             logger.info(f"Starting content generation for user: {request.user_profile.get('user_id', 'unknown')}")
             
             # 1. 基于用户画像获取上下文信息
+            # 提示词模板为内存查找，在发起检索前解析，模板缺失时无需等待检索即可失败
+            prompt_template = self._get_prompt_template(request)
             context_info = await self._get_user_context(request.user_profile)
             
             # 2. 构建内容生成提示词
-            prompt = self._build_generation_prompt(request, context_info)
+            system_prompt, prompt = self._build_generation_prompt(request, context_info, prompt_template)
             
             # 3. 调用LLM生成内容
-            response = await self.llm_caller.call_llm(prompt)
-            
-            # 4. 解析和优化生成结果
-            content = self._parse_generated_content(response, request)
+            response = await self.llm_caller.call_llm(
+                prompt, system_prompt, max_tokens=self._output_token_bucket(request)
+            )
             
-            # 5. 添加平台特定优化
-            platform_optimized = await self._optimize_for_platform(content, request.platform)
+            # 4. 解析生成结果并添加平台特定优化
+            fields = self._finalize_fields(response, request)
             
-            logger.info(f"Content generation completed for content_id: {content.content_id}")
-            return platform_optimized
+            logger.info(f"Content generation completed for content_id: {fields['content_id']}")
+            return fields
             
         except Exception as e:
             logger.error(f"Error generating content: {str(e)}")
             raise
     
+    async def generate_content_stream(
+        self, 
+        request: ContentGenerationRequest
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式生成个性化内容，边接收模型输出边解析标题和话题标签
+        
+        依次产出事件:
+        - {"event": "title", "title": str}: 首行输出完成时
+        - {"event": "hashtags", "hashtags": List[str]}: 解析到新的话题标签时
+        - {"event": "completed", "content": GeneratedContent}: 生成结束时
+        """
+        logger.info(f"Starting streaming content generation for user: {request.user_profile.get('user_id', 'unknown')}")
+        
+        prompt_template = self._get_prompt_template(request)
+        context_info = await self._get_user_context(request.user_profile)
+        system_prompt, prompt = self._build_generation_prompt(request, context_info, prompt_template)
+        
+        buffer = io.StringIO()
+        title: Optional[str] = None
+        title_head = ""
+        hashtags: Dict[str, None] = {}
+        pending = ""
+        
+        async for chunk in self.llm_caller.stream_llm(prompt, system_prompt):
+            buffer.write(chunk)
+            
+            # 标题为首个非空行，遇到换行即可确定
+            if title is None:
+                title_head = (title_head + chunk).lstrip()
+                if "\n" in title_head:
+                    title = title_head.split("\n", 1)[0]
+                    title_head = ""
+                    yield {"event": "title", "title": title}
+            
+            # 增量扫描话题标签，位于块末尾的标签可能未结束，留到下一块再确认
+            pending += chunk
+            new_tags = []
+            scan_end = len(pending)
+            for match in _HASHTAG_RE.finditer(pending):
+                if match.end() == len(pending):
+                    scan_end = match.start()
+                    break
+                tag = match.group(1)
+                if tag not in hashtags:
+                    hashtags[tag] = None
+                    new_tags.append(tag)
+            else:
+                if pending.endswith("#"):
+                    scan_end = len(pending) - 1
+            pending = pending[scan_end:]
+            
+            if new_tags:
+                yield {"event": "hashtags", "hashtags": new_tags}
+        
+        llm_response = buffer.getvalue()
+        if not llm_response:
+            raise RuntimeError("LLM streaming returned no content")
+        
+        content = self._parse_generated_content(llm_response, request)
+        platform_optimized = self._optimize_for_platform(content, request.platform)
+        
+        logger.info(f"Streaming content generation completed for content_id: {content.content_id}")
+        yield {"event": "completed", "content": platform_optimized}
+    
     async def generate_content_batch(
         self, 
         requests: List[ContentGenerationRequest]
@@ -110,8 +278,54 @@ class ContentGeneratorAgent:
         """批量生成内容"""
         logger.info(f"Starting batch content generation for {len(requests)} requests")
         
-        tasks = [self.generate_content(request) for request in requests]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # 合并完全相同的请求，每组只调用一次LLM
+        groups: Dict[Union[bytes, int], List[int]] = {}
+        for index, request in enumerate(requests):
+            groups.setdefault(self._request_key(request), []).append(index)
+        
+        if len(groups) < len(requests):
+            logger.info(f"Coalesced {len(requests) - len(groups)} duplicate requests in batch")
+        
+        # 先查结果缓存，只为未命中的请求调用LLM
+        cached: Dict[Union[bytes, int], GeneratedContent] = {}
+        for key in groups:
+            content = self._content_cache.get(key) if isinstance(key, bytes) else None
+            if content is not None:
+                cached[key] = content
+        self.content_cache_hits += len(cached)
+        self.content_cache_misses += len(groups) - len(cached)
+        if cached:
+            logger.info(f"Reused {len(cached)} cached generation results in batch")
+        
+        # 未命中的请求按共享输入打包，每包一次LLM调用
+        miss_keys = [key for key in groups if key not in cached]
+        async with asyncio.TaskGroup() as tg:
+            pack_tasks = [
+                (pack, tg.create_task(self._generate_pack([requests[groups[key][0]] for key in pack])))
+                for pack in self._plan_packs(miss_keys, groups, requests)
+            ]
+        
+        generated: Dict[Union[bytes, int], Union[GeneratedContent, Exception]] = {}
+        for pack, task in pack_tasks:
+            generated.update(zip(pack, task.result()))
+        
+        cache_ttl = settings.LLM_CACHE_TTL
+        for key, result in generated.items():
+            if cache_ttl > 0 and isinstance(key, bytes) and not isinstance(result, Exception):
+                # 缓存独立副本，调用方修改返回结果时不会影响之后的缓存命中
+                self._content_cache.set(key, self._clone_content(result), cache_ttl)
+        
+        # 将结果按原始顺序展开，重复请求和缓存命中均获得独立的content_id
+        results: List[Union[GeneratedContent, Exception]] = [None] * len(requests)
+        for key, indexes in groups.items():
+            if key in cached:
+                result = cached[key]
+                results[indexes[0]] = self._clone_content(result)
+            else:
+                result = generated[key]
+                results[indexes[0]] = result
+            for index in indexes[1:]:
+                results[index] = result if isinstance(result, Exception) else self._clone_content(result)
         
         # 过滤掉异常结果
         valid_results = [r for r in results if not isinstance(r, Exception)]
@@ -122,6 +336,188 @@ class ContentGeneratorAgent:
         
         return valid_results
     
+    def _plan_packs(
+        self,
+        keys: List[Union[bytes, int]],
+        groups: Dict[Union[bytes, int], List[int]],
+        requests: List[ContentGenerationRequest]
+    ) -> List[List[Union[bytes, int]]]:
+        """
+        将除用户画像外输入完全相同的请求分到同一组，每组按 CONTENT_GEN_PACK_SIZE 切分成包；
+        同组请求的平台和内容类型一致，因此落在同一输出长度档位，包大小再受合并调用输出上限约束
+        """
+        max_pack_size = max(settings.CONTENT_GEN_PACK_SIZE, 1)
+        # 每个请求的形状键只计算一次
+        shapes = {key: self._shape_key(requests[groups[key][0]]) for key in keys}
+        by_signature: Dict[Union[str, bytes, int], List[Union[bytes, int]]] = {}
+        for key in keys:
+            signature = self._pack_signature(requests[groups[key][0]]) if max_pack_size > 1 else None
+            by_signature.setdefault(key if signature is None else signature, []).append(key)
+        
+        packs = []
+        for same_inputs in by_signature.values():
+            # 同组内按形状排序（稳定排序），提示词长度相近的用户落在同一包中
+            same_inputs.sort(key=shapes.__getitem__)
+            pack_size = max(min(max_pack_size, PACKED_MAX_OUTPUT_TOKENS // shapes[same_inputs[0]][1]), 1)
+            packs.extend(
+                same_inputs[start:start + pack_size]
+                for start in range(0, len(same_inputs), pack_size)
+            )
+        # 按形状键顺序调度，同形状的调用集中发出
+        packs.sort(key=lambda pack: shapes[pack[0]])
+        return packs
+    
+    @classmethod
+    def _shape_key(cls, request: ContentGenerationRequest) -> Tuple[int, int]:
+        """请求形状键 (提示词token档位, 输出token档位)，提示词长度按序列化后的请求输入粗略估算"""
+        try:
+            input_chars = len(json_utils.dumps(asdict(request)))
+        except (TypeError, ValueError):
+            input_chars = 0
+        # 粗略按每2个字符1个token估算
+        return (
+            _round_up_to_bucket(input_chars // 2, PROMPT_TOKEN_BUCKETS),
+            cls._output_token_bucket(request)
+        )
+    
+    @staticmethod
+    def _output_token_bucket(request: ContentGenerationRequest) -> int:
+        """按平台字数上限和内容类型预估输出token数，向上取到 OUTPUT_TOKEN_BUCKETS 中的档位"""
+        optimization = PLATFORM_OPTIMIZATIONS.get(request.platform, PLATFORM_OPTIMIZATIONS["xhs"])
+        # 中文约每字1~2个token，另为标题和话题标签留出余量
+        estimate = optimization["max_chars"] * 2
+        if request.content_type in ("storytelling", "educational"):
+            estimate = estimate * 3 // 2
+        return _round_up_to_bucket(estimate, OUTPUT_TOKEN_BUCKETS)
+    
+    @staticmethod
+    def _pack_signature(request: ContentGenerationRequest) -> Optional[str]:
+        """除用户画像外的请求输入签名，无法序列化时返回None（不参与打包）"""
+        try:
+            return json_utils.dumps(
+                [request.content_type, request.topic, request.platform,
+                 request.requirements, request.brand_guidelines, request.constraints],
+                sort_keys=True
+            )
+        except (TypeError, ValueError):
+            return None
+    
+    async def _generate_pack(
+        self,
+        requests: List[ContentGenerationRequest]
+    ) -> List[Union[GeneratedContent, Exception]]:
+        """生成一包请求的内容，多个请求合并为一次LLM调用，合并调用失败时逐个生成"""
+        if len(requests) > 1:
+            try:
+                return await self._generate_packed(requests)
+            except Exception as e:
+                logger.warning(f"Packed generation of {len(requests)} requests failed, falling back to per-request calls: {e}")
+        
+        return list(await asyncio.gather(*(self._generate_with_limit(request) for request in requests)))
+    
+    async def _generate_packed(
+        self,
+        requests: List[ContentGenerationRequest]
+    ) -> List[GeneratedContent]:
+        """
+        多用户合并生成：共享同一份静态指令（系统提示词），在一条用户消息中列出各用户的输入，
+        要求模型按顺序返回JSON数组，减少网络往返和重复的前缀预填充
+        """
+        prompt_template = self._get_prompt_template(requests[0])
+        contexts = await asyncio.gather(*(self._get_user_context(r.user_profile) for r in requests))
+        built = [
+            self._build_generation_prompt(request, context_info, prompt_template)
+            for request, context_info in zip(requests, contexts)
+        ]
+        
+        packed_prompt = get_content_generator_prompt("multi_user_batch").format(
+            count=len(requests),
+            user_inputs="\n\n".join(f"### 用户{i}\n{prompt}" for i, (_, prompt) in enumerate(built, 1))
+        )
+        async with self._concurrency:
+            response = await self.llm_caller.call_llm(
+                packed_prompt,
+                built[0][0],
+                max_tokens=self._output_token_bucket(requests[0]) * len(requests)
+            )
+        
+        texts = self._parse_packed_response(response, len(requests))
+        contents = [
+            GeneratedContent(**self._finalize_fields(text, request))
+            for request, text in zip(requests, texts)
+        ]
+        logger.info(f"Generated {len(contents)} contents in one packed LLM call")
+        return contents
+    
+    @staticmethod
+    def _parse_packed_response(response: Optional[str], count: int) -> List[str]:
+        """解析合并生成的JSON数组为各用户的内容文本（标题在首行），格式不符时抛出ValueError"""
+        if not response:
+            raise ValueError("LLM returned no content")
+        
+        start, end = response.find("["), response.rfind("]")
+        if start < 0 or end < start:
+            raise ValueError("no JSON array in packed response")
+        items = json_utils.loads(response[start:end + 1])
+        if not isinstance(items, list) or len(items) != count:
+            raise ValueError(f"expected {count} items in packed response")
+        
+        texts = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get("content"), str):
+                raise ValueError("packed response item has no content")
+            title = str(item.get("title") or "").strip()
+            content = item["content"].strip()
+            texts.append(f"{title}\n{content}" if title and not content.startswith(title) else content)
+        return texts
+    
+    @staticmethod
+    def _request_key(request: ContentGenerationRequest) -> Union[bytes, int]:
+        """计算请求的内容哈希，无法序列化时退化为对象标识（不参与合并）"""
+        try:
+            payload = json_utils.dumps(asdict(request), sort_keys=True)
+        except (TypeError, ValueError):
+            return id(request)
+        return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+    
+    @staticmethod
+    def _clone_content(content: GeneratedContent) -> GeneratedContent:
+        """复制生成结果（含可变的列表和字典字段）并分配新的content_id"""
+        content_id = uuid.uuid4().hex
+        return replace(
+            content,
+            content_id=content_id,
+            hashtags=list(content.hashtags),
+            media_suggestions=dict(content.media_suggestions),
+            engagement_hooks=list(content.engagement_hooks),
+            platform_specific=dict(content.platform_specific),
+            metadata={**content.metadata, "request_id": content_id}
+        )
+    
+    async def _generate_with_limit(
+        self, 
+        request: ContentGenerationRequest
+    ) -> Union[GeneratedContent, Exception]:
+        """在并发限制内生成内容，限流时指数退避重试，异常作为结果返回"""
+        async with self._concurrency:
+            for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+                try:
+                    return await self.generate_content(request)
+                except Exception as e:
+                    if attempt < RATE_LIMIT_MAX_RETRIES and self._is_rate_limit_error(e):
+                        delay = RATE_LIMIT_BASE_DELAY * (2 ** attempt)
+                        logger.warning(f"Rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                        await asyncio.sleep(delay)
+                        continue
+                    return e
+    
+    @staticmethod
+    def _is_rate_limit_error(error: Exception) -> bool:
+        """判断异常是否为模型服务的限流错误"""
+        if getattr(error, "status_code", None) == 429:
+            return True
+        return "RateLimit" in type(error).__name__
+    
     async def _get_user_context(self, user_profile: Dict[str, Any]) -> Dict[str, Any]:
         """获取用户上下文信息用于内容个性化"""
         try:
@@ -129,12 +525,8 @@ class ContentGeneratorAgent:
             if not user_id:
                 return self._get_default_context()
             
-            # 使用LlamaIndex获取用户相关内容
-            semantic_results = await self.llamaindex_manager.query_user_content(
-                query=f"用户{user_id}的兴趣偏好和行为模式",
-                user_id=user_id,
-                top_k=5
-            )
+            # 使用LlamaIndex获取用户相关内容（带缓存）
+            semantic_results = await self._get_user_insights_cached(user_id)
             
             # 提取关键词和主题
             interests = user_profile.get('interests', [])
@@ -153,23 +545,88 @@ class ContentGeneratorAgent:
             logger.warning(f"Failed to get user context: {str(e)}")
             return self._get_default_context()
     
+    async def _get_user_insights_cached(self, user_id: str) -> Any:
+        """获取用户洞察，同一用户的并发请求只触发一次检索"""
+        cached = self._lookup_user_insights(user_id)
+        if cached is not None:
+            return cached
+        
+        lock = self._ctx_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            try:
+                # 等待锁期间其他请求可能已完成检索
+                cached = self._lookup_user_insights(user_id)
+                if cached is not None:
+                    return cached
+                
+                semantic_results = await self.llamaindex_manager.get_user_insights(user_id)
+                if "error" in semantic_results:
+                    # 查询失败不缓存，由调用方回退为默认上下文
+                    raise RuntimeError(semantic_results["error"])
+                
+                self._ctx_cache[user_id] = (time.monotonic(), semantic_results)
+                self._ctx_cache.move_to_end(user_id)
+                while len(self._ctx_cache) > USER_CONTEXT_CACHE_SIZE:
+                    self._ctx_cache.popitem(last=False)
+            finally:
+                # 锁只在检索进行中保留，成功、失败或缓存命中后都移除，已在等待的请求仍持有同一把锁
+                if self._ctx_locks.get(user_id) is lock:
+                    del self._ctx_locks[user_id]
+        
+        return self._copy_insights(semantic_results)
+    
+    def _lookup_user_insights(self, user_id: str) -> Optional[Any]:
+        """查询未过期的用户检索缓存"""
+        entry = self._ctx_cache.get(user_id)
+        if entry is None:
+            return None
+        
+        cached_at, semantic_results = entry
+        if time.monotonic() - cached_at >= USER_CONTEXT_CACHE_TTL:
+            del self._ctx_cache[user_id]
+            return None
+        
+        self._ctx_cache.move_to_end(user_id)
+        return self._copy_insights(semantic_results)
+    
+    @staticmethod
+    def _copy_insights(semantic_results: Any) -> Any:
+        """返回检索结果的浅拷贝，避免调用方修改缓存内容"""
+        if isinstance(semantic_results, (list, dict)):
+            return semantic_results.copy()
+        return semantic_results
+    
+    def _get_prompt_template(self, request: ContentGenerationRequest) -> PromptTemplate:
+        """获取请求内容类型对应的提示词模板"""
+        content_type_key = self.content_type_mapping.get(request.content_type, "creative_content_generation")
+        return get_content_generator_prompt(content_type_key)
+    
     def _build_generation_prompt(
         self, 
         request: ContentGenerationRequest, 
-        context_info: Dict[str, Any]
-    ) -> str:
-        """构建内容生成提示词"""
+        context_info: Dict[str, Any],
+        prompt_template: Optional[PromptTemplate] = None
+    ) -> Tuple[str, str]:
+        """
+        构建内容生成提示词，返回 (系统提示词, 用户提示词)
+        模板中的静态指令拆为系统提示词，作为所有请求共享的前缀 (Anthropic会标记cache_control)
+        """
         
         # 获取对应的提示词模板
-        content_type_key = self.content_type_mapping.get(request.content_type, "creative_content_generation")
-        prompt_template = get_content_generator_prompt(content_type_key)
+        if prompt_template is None:
+            prompt_template = self._get_prompt_template(request)
+        
+        # 用户画像和需求在多个变量中复用，只格式化一次
+        formatted_profile = self._format_user_profile(request.user_profile, context_info)
+        requirements_json = json_utils.dumps(request.requirements)
         
         # 构建变量映射
         variables = {
-            "target_audience_profile": self._format_user_profile(request.user_profile, context_info),
-            "content_requirements": json.dumps(request.requirements, ensure_ascii=False, indent=2),
-            "brand_tone_guidelines": json.dumps(request.brand_guidelines or {}, ensure_ascii=False, indent=2),
-            "creative_constraints": json.dumps(request.constraints or {}, ensure_ascii=False, indent=2)
+            "target_audience_profile": formatted_profile,
+            "content_requirements": requirements_json,
+            # 批次级的静态输入按键排序序列化，保证相同配置生成字节一致的提示词前缀
+            "brand_tone_guidelines": self._dumps_static_input(request.brand_guidelines),
+            "creative_constraints": self._dumps_static_input(request.constraints)
         }
         
         # 处理特定内容类型的额外变量
@@ -191,43 +648,62 @@ class ContentGeneratorAgent:
             variables.update({
                 "product_service_info": request.requirements.get('product_info', ''),
                 "sales_objectives": request.requirements.get('sales_goals', ''),
-                "target_customer_profile": self._format_user_profile(request.user_profile, context_info),
+                "target_customer_profile": formatted_profile,
                 "competitive_advantages": request.requirements.get('competitive_advantages', '')
             })
         else:
-            variables["content_requirements"] = f"主题: {request.topic}\n" + variables["content_requirements"]
+            variables["content_requirements"] = f"主题: {request.topic}\n{requirements_json}"
+        
+        # 平台字数限制写入提示词末尾，让模型自行控制篇幅，避免为截断部分付费
+        optimization = PLATFORM_OPTIMIZATIONS.get(request.platform, PLATFORM_OPTIMIZATIONS["xhs"])
+        platform_limits = (
+            f"\n\n平台限制：请将正文严格控制在{optimization['max_chars']}字以内，"
+            f"话题标签不超过{optimization['hashtag_limit']}个。"
+        )
         
-        return prompt_template.format(**variables)
+        system_prompt, prompt = prompt_template.format_split(**variables)
+        return system_prompt, prompt + platform_limits
+    
+    def _dumps_static_input(self, data: Optional[Dict[str, Any]]) -> str:
+        """序列化批次级静态输入，批次内共享的同一对象只序列化一次"""
+        if not data:
+            return "{}"
+        
+        key = id(data)
+        entry = self._json_cache.get(key)
+        # 同时保存对象引用，防止对象被回收后id被复用导致误命中
+        if entry is not None and entry[0] is data:
+            self._json_cache.move_to_end(key)
+            return entry[1]
+        
+        serialized = json_utils.dumps(data, sort_keys=True)
+        self._json_cache[key] = (data, serialized)
+        while len(self._json_cache) > STATIC_INPUT_CACHE_SIZE:
+            self._json_cache.popitem(last=False)
+        
+        return serialized
     
     def _format_user_profile(self, user_profile: Dict[str, Any], context_info: Dict[str, Any]) -> str:
         """格式化用户画像信息"""
-        profile_parts = []
-        
-        # 基本信息
-        if 'nickname' in user_profile:
-            profile_parts.append(f"用户昵称: {user_profile['nickname']}")
-        
-        # 兴趣偏好
         interests = context_info.get('interests', [])
-        if interests:
-            profile_parts.append(f"兴趣领域: {', '.join(interests)}")
-        
-        # 痛点需求
         pain_points = context_info.get('pain_points', [])
-        if pain_points:
-            profile_parts.append(f"主要痛点: {', '.join(pain_points)}")
-        
-        # 内容偏好
         content_prefs = context_info.get('content_preferences', {})
-        if content_prefs:
-            profile_parts.append(f"内容偏好: {json.dumps(content_prefs, ensure_ascii=False)}")
-        
-        # 参与模式
         engagement = context_info.get('engagement_patterns', {})
-        if engagement:
-            profile_parts.append(f"互动习惯: {json.dumps(engagement, ensure_ascii=False)}")
         
-        return "\n".join(profile_parts)
+        profile_parts = (
+            # 基本信息
+            f"用户昵称: {user_profile['nickname']}" if 'nickname' in user_profile else None,
+            # 兴趣偏好
+            f"兴趣领域: {', '.join(interests)}" if interests else None,
+            # 痛点需求
+            f"主要痛点: {', '.join(pain_points)}" if pain_points else None,
+            # 内容偏好
+            f"内容偏好: {json_utils.dumps(content_prefs)}" if content_prefs else None,
+            # 参与模式
+            f"互动习惯: {json_utils.dumps(engagement)}" if engagement else None,
+        )
+        
+        return "\n".join(part for part in profile_parts if part)
     
     def _parse_generated_content(
         self, 
@@ -235,10 +711,28 @@ class ContentGeneratorAgent:
         request: ContentGenerationRequest
     ) -> GeneratedContent:
         """解析LLM生成的内容"""
-        import uuid
-        
+        return GeneratedContent(**self._parse_generated_fields(llm_response, request))
+    
+    def _finalize_fields(
+        self, 
+        llm_response: str, 
+        request: ContentGenerationRequest
+    ) -> Dict[str, Any]:
+        """解析LLM输出并应用平台限制，返回GeneratedContent的字段字典"""
+        fields = self._parse_generated_fields(llm_response, request)
+        fields["main_content"], fields["hashtags"], fields["platform_specific"] = self._apply_platform_limits(
+            fields["main_content"], fields["hashtags"], request.platform
+        )
+        return fields
+    
+    def _parse_generated_fields(
+        self, 
+        llm_response: str, 
+        request: ContentGenerationRequest
+    ) -> Dict[str, Any]:
+        """解析LLM生成的内容为GeneratedContent的字段字典"""
         # 这里简化处理，实际应该解析结构化响应
-        content_id = str(uuid.uuid4())
+        content_id = uuid.uuid4().hex
         
         # 提取标题（假设在第一行）
         lines = llm_response.strip().split('\n')
@@ -256,74 +750,63 @@ class ContentGeneratorAgent:
             "generation_model": self.llm_caller.model_name
         }
         
-        return GeneratedContent(
-            content_id=content_id,
-            title=title,
-            main_content=llm_response,
-            hashtags=hashtags,
-            media_suggestions={},
-            engagement_hooks=[],
-            platform_specific={},
-            metadata=metadata,
-            generation_timestamp=datetime.now(),
-            ai_explanation="基于用户画像和上下文信息生成的个性化内容"
-        )
+        return {
+            "content_id": content_id,
+            "title": title,
+            "main_content": llm_response,
+            "hashtags": hashtags,
+            "media_suggestions": {},
+            "engagement_hooks": [],
+            "platform_specific": {},
+            "metadata": metadata,
+            "generation_timestamp": datetime.now(),
+            "ai_explanation": "基于用户画像和上下文信息生成的个性化内容"
+        }
     
     def _extract_hashtags(self, content: str) -> List[str]:
         """从内容中提取话题标签"""
-        import re
+        # 大部分输出不含'#'时跳过正则扫描
+        hashtags = _HASHTAG_RE.findall(content) if "#" in content else []
         
-        # 匹配中文和英文的话题标签
-        hashtags = re.findall(r'#([\u4e00-\u9fa5\w]+)', content)
-        
-        # 如果提取不到，生成默认标签
-        if not hashtags:
-            hashtags = ["内容分享", "生活记录", "今日分享"]
-        
-        return list(set(hashtags))[:10]  # 限制最多10个标签
+        # 按出现顺序去重（顺序稳定，便于下游提示词命中缓存），限制最多10个标签；
+        # 如果提取不到，使用默认标签
+        return list(dict.fromkeys(hashtags))[:10] or list(DEFAULT_HASHTAGS)
     
-    async def _optimize_for_platform(
+    def _optimize_for_platform(
         self, 
         content: GeneratedContent, 
         platform: str
     ) -> GeneratedContent:
         """针对特定平台优化内容"""
-        platform_optimizations = {
-            "xhs": {
-                "max_chars": 1000,
-                "hashtag_limit": 10,
-                "visual_priority": "high",
-                "tone": "friendly"
-            },
-            "weibo": {
-                "max_chars": 2000,
-                "hashtag_limit": 20,
-                "trending_focus": True,
-                "tone": "casual"
-            },
-            "douyin": {
-                "max_chars": 500,
-                "hashtag_limit": 5,
-                "video_first": True,
-                "tone": "entertaining"
-            }
-        }
-        
-        optimization = platform_optimizations.get(platform, platform_optimizations["xhs"])
+        content.main_content, content.hashtags, content.platform_specific = self._apply_platform_limits(
+            content.main_content, content.hashtags, platform
+        )
+        return content
+    
+    def _apply_platform_limits(
+        self, 
+        main_content: str, 
+        hashtags: List[str], 
+        platform: str
+    ) -> Tuple[str, List[str], Dict[str, Any]]:
+        """应用平台的字数和标签数量限制，返回 (正文, 标签, 平台特定字段)"""
+        optimization = PLATFORM_OPTIMIZATIONS.get(platform, PLATFORM_OPTIMIZATIONS["xhs"])
         
-        # 应用平台限制
+        # 字数限制已写入提示词，这里仅作为兜底，未超限时不做切片
         max_chars = optimization["max_chars"]
-        if len(content.main_content) > max_chars:
-            content.main_content = content.main_content[:max_chars-3] + "..."
+        if len(main_content) > max_chars:
+            logger.warning(
+                f"Generated content exceeds {platform} limit ({len(main_content)} > {max_chars} chars), truncating"
+            )
+            main_content = f"{main_content[:max_chars - 3]}..."
         
         # 限制标签数量
         max_hashtags = optimization["hashtag_limit"]
-        content.hashtags = content.hashtags[:max_hashtags]
+        if len(hashtags) > max_hashtags:
+            hashtags = hashtags[:max_hashtags]
         
         # 添加平台特定字段
-        content.platform_specific = optimization
-        
-        return content
+        return main_content, hashtags, dict(optimization)
     
     def _get_default_context(self) -> Dict[str, Any]:
         """获取默认上下文"""
@@ -0,0 +1,89 @@
+"""
+嵌入向量持久化缓存
+按 (嵌入模型名, 文本sha256) 在SQLite中保存嵌入向量，重建索引时内容未变的文档
+直接复用已有向量，只为新增或修改的文本请求嵌入接口
+"""
+
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """SQLite嵌入向量缓存，向量以float32原始字节存储"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        # 同一连接可能被线程池中的多个构建任务使用
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """首次使用时打开数据库并建表"""
+
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, digest))"
+            )
+        return self._conn
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """按顺序返回各文本的缓存向量，未命中的位置为None"""
+
+        digests = [self._digest(text) for text in texts]
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            # 分批查询，避免超出SQLite的参数个数上限
+            for start in range(0, len(digests), 500):
+                chunk = digests[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    conn.execute(
+                        f"SELECT digest, vector FROM embeddings "
+                        f"WHERE model = ? AND digest IN ({placeholders})",
+                        (model, *chunk),
+                    ).fetchall()
+                )
+
+        return [
+            np.frombuffer(found[digest], dtype=np.float32).tolist() if digest in found else None
+            for digest in digests
+        ]
+
+    def put_many(
+        self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]
+    ) -> None:
+        """写入文本对应的向量，已存在的条目直接覆盖"""
+
+        rows = [
+            (model, self._digest(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
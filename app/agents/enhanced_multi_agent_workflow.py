@@ -4,147 +4,350 @@
 包含StrategyCoordinatorAgent和ContentGeneratorAgent的完整集成
 """
 
-from typing import Dict, List, Any, Optional, TypedDict
-from dataclasses import dataclass
+from typing import Annotated, AsyncIterator, Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass, field, fields, is_dataclass
 from datetime import datetime
+from functools import cached_property
+from pathlib import Path
 import asyncio
-import json
+import base64
+import functools
+import operator
+import os
+import pickle
+import re
+import time
+import uuid
 
+from langgraph.cache.memory import InMemoryCache
 from langgraph.graph import StateGraph, END
+from langgraph.types import CachePolicy
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
 
 from app.agents.enhanced_user_analyst_agent import EnhancedUserAnalystAgent, EnhancedUserProfile
 from app.agents.content_generator_agent import ContentGeneratorAgent, ContentGenerationRequest, GeneratedContent
 from app.agents.strategy_coordinator_agent import StrategyCoordinatorAgent, StrategyObjective, StrategyType, ContentPlan
 from app.agents.llamaindex_manager import LlamaIndexManager
+from app.agents.llm_cache import LLMResponseCache
 from app.agents.llm_manager import AgentLLMCaller, ModelProvider
-from app.prompts.content_strategy_prompts import get_content_strategy_prompt
+from app.config.settings import settings
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
 
-@dataclass
+# 默认策略目标指标和目标用户筛选条件，每次运行都相同，在模块加载时构建一次
+_DEFAULT_TARGET_METRICS = {"engagement_rate": 0.05, "reach": 10000}
+_DEFAULT_USER_CRITERIA = {"min_engagement_rate": 0.03, "min_comment_count": 3}
+
+# 用户洞察缓存配置：同一用户在TTL内重复出现（跨运行或计划内重复）时不再重新检索
+USER_INSIGHT_CACHE_TTL = 600  # 秒
+USER_INSIGHT_CACHE_SIZE = 4096
+
+
+@dataclass(slots=True)
 class EnhancedAgentResult:
-    """增强版Agent执行结果"""
+    """增强版Agent执行结果 (slots数据类，每个阶段都会创建，省去实例__dict__)"""
     agent_name: str
     success: bool
     data: Any
     message: str
     llm_analysis: Optional[str]  # LLM分析结果
-    timestamp: datetime
     execution_time: float
+    created_at: float = field(default_factory=time.time)  # Unix时间戳，需要时再转换为datetime
+    
+    @property
+    def timestamp(self) -> datetime:
+        """结果生成时间"""
+        return datetime.fromtimestamp(self.created_at)
+
+
+@dataclass(slots=True)
+class EnhancedMultiAgentState:
+    """增强版Multi-Agent工作流状态 (slots数据类，节点以属性方式访问)"""
+    messages: List[BaseMessage] = field(default_factory=list)
+    current_task: str = ""
+    strategy_objective: Optional[StrategyObjective] = None
+    content_plan: Optional[ContentPlan] = None
+    target_users: List[EnhancedUserProfile] = field(default_factory=list)
+    generated_content: List[GeneratedContent] = field(default_factory=list)
+    # 并行分支会同时追加执行结果，使用累加reducer合并
+    agent_results: Annotated[List[EnhancedAgentResult], operator.add] = field(default_factory=list)
+    llm_insights: Dict[str, str] = field(default_factory=dict)  # 各阶段的LLM洞察
+    execution_context: Dict[str, Any] = field(default_factory=dict)  # 执行上下文
+    preferred_model: Optional[str] = None  # 首选模型
+    # 完成阶段统计的 (成功数, 失败数, 总执行时间)，供结果摘要和性能指标复用
+    agent_stats: Optional[Tuple[int, int, float]] = None
+
+
+class _PickleSerializer:
+    """进程内缓存使用pickle序列化，完整保留dataclass等自定义类型"""
+    
+    def dumps_typed(self, obj: Any):
+        return "pickle", pickle.dumps(obj)
+    
+    def loads_typed(self, data):
+        return pickle.loads(data[1])
+
+
+class SuccessOnlyNodeCache(InMemoryCache):
+    """节点结果缓存：只缓存执行成功的节点输出，失败结果（如LLM临时不可用）不写入，下次重新执行"""
+    
+    def __init__(self):
+        super().__init__(serde=_PickleSerializer())
+    
+    def set(self, keys) -> None:
+        for key, value in keys.items():
+            if not self._is_successful(value[0]):
+                continue
+            try:
+                super().set({key: value})
+            except Exception as e:
+                # 无法序列化的结果不缓存，不影响工作流本身
+                logger.debug(f"节点结果无法缓存，跳过: {e}")
+    
+    @staticmethod
+    def _is_successful(writes) -> bool:
+        return all(
+            result.success
+            for channel, value in writes if channel == "agent_results"
+            for result in value
+        )
+
+
+# 所有工作流实例共享的节点缓存，使相同输入的重复运行可以跳过已执行过的节点
+node_cache = SuccessOnlyNodeCache()
+
+
+# 检查点ID只允许字母、数字、下划线和连字符，避免拼接文件路径时越出检查点目录
+_WORKFLOW_ID_RE = re.compile(r"[\w-]+")
+
+
+class WorkflowCheckpoint:
+    """
+    工作流阶段检查点
+    每个阶段成功完成后向 <目录>/<workflow_id>.jsonl 追加一行（阶段名 + pickle编码的状态更新），
+    进程中断后以同一workflow_id重新执行时，已完成的阶段直接回放记录的输出，只执行剩余阶段
+    """
+    
+    def __init__(self, workflow_id: str, directory: str):
+        if not _WORKFLOW_ID_RE.fullmatch(workflow_id):
+            raise ValueError(f"无效的工作流ID: {workflow_id}")
+        self.workflow_id = workflow_id
+        self.path = Path(directory) / f"{workflow_id}.jsonl"
+        self.completed: Dict[str, Dict[str, Any]] = self._load()
+    
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """读取已完成阶段的输出，进程中断时写了一半的末行直接跳过"""
+        completed: Dict[str, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return completed
+        
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json_utils.loads(line)
+                    completed[entry["stage"]] = pickle.loads(base64.b64decode(entry["update"]))
+                except Exception as e:
+                    logger.warning(f"⚠️ 跳过无法解析的检查点记录: {e}")
+        return completed
+    
+    def record(self, stage: str, update: Dict[str, Any]) -> None:
+        """追加一个阶段的输出并落盘，无法序列化的输出不记录"""
+        try:
+            payload = base64.b64encode(pickle.dumps(update)).decode()
+        except Exception as e:
+            logger.debug(f"阶段输出无法写入检查点，跳过: {e}")
+            return
+        
+        line = json_utils.dumps({"stage": stage, "created_at": time.time(), "update": payload})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.completed[stage] = update
+    
+    def discard(self) -> None:
+        """删除检查点文件"""
+        self.path.unlink(missing_ok=True)
+
 
+def _profile_fields(user: Any) -> Dict[str, Any]:
+    """按字段浅拷贝用户画像，slots数据类没有实例__dict__，逐字段读取"""
+    if is_dataclass(user):
+        return {f.name: getattr(user, f.name) for f in fields(user)}
+    return dict(vars(user))
 
-class EnhancedMultiAgentState(TypedDict):
-    """增强版Multi-Agent工作流状态"""
-    messages: List[BaseMessage]
-    current_task: str
-    strategy_objective: Optional[StrategyObjective]
-    content_plan: Optional[ContentPlan]
-    target_users: List[EnhancedUserProfile]
-    generated_content: List[GeneratedContent]
-    agent_results: List[EnhancedAgentResult]
-    llm_insights: Dict[str, str]  # 各阶段的LLM洞察
-    execution_context: Dict[str, Any]  # 执行上下文
-    preferred_model: Optional[str]  # 首选模型
+
+def _update_succeeded(update: Dict[str, Any]) -> bool:
+    """阶段输出中的Agent结果是否全部成功"""
+    return all(result.success for result in update.get("agent_results", []))
+
+
+def _workflow_node(method_name: str, checkpointed: bool = True):
+    """
+    创建与实例无关的节点函数，运行时从config中取出工作流实例并调用其同名方法；
+    启用检查点时，已完成的阶段直接回放记录的输出，成功完成的阶段写入检查点
+    """
+    
+    async def node(state: EnhancedMultiAgentState, config: RunnableConfig) -> Dict[str, Any]:
+        workflow = config["configurable"]["workflow"]
+        checkpoint: Optional[WorkflowCheckpoint] = config["configurable"].get("checkpoint")
+        if checkpoint is None or not checkpointed:
+            return await getattr(workflow, method_name)(state)
+        
+        recorded = checkpoint.completed.get(method_name)
+        if recorded is not None:
+            logger.info(f"⏭️ 从检查点恢复已完成的阶段: {method_name}")
+            return recorded
+        
+        update = await getattr(workflow, method_name)(state)
+        if _update_succeeded(update):
+            await asyncio.to_thread(checkpoint.record, method_name, update)
+        return update
+    
+    node.__name__ = method_name
+    return node
+
+
+@functools.cache
+def get_compiled_graph():
+    """构建并编译增强版LangGraph工作流，进程内只编译一次"""
+    
+    # 创建状态图
+    workflow = StateGraph(EnhancedMultiAgentState)
+    
+    # 节点缓存策略：仅缓存结果只取决于上游输入的节点，按决定性输入字段生成缓存键；
+    # 策略执行节点有副作用，不缓存
+    cache_ttl = settings.WORKFLOW_NODE_CACHE_TTL
+    
+    def cache_policy(key_func) -> Optional[CachePolicy]:
+        if cache_ttl <= 0:
+            return None
+        return CachePolicy(
+            key_func=lambda state: f"{state.preferred_model or 'auto'}|{key_func(state)}",
+            ttl=cache_ttl
+        )
+    
+    def user_ids(users) -> str:
+        return ",".join(str(getattr(user, "user_id", user)) for user in users)
+    
+    # 添加节点
+    workflow.add_node("initialize_workflow", _workflow_node("_initialize_workflow"))
+    workflow.add_node(
+        "strategy_planning", _workflow_node("_strategy_planning"),
+        cache_policy=cache_policy(lambda state: repr(state.strategy_objective))
+    )
+    workflow.add_node(
+        "user_analysis", _workflow_node("_user_analysis"),
+        cache_policy=cache_policy(
+            lambda state: user_ids(state.content_plan.target_users) if state.content_plan else ""
+        )
+    )
+    workflow.add_node(
+        "content_generation", _workflow_node("_content_generation"),
+        cache_policy=cache_policy(lambda state: user_ids(state.target_users))
+    )
+    workflow.add_node("strategy_execution", _workflow_node("_strategy_execution"))
+    workflow.add_node("finalize_workflow", _workflow_node("_finalize_workflow", checkpointed=False))
+    
+    # 设置入口点
+    workflow.set_entry_point("initialize_workflow")
+    
+    # 添加边（工作流路径）
+    # 用户分析完成后分为两条互不依赖的分支，在同一超步中并行执行：
+    # 内容生成，以及 策略执行（仅依赖内容计划）；两者写入不同的状态字段，在收尾节点汇合
+    workflow.add_edge("initialize_workflow", "strategy_planning")
+    workflow.add_edge("strategy_planning", "user_analysis")
+    workflow.add_edge("user_analysis", "content_generation")
+    workflow.add_edge("user_analysis", "strategy_execution")
+    workflow.add_edge(["content_generation", "strategy_execution"], "finalize_workflow")
+    workflow.add_edge("finalize_workflow", END)
+    
+    # 编译图
+    return workflow.compile(cache=node_cache)
 
 
 class EnhancedMultiAgentWorkflow:
     """增强版Multi-Agent工作流引擎 - 集成所有Agent"""
     
     def __init__(self, preferred_model_provider: Optional[ModelProvider] = None):
-        self.graph = None
         self.strategy_coordinator = StrategyCoordinatorAgent(preferred_model_provider)
         self.user_analyst = EnhancedUserAnalystAgent(preferred_model_provider)
         self.content_generator = ContentGeneratorAgent(preferred_model_provider)
-        self.llamaindex_manager = LlamaIndexManager()
+        self.llamaindex_manager = LlamaIndexManager.instance()
         self.preferred_provider = preferred_model_provider
+        self._insight_cache = LLMResponseCache(USER_INSIGHT_CACHE_SIZE)
         
-        # 为各Agent创建专用LLM调用器
-        self.coordinator_llm = AgentLLMCaller("StrategyCoordinatorAgent", preferred_model_provider)
-        self.user_analyst_llm = AgentLLMCaller("UserAnalystAgent", preferred_model_provider)
-        self.content_generator_llm = AgentLLMCaller("ContentGeneratorAgent", preferred_model_provider)
-        
-        self._build_workflow()
-        
-    def _build_workflow(self):
-        """构建增强版LangGraph工作流"""
-        
-        # 创建状态图
-        workflow = StateGraph(EnhancedMultiAgentState)
-        
-        # 添加节点
-        workflow.add_node("initialize_workflow", self._initialize_workflow)
-        workflow.add_node("strategy_planning", self._strategy_planning)
-        workflow.add_node("user_analysis", self._user_analysis)
-        workflow.add_node("content_generation", self._content_generation)
-        workflow.add_node("strategy_execution", self._strategy_execution)
-        workflow.add_node("finalize_workflow", self._finalize_workflow)
-        
-        # 设置入口点
-        workflow.set_entry_point("initialize_workflow")
+        # 各Agent专用LLM调用器在首次使用时才构建，见下方cached_property
         
-        # 添加边（工作流路径）
-        workflow.add_edge("initialize_workflow", "strategy_planning")
-        workflow.add_edge("strategy_planning", "user_analysis")
-        workflow.add_edge("user_analysis", "content_generation")
-        workflow.add_edge("content_generation", "strategy_execution")
-        workflow.add_edge("strategy_execution", "finalize_workflow")
-        workflow.add_edge("finalize_workflow", END)
-        
-        # 编译图
-        self.graph = workflow.compile()
+        # 所有实例共享同一个预编译的图，节点在运行时通过config分派到当前实例
+        self.graph = get_compiled_graph()
+    
+    @cached_property
+    def coordinator_llm(self) -> AgentLLMCaller:
+        """策略协调LLM调用器，首次访问时构建"""
+        return AgentLLMCaller("StrategyCoordinatorAgent", self.preferred_provider)
+    
+    @cached_property
+    def user_analyst_llm(self) -> AgentLLMCaller:
+        """用户分析LLM调用器，首次访问时构建"""
+        return AgentLLMCaller("UserAnalystAgent", self.preferred_provider)
+    
+    @cached_property
+    def content_generator_llm(self) -> AgentLLMCaller:
+        """内容生成LLM调用器，首次访问时构建"""
+        return AgentLLMCaller("ContentGeneratorAgent", self.preferred_provider)
         
-    async def _initialize_workflow(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _initialize_workflow(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """初始化工作流"""
         logger.info("🚀 启动增强版Multi-Agent工作流")
         
-        start_time = datetime.now()
-        state["current_task"] = "workflow_initialization"
-        state["agent_results"] = []
-        state["llm_insights"] = {}
-        state["execution_context"] = {
-            "workflow_start_time": start_time,
-            "llm_provider": self.preferred_provider.value if self.preferred_provider else "auto"
-        }
-        
         # 设置默认策略目标
-        state["strategy_objective"] = StrategyObjective(
+        strategy_objective = StrategyObjective(
             objective_type=StrategyType.ENGAGEMENT,
-            target_metrics={"engagement_rate": 0.05, "reach": 10000},
+            target_metrics=dict(_DEFAULT_TARGET_METRICS),
             timeline_days=7,
             budget_limit=1000.0,
             target_audience_size=30
         )
         
-        state["messages"] = [
-            HumanMessage(content="启动增强版Multi-Agent工作流：策略制定 → 用户分析 → 内容生成 → 策略执行")
-        ]
-        
-        return state
+        return {
+            "current_task": "workflow_initialization",
+            "llm_insights": {},
+            "execution_context": {
+                "workflow_start_time": datetime.now(),
+                "llm_provider": self.preferred_provider.value if self.preferred_provider else "auto"
+            },
+            "strategy_objective": strategy_objective,
+            "messages": [
+                HumanMessage(content="启动增强版Multi-Agent工作流：策略制定 → 用户分析 → 内容生成 → 策略执行")
+            ]
+        }
     
-    async def _strategy_planning(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _strategy_planning(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """策略规划阶段"""
         logger.info("📋 执行策略规划阶段")
         
-        start_time = datetime.now()
-        state["current_task"] = "strategy_planning"
+        start_time = time.perf_counter()
+        update: Dict[str, Any] = {"current_task": "strategy_planning"}
         
         try:
-            strategy_objective = state["strategy_objective"]
+            strategy_objective = state.strategy_objective
             
             # 使用策略协调Agent创建内容计划
             content_plan = await self.strategy_coordinator.create_content_strategy(
                 strategy_objective,
                 {
-                    "min_engagement_rate": 0.03,
-                    "min_comment_count": 3,
+                    **_DEFAULT_USER_CRITERIA,
                     "limit": strategy_objective.target_audience_size
                 }
             )
             
-            state["content_plan"] = content_plan
+            update["content_plan"] = content_plan
             
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             
             result = EnhancedAgentResult(
                 agent_name="StrategyCoordinatorAgent",
@@ -152,15 +355,14 @@ class EnhancedMultiAgentWorkflow:
                 data=content_plan,
                 message=f"成功制定内容策略，包含{len(content_plan.target_users)}个目标用户",
                 llm_analysis=f"AI优化策略：基于{len(content_plan.target_users)}个用户画像制定个性化内容策略",
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
             
             logger.info(f"✅ 策略规划完成，识别{len(content_plan.target_users)}个目标用户")
             
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             logger.error(f"❌ 策略规划失败: {e}")
             result = EnhancedAgentResult(
                 agent_name="StrategyCoordinatorAgent",
@@ -168,34 +370,53 @@ class EnhancedMultiAgentWorkflow:
                 data=None,
                 message=f"策略规划失败: {str(e)}",
                 llm_analysis=None,
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
         
-        return state
+        return update
     
-    async def _user_analysis(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _user_analysis(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """用户分析阶段"""
         logger.info("👥 执行用户分析阶段")
         
-        start_time = datetime.now()
-        state["current_task"] = "user_analysis"
+        start_time = time.perf_counter()
+        update: Dict[str, Any] = {"current_task": "user_analysis"}
         
         try:
-            content_plan = state["content_plan"]
+            content_plan = state.content_plan
             target_users = content_plan.target_users
             
-            # 增强用户洞察
+            # 增强用户洞察：各用户之间互不依赖，限流并发获取，单个用户失败时跳过；
+            # 重复的用户只获取一次，近期获取过的用户直接读缓存
+            semaphore = asyncio.Semaphore(settings.USER_INSIGHT_CONCURRENCY)
+            
+            async def fetch_insights(user_id: str) -> EnhancedUserProfile:
+                cached = self._insight_cache.get(user_id)
+                if cached is not None:
+                    return cached
+                async with semaphore:
+                    user_insights = await self.user_analyst.get_user_insights(user_id)
+                self._insight_cache.set(user_id, user_insights, USER_INSIGHT_CACHE_TTL)
+                return user_insights
+            
+            unique_ids = list(dict.fromkeys(user.user_id for user in target_users))
+            insights = await asyncio.gather(
+                *(fetch_insights(user_id) for user_id in unique_ids),
+                return_exceptions=True
+            )
+            insights_by_id = dict(zip(unique_ids, insights))
             enhanced_users = []
             for user in target_users:
-                # 使用增强版用户分析获取更深入的洞察
-                user_insights = await self.user_analyst.get_user_insights(user.user_id)
+                user_insights = insights_by_id[user.user_id]
+                if isinstance(user_insights, Exception):
+                    logger.warning(f"⚠️ 获取用户 {user.user_id} 洞察失败，已跳过: {user_insights}")
+                    continue
                 enhanced_users.append(user_insights)
             
-            state["target_users"] = enhanced_users
+            update["target_users"] = enhanced_users
             
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             
             result = EnhancedAgentResult(
                 agent_name="EnhancedUserAnalystAgent",
@@ -203,15 +424,14 @@ class EnhancedMultiAgentWorkflow:
                 data=enhanced_users,
                 message=f"成功分析{len(enhanced_users)}个高价值用户",
                 llm_analysis=f"AI洞察：识别用户行为模式和内容偏好",
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
             
             logger.info(f"✅ 用户分析完成，分析{len(enhanced_users)}个用户")
             
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             logger.error(f"❌ 用户分析失败: {e}")
             result = EnhancedAgentResult(
                 agent_name="EnhancedUserAnalystAgent",
@@ -219,29 +439,29 @@ class EnhancedMultiAgentWorkflow:
                 data=None,
                 message=f"用户分析失败: {str(e)}",
                 llm_analysis=None,
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
         
-        return state
+        return update
     
-    async def _content_generation(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _content_generation(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """内容生成阶段"""
         logger.info("✍️ 执行内容生成阶段")
         
-        start_time = datetime.now()
-        state["current_task"] = "content_generation"
+        start_time = time.perf_counter()
+        update: Dict[str, Any] = {"current_task": "content_generation"}
         
         try:
-            target_users = state["target_users"]
-            content_plan = state["content_plan"]
+            target_users = state.target_users
+            content_plan = state.content_plan
             
             # 为每个用户生成个性化内容
+            # 内容生成只读取画像字段，按字段浅拷贝即可，无需asdict逐层递归深拷贝
             content_requests = []
             for user in target_users:
                 request = ContentGenerationRequest(
-                    user_profile=asdict(user),
+                    user_profile=_profile_fields(user),
                     content_type="creative",
                     topic="个性化UGC内容",
                     platform="xhs",
@@ -256,9 +476,9 @@ class EnhancedMultiAgentWorkflow:
             # 批量生成内容
             generated_content = await self.content_generator.generate_content_batch(content_requests)
             
-            state["generated_content"] = generated_content
+            update["generated_content"] = generated_content
             
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             
             result = EnhancedAgentResult(
                 agent_name="ContentGeneratorAgent",
@@ -266,15 +486,14 @@ class EnhancedMultiAgentWorkflow:
                 data=generated_content,
                 message=f"成功生成{len(generated_content)}个个性化内容",
                 llm_analysis=f"AI创意：为{len(target_users)}个用户生成个性化内容",
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
             
             logger.info(f"✅ 内容生成完成，生成{len(generated_content)}个内容")
             
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             logger.error(f"❌ 内容生成失败: {e}")
             result = EnhancedAgentResult(
                 agent_name="ContentGeneratorAgent",
@@ -282,23 +501,22 @@ class EnhancedMultiAgentWorkflow:
                 data=None,
                 message=f"内容生成失败: {str(e)}",
                 llm_analysis=None,
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
         
-        return state
+        return update
     
-    async def _strategy_execution(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _strategy_execution(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """策略执行阶段"""
         logger.info("🎯 执行策略执行阶段")
         
-        start_time = datetime.now()
-        state["current_task"] = "strategy_execution"
+        start_time = time.perf_counter()
+        # 与内容生成分支并行运行，不写入current_task以免并发更新冲突
+        update: Dict[str, Any] = {}
         
         try:
-            content_plan = state["content_plan"]
-            generated_content = state["generated_content"]
+            content_plan = state.content_plan
             
             # 执行内容计划
             execution_result = await self.strategy_coordinator.execute_content_plan(content_plan)
@@ -307,7 +525,7 @@ class EnhancedMultiAgentWorkflow:
             actual_metrics = execution_result.actual_metrics
             success_indicators = execution_result.success_indicators
             
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             
             result = EnhancedAgentResult(
                 agent_name="StrategyCoordinatorAgent",
@@ -319,15 +537,14 @@ class EnhancedMultiAgentWorkflow:
                 },
                 message=f"策略执行完成，成功率{sum(success_indicators.values())/len(success_indicators)*100:.1f}%",
                 llm_analysis=f"AI优化：基于实际结果生成{len(execution_result.optimization_suggestions)}个优化建议",
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
             
             logger.info("✅ 策略执行完成")
             
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
+            execution_time = time.perf_counter() - start_time
             logger.error(f"❌ 策略执行失败: {e}")
             result = EnhancedAgentResult(
                 agent_name="StrategyCoordinatorAgent",
@@ -335,108 +552,154 @@ class EnhancedMultiAgentWorkflow:
                 data=None,
                 message=f"策略执行失败: {str(e)}",
                 llm_analysis=None,
-                timestamp=datetime.now(),
                 execution_time=execution_time
             )
-            state["agent_results"].append(result)
+            update["agent_results"] = [result]
         
-        return state
+        return update
     
-    async def _finalize_workflow(self, state: EnhancedMultiAgentState) -> EnhancedMultiAgentState:
+    async def _finalize_workflow(self, state: EnhancedMultiAgentState) -> Dict[str, Any]:
         """工作流完成阶段"""
         logger.info("📊 生成最终执行报告")
         
-        state["current_task"] = "workflow_finalization"
-        
-        # 统计结果
-        results = state["agent_results"]
-        successful_agents = [r for r in results if r.success]
-        failed_agents = [r for r in results if not r.success]
-        
-        # 计算性能指标
-        total_execution_time = sum(r.execution_time for r in results)
+        # 单次遍历统计成败数和总耗时，同时收集Agent详细结果片段
+        results = state.agent_results
+        successful_count = 0
+        total_execution_time = 0.0
+        details: List[str] = []
+        for result in results:
+            total_execution_time += result.execution_time
+            if result.success:
+                successful_count += 1
+                details.append(f"✅ {result.agent_name}: {result.message}\n")
+            else:
+                details.append(f"❌ {result.agent_name}: {result.message}\n")
+            if result.llm_analysis:
+                details.append(f"   💡 AI洞察: {result.llm_analysis[:100]}...\n")
+        failed_count = len(results) - successful_count
         avg_execution_time = total_execution_time / len(results) if results else 0
         
-        final_report = f"""
+        # 报告各片段收集到列表中，最后一次性拼接
+        parts = [f"""
 🎉 增强版Multi-Agent工作流执行完成！
 
 📈 执行统计:
-✅ 成功的Agent: {len(successful_agents)}
-❌ 失败的Agent: {len(failed_agents)}
+✅ 成功的Agent: {successful_count}
+❌ 失败的Agent: {failed_count}
 ⏱️  总执行时间: {total_execution_time:.2f}秒
 ⏱️  平均执行时间: {avg_execution_time:.2f}秒
 
 🎯 工作流成果:
-"""
+"""]
         
         # 添加具体成果
-        if state.get("content_plan"):
-            plan = state["content_plan"]
-            final_report += f"📋 内容计划: 针对{len(plan.target_users)}个用户制定策略\n"
+        if state.content_plan:
+            plan = state.content_plan
+            parts.append(f"📋 内容计划: 针对{len(plan.target_users)}个用户制定策略\n")
         
-        if state.get("generated_content"):
-            content = state["generated_content"]
-            final_report += f"✍️  生成内容: {len(content)}个个性化内容\n"
+        if state.generated_content:
+            content = state.generated_content
+            parts.append(f"✍️  生成内容: {len(content)}个个性化内容\n")
         
-        if state.get("target_users"):
-            users = state["target_users"]
-            final_report += f"👥 目标用户: 分析{len(users)}个高价值用户\n"
+        if state.target_users:
+            users = state.target_users
+            parts.append(f"👥 目标用户: 分析{len(users)}个高价值用户\n")
         
         # 添加Agent详细结果
-        final_report += "\n📊 Agent执行详情:\n"
-        for result in results:
-            status = "✅" if result.success else "❌"
-            final_report += f"{status} {result.agent_name}: {result.message}\n"
-            if result.llm_analysis:
-                final_report += f"   💡 AI洞察: {result.llm_analysis[:100]}...\n"
+        parts.append("\n📊 Agent执行详情:\n")
+        parts.extend(details)
         
-        state["messages"].append(AIMessage(content=final_report))
+        final_report = "".join(parts)
         
         logger.info("🎉 增强版Multi-Agent工作流完成")
-        return state
+        return {
+            "current_task": "workflow_finalization",
+            "messages": state.messages + [AIMessage(content=final_report)],
+            "agent_stats": (successful_count, failed_count, total_execution_time)
+        }
     
     async def execute_complete_workflow(
         self, 
-        initial_input: Optional[Dict[str, Any]] = None
+        initial_input: Optional[Dict[str, Any]] = None,
+        resume_from: Optional[str] = None
     ) -> Dict[str, Any]:
-        """执行完整的增强版Multi-Agent工作流"""
+        """执行完整的增强版Multi-Agent工作流，消费流式事件直到得到最终结果"""
+        
+        async for event in self.execute_complete_workflow_stream(initial_input, resume_from):
+            if event["event"] == "completed":
+                return event["result"]
+            if event["event"] == "failed":
+                return {
+                    "success": False,
+                    "workflow_completed": False,
+                    "workflow_id": event["workflow_id"],
+                    "error": event["error"],
+                    "execution_summary": f"工作流执行失败: {event['error']}"
+                }
+        
+        raise RuntimeError("工作流未产出最终结果")
+    
+    async def execute_complete_workflow_stream(
+        self, 
+        initial_input: Optional[Dict[str, Any]] = None,
+        resume_from: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式执行增强版Multi-Agent工作流，每个阶段完成时立即产出其结果
+        
+        Args:
+            initial_input: 自定义输入（如策略目标）
+            resume_from: 之前运行返回的workflow_id，传入时跳过检查点中已成功完成的阶段
+        
+        依次产出事件:
+        - {"event": "stage", "stage": str, "update": Dict}: 某个阶段节点完成时，update为其写入的状态
+        - {"event": "completed", "result": Dict}: 工作流结束时，result与非流式接口的返回值相同
+        - {"event": "failed", "workflow_id": str, "error": str}: 工作流执行失败时
+        """
         
         if not self.graph:
             raise ValueError("工作流图未初始化")
         
-        # 初始化状态
-        initial_state = EnhancedMultiAgentState(
-            messages=[],
-            current_task="",
-            strategy_objective=None,
-            content_plan=None,
-            target_users=[],
-            generated_content=[],
-            agent_results=[],
-            llm_insights={},
-            execution_context={},
-            preferred_model=self.preferred_provider.value if self.preferred_provider else None
-        )
-        
-        # 自定义策略目标
-        if initial_input and "strategy_objective" in initial_input:
-            strategy_data = initial_input["strategy_objective"]
-            initial_state["strategy_objective"] = StrategyObjective(
-                objective_type=StrategyType(strategy_data.get("type", "engagement")),
-                target_metrics=strategy_data.get("metrics", {"engagement_rate": 0.05}),
-                timeline_days=strategy_data.get("timeline", 7),
-                budget_limit=strategy_data.get("budget", 1000.0),
-                target_audience_size=strategy_data.get("audience_size", 30)
-            )
+        initial_state = self._build_initial_state(initial_input)
+        workflow_id = resume_from or uuid.uuid4().hex
+        configurable: Dict[str, Any] = {"workflow": self}
         
         try:
+            # 未启用检查点时无法恢复，直接失败，避免把调用方传入的ID当作新工作流重新执行全部阶段
+            if resume_from is not None and not settings.WORKFLOW_CHECKPOINT_DIR:
+                raise ValueError("未配置WORKFLOW_CHECKPOINT_DIR，无法从检查点恢复工作流")
+            
+            # 配置了检查点目录时按阶段落盘，中断后可用workflow_id从未完成的阶段继续
+            checkpoint = None
+            if settings.WORKFLOW_CHECKPOINT_DIR:
+                checkpoint = WorkflowCheckpoint(workflow_id, settings.WORKFLOW_CHECKPOINT_DIR)
+                configurable["checkpoint"] = checkpoint
+                if checkpoint.completed:
+                    logger.info(f"♻️ 从检查点恢复工作流 {workflow_id}，已完成{len(checkpoint.completed)}个阶段")
+            
             logger.info("🚀 开始执行增强版Multi-Agent工作流")
-            final_state = await self.graph.ainvoke(initial_state)
+            final_state: Dict[str, Any] = {}
+            async for mode, chunk in self.graph.astream(
+                initial_state,
+                config={"configurable": configurable},
+                stream_mode=["updates", "values"]
+            ):
+                if mode == "values":
+                    final_state = chunk
+                    continue
+                for stage, update in chunk.items():
+                    if not stage.startswith("__"):
+                        yield {"event": "stage", "stage": stage, "update": update}
+            
+            # 全部阶段成功时不再需要检查点；有阶段失败时保留，重新执行只需重跑失败的阶段
+            if checkpoint is not None and _update_succeeded(final_state):
+                checkpoint.discard()
             
             # 整理返回结果
-            return {
+            yield {"event": "completed", "result": {
                 "success": True,
                 "workflow_completed": True,
+                "workflow_id": workflow_id,
                 "final_state": final_state,
                 "agent_results": final_state.get("agent_results", []),
                 "content_plan": final_state.get("content_plan"),
@@ -445,24 +708,55 @@ class EnhancedMultiAgentWorkflow:
                 "messages": [msg.content for msg in final_state.get("messages", [])],
                 "execution_summary": self._generate_execution_summary(final_state),
                 "performance_metrics": self._generate_performance_metrics(final_state)
-            }
+            }}
             
         except Exception as e:
             logger.error(f"❌ 增强版Multi-Agent工作流执行失败: {e}")
-            return {
-                "success": False,
-                "workflow_completed": False,
-                "error": str(e),
-                "execution_summary": f"工作流执行失败: {str(e)}"
-            }
-    
-    def _generate_execution_summary(self, final_state: EnhancedMultiAgentState) -> str:
-        """生成执行摘要"""
+            yield {"event": "failed", "workflow_id": workflow_id, "error": str(e)}
+    
+    def _build_initial_state(
+        self, 
+        initial_input: Optional[Dict[str, Any]]
+    ) -> EnhancedMultiAgentState:
+        """根据输入构建初始状态"""
+        
+        initial_state = EnhancedMultiAgentState(
+            preferred_model=self.preferred_provider.value if self.preferred_provider else None
+        )
+        
+        # 自定义策略目标
+        if initial_input and "strategy_objective" in initial_input:
+            strategy_data = initial_input["strategy_objective"]
+            initial_state.strategy_objective = StrategyObjective(
+                objective_type=StrategyType(strategy_data.get("type", "engagement")),
+                target_metrics=strategy_data.get("metrics", {"engagement_rate": 0.05}),
+                timeline_days=strategy_data.get("timeline", 7),
+                budget_limit=strategy_data.get("budget", 1000.0),
+                target_audience_size=strategy_data.get("audience_size", 30)
+            )
+        
+        return initial_state
+    
+    @staticmethod
+    def _agent_stats(final_state: Dict[str, Any]) -> Tuple[int, int, float]:
+        """读取完成阶段统计的 (成功数, 失败数, 总执行时间)，未经过完成阶段时单次遍历统计"""
+        stats = final_state.get("agent_stats")
+        if stats is not None:
+            return stats
+        
+        successful = 0
+        total_execution_time = 0.0
         results = final_state.get("agent_results", [])
-        successful = len([r for r in results if r.success])
-        total = len(results)
+        for result in results:
+            total_execution_time += result.execution_time
+            successful += result.success
+        return successful, len(results) - successful, total_execution_time
+    
+    def _generate_execution_summary(self, final_state: Dict[str, Any]) -> str:
+        """生成执行摘要"""
+        successful, failed, _ = self._agent_stats(final_state)
         
-        summary = f"增强版Multi-Agent工作流完成：{successful}/{total} 个Agent成功执行"
+        summary = f"增强版Multi-Agent工作流完成：{successful}/{successful + failed} 个Agent成功执行"
         
         if final_state.get("content_plan"):
             plan = final_state["content_plan"]
@@ -474,17 +768,20 @@ class EnhancedMultiAgentWorkflow:
         
         return summary
     
-    def _generate_performance_metrics(self, final_state: EnhancedMultiAgentState) -> Dict[str, Any]:
+    def _generate_performance_metrics(self, final_state: Dict[str, Any]) -> Dict[str, Any]:
         """生成性能指标"""
-        results = final_state.get("agent_results", [])
+        successful, failed, total_execution_time = self._agent_stats(final_state)
         
         return {
-            "total_agents": len(results),
-            "successful_agents": len([r for r in results if r.success]),
-            "failed_agents": len([r for r in results if not r.success]),
+            "total_agents": successful + failed,
+            "successful_agents": successful,
+            "failed_agents": failed,
             "target_users": len(final_state.get("target_users", [])),
             "generated_content": len(final_state.get("generated_content", [])),
-            "total_execution_time": sum(r.execution_time for r in results)
+            "total_execution_time": total_execution_time,
+            # 内容生成结果缓存的累计命中/未命中次数
+            "content_cache_hits": self.content_generator.content_cache_hits,
+            "content_cache_misses": self.content_generator.content_cache_misses
         }
 
 
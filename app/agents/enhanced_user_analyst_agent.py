@@ -3,10 +3,14 @@
 集成LlamaIndex智能检索功能，提供更深度的用户洞察分析
 """
 
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
 from datetime import datetime
+from contextlib import aclosing
 import asyncio
+import io
+
+import numpy as np
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, desc
@@ -14,16 +18,32 @@ from sqlalchemy.orm import selectinload
 
 from app.agents.user_analyst_agent import UserAnalystAgent, UserProfile, AnalysisResult
 from app.agents.llamaindex_manager import LlamaIndexManager
+from app.agents.llm_cache import semantic_cached
 from app.agents.llm_manager import AgentLLMCaller, ModelProvider
 from app.prompts.user_analyst_prompts import get_user_analyst_prompt
+from app.config.settings import settings
 from app.infra.models.llm_models import LlmCommentAnalysis
 from app.infra.models.comment_models import XhsComment
 from app.utils.logger import app_logger as logger
 
 
-@dataclass
+# 单个用户AI洞察保留的最大字符数
+USER_INSIGHT_MAX_CHARS = 500
+
+# 多个用户合并生成AI洞察时的分析要求
+USER_INSIGHT_BATCH_CRITERIA = (
+    "基于语义搜索的用户行为分析，生成单个用户的深度AI洞察："
+    "用户画像、价值潜力、需求洞察和营销策略建议，"
+    f"每位用户不超过{USER_INSIGHT_MAX_CHARS}字"
+)
+
+# 批量离线增强时每轮处理的用户数，限制单轮检索矩阵和待写回画像的内存
+BULK_ENHANCE_CHUNK_SIZE = 200
+
+
+@dataclass(slots=True)
 class EnhancedUserProfile(UserProfile):
-    """增强版用户画像 - 包含LlamaIndex检索结果"""
+    """增强版用户画像 - 包含LlamaIndex检索结果 (与UserProfile同为slots数据类)"""
     semantic_search_results: List[Dict[str, Any]]
     related_content_summary: str
     ai_insights: str
@@ -44,11 +64,9 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
     def __init__(self, preferred_model_provider: Optional[ModelProvider] = None):
         super().__init__()
         self.name = "EnhancedUserAnalystAgent"
-        self.llamaindex_manager = LlamaIndexManager()
+        # 共享进程级索引管理器，已有索引只在首次获取时加载一次
+        self.llamaindex_manager = LlamaIndexManager.instance()
         self.llm_caller = AgentLLMCaller(self.name, preferred_model_provider)
-        
-        # 尝试加载已有索引
-        self.llamaindex_manager.load_existing_indexes()
     
     async def execute_enhanced_analysis(
         self, 
@@ -66,18 +84,20 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             EnhancedAnalysisResult: 增强版分析结果
         """
         start_time = datetime.now()
+        # 本次分析各阶段结果共用同一个时间戳
+        analysis_timestamp = start_time.isoformat()
         
         # 执行基础用户分析
         logger.info("🔍 执行基础用户分析...")
         basic_result = await self.execute(db_session, criteria)
         
-        # 执行语义检索增强
-        logger.info("🧠 执行语义检索增强...")
-        semantic_insights = await self._perform_semantic_analysis(basic_result, criteria)
-        
-        # 执行内容分析
-        logger.info("📝 执行用户内容分析...")
-        content_analysis = await self._perform_content_analysis(basic_result.high_value_users)
+        # 语义检索增强、用户内容分析和用户画像增强都只依赖基础分析结果，且不访问数据库会话，并发执行
+        logger.info("🧠 并发执行语义检索增强、用户内容分析和用户画像增强...")
+        semantic_insights, content_analysis, enhanced_users = await asyncio.gather(
+            self._perform_semantic_analysis(basic_result, criteria, analysis_timestamp),
+            self._perform_content_analysis(basic_result.high_value_users, analysis_timestamp),
+            self._enhance_user_profiles(db_session, basic_result.high_value_users)
+        )
         
         # 生成检索摘要
         logger.info("📊 生成智能分析摘要...")
@@ -85,11 +105,6 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             semantic_insights, content_analysis, basic_result
         )
         
-        # 增强用户画像
-        enhanced_users = await self._enhance_user_profiles(
-            db_session, basic_result.high_value_users
-        )
-        
         # 构建增强版结果
         enhanced_result = EnhancedAnalysisResult(
             high_value_users=enhanced_users,
@@ -104,10 +119,43 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
         logger.info(f"✅ 增强版用户分析完成，处理了 {len(enhanced_users)} 个用户")
         return enhanced_result
     
+    async def execute_enhanced_analysis_bulk(
+        self,
+        db_session: AsyncSession,
+        user_ids: List[str]
+    ) -> List[EnhancedUserProfile]:
+        """
+        离线批量增强指定用户的画像，适用于一次处理成千上万用户的任务
+        按BULK_ENHANCE_CHUNK_SIZE分轮处理，每轮复用批量检索和合并的AI洞察生成，
+        结果按user_ids顺序返回，没有分析数据的用户会被跳过
+        """
+        
+        unique_ids = list(dict.fromkeys(user_ids))
+        logger.info(f"📦 开始批量增强 {len(unique_ids)} 个用户画像")
+        
+        enhanced_by_id: Dict[str, EnhancedUserProfile] = {}
+        for start in range(0, len(unique_ids), BULK_ENHANCE_CHUNK_SIZE):
+            chunk_ids = unique_ids[start:start + BULK_ENHANCE_CHUNK_SIZE]
+            
+            result = await db_session.execute(
+                select(LlmCommentAnalysis)
+                .where(LlmCommentAnalysis.comment_user_id.in_(chunk_ids))
+                .order_by(desc(LlmCommentAnalysis.created_at))
+            )
+            basic_users = await self._enrich_user_profiles(db_session, result.scalars().all())
+            
+            for enhanced_user in await self._enhance_user_profiles(db_session, basic_users):
+                enhanced_by_id[enhanced_user.user_id] = enhanced_user
+            
+            logger.info(f"📦 批量增强进度: {min(start + BULK_ENHANCE_CHUNK_SIZE, len(unique_ids))}/{len(unique_ids)}")
+        
+        return [enhanced_by_id[user_id] for user_id in unique_ids if user_id in enhanced_by_id]
+    
     async def _perform_semantic_analysis(
         self, 
         basic_result: AnalysisResult, 
-        criteria: Optional[Dict[str, Any]]
+        criteria: Optional[Dict[str, Any]],
+        analysis_timestamp: str
     ) -> Dict[str, Any]:
         """执行语义分析"""
         
@@ -115,23 +163,24 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             # 构建语义搜索查询
             search_queries = self._build_semantic_queries(criteria)
             
-            semantic_results = {}
+            # 所有查询一次批量检索，查询向量通过一次嵌入请求计算
+            all_search_results = await self.llamaindex_manager.semantic_search_batch(
+                list(search_queries.values()),
+                index_type="all",
+                top_k=5,
+                similarity_threshold=0.6
+            )
             
-            for query_name, query_text in search_queries.items():
-                logger.info(f"执行语义搜索: {query_name}")
-                
-                search_results = await self.llamaindex_manager.semantic_search(
-                    query=query_text,
-                    index_type="all",
-                    top_k=5,
-                    similarity_threshold=0.6
-                )
-                
-                semantic_results[query_name] = {
+            semantic_results = {
+                query_name: {
                     "query": query_text,
                     "results": search_results,
                     "result_count": len(search_results)
                 }
+                for (query_name, query_text), search_results in zip(
+                    search_queries.items(), all_search_results
+                )
+            }
             
             # 生成语义洞察摘要
             insights_summary = await self._generate_semantic_insights_summary(semantic_results)
@@ -140,7 +189,7 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                 "search_results": semantic_results,
                 "insights_summary": insights_summary,
                 "total_queries": len(search_queries),
-                "execution_time": datetime.now().isoformat()
+                "execution_time": analysis_timestamp
             }
             
         except Exception as e:
@@ -200,7 +249,7 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                 comment_sentiment_data="多维度语义搜索结果"
             )
             
-            insights = await self.llm_caller.analyze_users(
+            insights = await self.llm_caller.summarize_users(
                 analysis_prompt, 
                 "生成基于语义搜索结果的用户洞察摘要"
             )
@@ -213,7 +262,8 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
     
     async def _perform_content_analysis(
         self, 
-        high_value_users: List[UserProfile]
+        high_value_users: List[UserProfile],
+        analysis_timestamp: str
     ) -> Dict[str, Any]:
         """执行用户内容分析"""
         
@@ -223,13 +273,14 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             
             content_insights = {}
             
-            # 分析前几个高价值用户的内容
-            for i, user in enumerate(high_value_users[:5], 1):
-                logger.info(f"分析用户 {user.user_id} 的内容...")
-                
-                # 使用LlamaIndex获取用户详细洞察
-                user_insights = await self.llamaindex_manager.get_user_insights(user.user_id)
-                
+            # 分析前几个高价值用户的内容，使用LlamaIndex一次批量获取各用户详细洞察
+            top_users = high_value_users[:5]
+            all_user_insights = await self.llamaindex_manager.get_user_insights_batch(
+                [user.user_id for user in top_users]
+            )
+            
+            for i, user in enumerate(top_users, 1):
+                user_insights = all_user_insights[user.user_id]
                 if "error" not in user_insights:
                     content_insights[f"user_{i}"] = {
                         "user_id": user.user_id,
@@ -245,7 +296,7 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                 "individual_insights": content_insights,
                 "overall_analysis": overall_analysis,
                 "analyzed_users_count": len(content_insights),
-                "analysis_timestamp": datetime.now().isoformat()
+                "analysis_timestamp": analysis_timestamp
             }
             
         except Exception as e:
@@ -256,26 +307,26 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
         """总结用户内容"""
         
         try:
-            summary_parts = []
+            get = user_insights.get
             
             # 总结数据量
-            summary_parts.append(f"总记录: {user_insights.get('total_records', 0)}")
-            summary_parts.append(f"评论: {user_insights.get('comments_count', 0)}")
-            summary_parts.append(f"笔记: {user_insights.get('notes_count', 0)}")
-            summary_parts.append(f"分析: {user_insights.get('analyses_count', 0)}")
+            summary = (
+                f"总记录: {get('total_records', 0)} | 评论: {get('comments_count', 0)} | "
+                f"笔记: {get('notes_count', 0)} | 分析: {get('analyses_count', 0)}"
+            )
             
             # 添加关键洞察
-            if user_insights.get('analyses'):
-                analyses = user_insights['analyses']
-                if analyses:
-                    first_analysis = analyses[0]
-                    metadata = first_analysis.get('metadata', {})
-                    if metadata.get('emotional_preference'):
-                        summary_parts.append(f"情感倾向: {metadata['emotional_preference']}")
-                    if metadata.get('unmet_preference'):
-                        summary_parts.append(f"未满足需求: {metadata['unmet_preference']}")
-            
-            return " | ".join(summary_parts)
+            analyses = get('analyses')
+            if analyses:
+                metadata = analyses[0].get('metadata', {})
+                emotional_preference = metadata.get('emotional_preference')
+                unmet_preference = metadata.get('unmet_preference')
+                if emotional_preference:
+                    summary += f" | 情感倾向: {emotional_preference}"
+                if unmet_preference:
+                    summary += f" | 未满足需求: {unmet_preference}"
+            
+            return summary
             
         except Exception as e:
             logger.error(f"用户内容总结失败: {e}")
@@ -310,7 +361,7 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                 user_feedback_data="用户评论和分析数据"
             )
             
-            analysis = await self.llm_caller.analyze_users(
+            analysis = await self.llm_caller.summarize_users(
                 analysis_prompt,
                 "基于用户内容数据生成深度分析报告"
             )
@@ -362,28 +413,31 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
     ) -> List[EnhancedUserProfile]:
         """增强用户画像"""
         
-        enhanced_users = []
+        # 所有用户的语义搜索一次批量完成，检索失败时各用户按无结果处理
+        user_queries = [f"用户 {user.nickname} {user.user_id}" for user in basic_users]
+        try:
+            all_search_results = await self.llamaindex_manager.semantic_search_batch(
+                user_queries,
+                index_type="all",
+                top_k=3,
+                similarity_threshold=0.5
+            )
+        except Exception as e:
+            logger.error(f"❌ 批量检索用户相关内容失败: {e}")
+            all_search_results = [[] for _ in basic_users]
+        
+        # 各用户的AI洞察互不依赖，先批量生成全部洞察，再逐个组装画像
+        all_insights = await self._generate_users_ai_insights(basic_users, all_search_results)
         
-        for user in basic_users:
+        enhanced_users = []
+        for user, search_results, ai_insights in zip(basic_users, all_search_results, all_insights):
             try:
-                # 获取用户的语义搜索结果
-                user_query = f"用户 {user.nickname} {user.user_id}"
-                search_results = await self.llamaindex_manager.semantic_search(
-                    query=user_query,
-                    index_type="all",
-                    top_k=3,
-                    similarity_threshold=0.5
-                )
-                
                 # 生成相关内容摘要
                 related_summary = self._generate_related_content_summary(search_results)
-                
-                # 生成AI洞察
-                ai_insights = await self._generate_user_ai_insights(user, search_results)
-                
+            
                 # 计算检索分数
                 retrieval_score = self._calculate_retrieval_score(search_results)
-                
+            
                 # 创建增强版用户画像
                 enhanced_user = EnhancedUserProfile(
                     user_id=user.user_id,
@@ -404,9 +458,9 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                     ai_insights=ai_insights,
                     retrieval_score=retrieval_score
                 )
-                
+            
                 enhanced_users.append(enhanced_user)
-                
+            
             except Exception as e:
                 logger.error(f"❌ 增强用户 {user.user_id} 画像失败: {e}")
                 # 如果增强失败，至少保留基础信息
@@ -433,6 +487,59 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
         
         return enhanced_users
     
+    async def _generate_users_ai_insights(
+        self,
+        users: List[UserProfile],
+        all_search_results: List[List[Dict[str, Any]]]
+    ) -> List[str]:
+        """
+        批量生成用户AI洞察，结果与users一一对应
+        每USER_INSIGHT_BATCH_SIZE个用户合并为一次LLM调用，共享同一份提示词前缀，各批限流并发；
+        批大小为1时逐个用户流式生成
+        """
+        
+        semaphore = asyncio.Semaphore(settings.USER_INSIGHT_CONCURRENCY)
+        batch_size = settings.USER_INSIGHT_BATCH_SIZE
+        
+        if batch_size <= 1:
+            async def generate_one(user: UserProfile, search_results: List[Dict[str, Any]]) -> str:
+                async with semaphore:
+                    return await self._generate_user_ai_insights(user, search_results)
+            
+            return list(await asyncio.gather(*(
+                generate_one(user, search_results)
+                for user, search_results in zip(users, all_search_results)
+            )))
+        
+        insights = ["没有足够的数据生成AI洞察"] * len(users)
+        pending = [i for i, search_results in enumerate(all_search_results) if search_results]
+        
+        async def generate_batch(indices: List[int]) -> None:
+            try:
+                user_data_list = []
+                for i in indices:
+                    user_info, context = self._build_user_insight_data(users[i], all_search_results[i])
+                    user_data_list.append(f"用户基础信息：{user_info}\n用户行为数据：\n{context}")
+                
+                async with semaphore:
+                    results = await self.llm_caller.analyze_users_batch(
+                        user_data_list, USER_INSIGHT_BATCH_CRITERIA
+                    )
+                
+                for i, text in zip(indices, results):
+                    insights[i] = text[:USER_INSIGHT_MAX_CHARS] if text else "无法生成AI洞察"
+            
+            except Exception as e:
+                logger.error(f"❌ 批量生成用户AI洞察失败: {e}")
+                for i in indices:
+                    insights[i] = f"AI洞察生成失败: {str(e)}"
+        
+        await asyncio.gather(*(
+            generate_batch(pending[start:start + batch_size])
+            for start in range(0, len(pending), batch_size)
+        ))
+        return insights
+    
     def _generate_related_content_summary(self, search_results: List[Dict[str, Any]]) -> str:
         """生成相关内容摘要"""
         
@@ -458,22 +565,7 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             if not search_results:
                 return "没有足够的数据生成AI洞察"
             
-            # 整理搜索结果
-            context_data = []
-            for result in search_results[:2]:
-                context_data.append(result.get("content", "")[:300])
-            
-            context = "\n".join(context_data)
-            
-            # 构建用户基础信息
-            user_info = f"""
-用户ID: {user.user_id}
-昵称: {user.nickname}  
-价值评分: {user.value_score}
-情感倾向: {user.emotional_preference}
-互动次数: {user.interaction_count}
-未满足需求: {user.unmet_desc[:100]}...
-"""
+            user_info, context = self._build_user_insight_data(user, search_results)
             
             # 使用专业提示词生成洞察
             prompt_template = get_user_analyst_prompt("deep_user_analysis")
@@ -484,29 +576,75 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
                 comment_sentiment_data="基于语义搜索的用户行为分析"
             )
             
-            insights = await self.llm_caller.analyze_users(
-                analysis_prompt,
-                "生成单个用户的深度AI洞察分析"
-            )
-            
-            return insights[:500] if insights else "无法生成AI洞察"
+            insights = await self._stream_user_insights(analysis_prompt, user.user_id)
+            return insights if insights else "无法生成AI洞察"
             
         except Exception as e:
             logger.error(f"❌ 生成用户AI洞察失败: {e}")
             return f"AI洞察生成失败: {str(e)}"
     
+    @staticmethod
+    def _build_user_insight_data(
+        user: UserProfile,
+        search_results: List[Dict[str, Any]]
+    ) -> Tuple[str, str]:
+        """构建生成AI洞察所需的 (用户基础信息, 检索到的行为数据)"""
+        
+        # 整理搜索结果
+        context = "\n".join(result.get("content", "")[:300] for result in search_results[:2])
+        
+        # 构建用户基础信息
+        user_info = f"""
+用户ID: {user.user_id}
+昵称: {user.nickname}  
+价值评分: {user.value_score}
+情感倾向: {user.emotional_preference}
+互动次数: {user.interaction_count}
+未满足需求: {user.unmet_desc[:100]}...
+"""
+        return user_info, context
+    
+    @semantic_cached(
+        key_func=lambda self, analysis_prompt, user_id: (
+            (self.name, self.llm_caller.preferred_provider, USER_INSIGHT_MAX_CHARS, user_id),
+            analysis_prompt,
+        )
+    )
+    async def _stream_user_insights(self, analysis_prompt: str, user_id: str) -> Optional[str]:
+        """
+        流式生成单个用户的AI洞察，按用户分区语义缓存：洞察文本会指名该用户，不同用户之间
+        即使提示词几乎相同也不复用，同一用户上下文仅有细微变化时直接复用
+        只保留前USER_INSIGHT_MAX_CHARS个字符，流式读取够长度后立即关闭流，不再等待剩余输出
+        """
+        buffer = io.StringIO()
+        async with aclosing(self.llm_caller.stream_analyze_users(
+            analysis_prompt,
+            "生成单个用户的深度AI洞察分析"
+        )) as stream:
+            async for chunk in stream:
+                buffer.write(chunk)
+                if buffer.tell() >= USER_INSIGHT_MAX_CHARS:
+                    break
+        
+        insights = buffer.getvalue()
+        return insights[:USER_INSIGHT_MAX_CHARS] or None
+    
     def _calculate_retrieval_score(self, search_results: List[Dict[str, Any]]) -> float:
         """计算检索评分"""
         
         if not search_results:
             return 0.0
         
-        # 基于搜索结果的数量和质量计算分数
-        total_score = sum(result.get("score", 0) for result in search_results)
+        # 基于搜索结果的数量和质量计算分数，相似度一次性取出为连续数组后向量化求均值
         result_count = len(search_results)
+        scores = np.fromiter(
+            (result.get("score") or 0.0 for result in search_results),
+            dtype=np.float64,
+            count=result_count
+        )
         
         # 归一化分数
-        avg_score = total_score / result_count if result_count > 0 else 0
+        avg_score = float(scores.mean())
         count_bonus = min(result_count / 5.0, 1.0)  # 最多5个结果的奖励
         
         final_score = (avg_score * 0.7) + (count_bonus * 0.3)
@@ -530,4 +668,17 @@ class EnhancedUserAnalystAgent(UserAnalystAgent):
             
         except Exception as e:
             logger.error(f"❌ 智能用户查询失败: {e}")
-            return f"查询失败: {str(e)}"
\ No newline at end of file
+            return f"查询失败: {str(e)}"
+    
+    async def stream_smart_user_query(self, question: str) -> AsyncIterator[str]:
+        """智能用户查询的流式版本 - 逐块产出回答，供SSE接口直接转发"""
+        
+        logger.info(f"🤔 流式智能用户查询: {question}")
+        
+        async with aclosing(self.llamaindex_manager.stream_intelligent_query(
+            question=question,
+            context_type="all",
+            max_context_length=2000
+        )) as stream:
+            async for chunk in stream:
+                yield chunk
\ No newline at end of file
@@ -5,14 +5,24 @@ LlamaIndex集成模块
 
 import os
 import asyncio
-from typing import List, Dict, Any, Optional, Union
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple, Union
 from datetime import datetime
 from pathlib import Path
 
-from llama_index.core import VectorStoreIndex, Document, Settings, StorageContext
+import numpy as np
+
+from llama_index.core import VectorStoreIndex, Document, Settings, StorageContext, QueryBundle
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.indices.postprocessor import SimilarityPostprocessor
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.simple import SimpleVectorStoreData
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.core.ingestion import arun_transformations
+from llama_index.core.schema import MetadataMode
 
 try:
     from llama_index.embeddings.openai import OpenAIEmbedding
@@ -27,18 +37,189 @@ except ImportError:
         OpenAIEmbedding = None
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
+from sqlalchemy import func, select, text
 from app.infra.db.async_database import get_session_context
 from app.infra.models.comment_models import XhsComment
 from app.infra.models.note_models import XhsNote
 from app.infra.models.llm_models import LlmCommentAnalysis
+from app.agents.embedding_cache import EmbeddingCache
+from app.agents.llm_cache import semantic_cached, semantic_query_vector
 from app.config.settings import settings
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
+# int8量化矩阵分块反量化打分时每块的行数，限制临时float32矩阵的大小
+INT8_SCORE_BLOCK_ROWS = 8192
+
+# 向量以float32二进制矩阵持久化，代替SimpleVectorStore默认的JSON文本（嵌入数组被逐个字符串化）
+VECTOR_MATRIX_FILE = "vectors.npz"
+VECTOR_META_FILE = "vector_meta.json"
+LEGACY_VECTOR_STORE_FILE = "default__vector_store.json"
+
+# 构建索引时数据库流式读取每批的行数，边读取边构造文档
+INDEX_BUILD_YIELD_PER = 200
+
+# 索引文档文本模板，占位符与构建索引时查询的列标签一致，直接对查询结果行 format_map
+COMMENT_DOC_TEMPLATE = """
+评论ID: {comment_id}
+笔记ID: {note_id}
+用户昵称: {user_nickname}
+评论内容: {comment_content}
+点赞数: {like_count}
+创建时间: {create_time}
+"""
+
+NOTE_DOC_TEMPLATE = """
+笔记ID: {note_id}
+标题: {title}
+作者ID: {author_user_id}
+点赞数: {liked_count}
+卡片类型: {card_type}
+模型类型: {model_type}
+创建时间: {created_at}
+"""
+
+ANALYSIS_DOC_TEMPLATE = """
+分析ID: {analysis_id}
+笔记ID: {note_id}
+用户昵称: {user_nickname}
+情感倾向: {emotional_preference}
+AIPS偏好: {aips_preference}
+是否去过: {has_visited}
+未满足需求: {unmet_preference}
+未满足需求描述: {unmet_desc}
+性别: {gender}
+年龄: {age}
+分析时间: {created_at}
+"""
+
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """索引构建规格：查询的列、文档文本模板和元数据投影"""
+
+    index_type: str  # 索引类型，对应 <index_type>_index / <index_type>_storage_dir 属性
+    label: str  # 日志中的数据名称
+    unit: str  # 日志中的计数单位
+    emoji: str
+    columns: Tuple[Any, ...]  # 查询的列，标签与模板占位符、元数据键一致
+    template: str
+    user_column: Any  # 按用户精确查询记录时过滤的列
+    user_key: str  # 查询结果行中用户ID所在的键
+    recency_order: Tuple[Any, ...]  # 按用户查询记录时从新到旧的排序，末尾以主键保证顺序确定
+    text_only: Tuple[str, ...] = ()  # 只进入文本不进入元数据的列
+    str_fields: Tuple[str, ...] = ()  # 元数据中转为字符串的列
+
+
+COMMENT_INDEX_SPEC = IndexSpec(
+    index_type="comment",
+    label="评论",
+    unit="评论",
+    emoji="🔍",
+    columns=(
+        XhsComment.comment_id,
+        XhsComment.note_id,
+        XhsComment.comment_user_id.label("user_id"),
+        XhsComment.comment_user_nickname.label("user_nickname"),
+        XhsComment.comment_content,
+        XhsComment.comment_like_count.label("like_count"),
+        XhsComment.comment_create_time.label("create_time"),
+    ),
+    template=COMMENT_DOC_TEMPLATE,
+    user_column=XhsComment.comment_user_id,
+    user_key="user_id",
+    recency_order=(XhsComment.comment_create_time.desc(), XhsComment.comment_id.desc()),
+    text_only=("comment_content",),
+    str_fields=("create_time",),
+)
+
+NOTE_INDEX_SPEC = IndexSpec(
+    index_type="note",
+    label="笔记",
+    unit="笔记",
+    emoji="📝",
+    columns=(
+        XhsNote.note_id,
+        XhsNote.note_display_title.label("title"),
+        XhsNote.author_user_id,
+        XhsNote.note_liked_count.label("liked_count"),
+        XhsNote.note_card_type.label("card_type"),
+        XhsNote.note_model_type.label("model_type"),
+        XhsNote.created_at,
+    ),
+    template=NOTE_DOC_TEMPLATE,
+    user_column=XhsNote.author_user_id,
+    user_key="author_user_id",
+    recency_order=(XhsNote.created_at.desc(), XhsNote.note_id.desc()),
+    str_fields=("created_at",),
+)
+
+ANALYSIS_INDEX_SPEC = IndexSpec(
+    index_type="analysis",
+    label="LLM分析",
+    unit="分析",
+    emoji="🧠",
+    columns=(
+        LlmCommentAnalysis.id.label("analysis_id"),
+        LlmCommentAnalysis.note_id,
+        LlmCommentAnalysis.comment_user_id.label("user_id"),
+        LlmCommentAnalysis.comment_user_nickname.label("user_nickname"),
+        LlmCommentAnalysis.emotional_preference,
+        LlmCommentAnalysis.aips_preference,
+        LlmCommentAnalysis.has_visited,
+        LlmCommentAnalysis.unmet_preference,
+        LlmCommentAnalysis.unmet_desc,
+        LlmCommentAnalysis.gender,
+        LlmCommentAnalysis.age,
+        LlmCommentAnalysis.created_at,
+    ),
+    template=ANALYSIS_DOC_TEMPLATE,
+    user_column=LlmCommentAnalysis.comment_user_id,
+    user_key="user_id",
+    recency_order=(LlmCommentAnalysis.created_at.desc(), LlmCommentAnalysis.id.desc()),
+    text_only=("unmet_desc",),
+    str_fields=("created_at",),
+)
+
+# 用户洞察查询的数据类型
+USER_RECORD_SPECS = (COMMENT_INDEX_SPEC, NOTE_INDEX_SPEC, ANALYSIS_INDEX_SPEC)
+
+# 用户洞察中每种数据类型最多返回的记录数
+USER_INSIGHT_RECORD_LIMIT = 10
+
 
 class LlamaIndexManager:
     """LlamaIndex管理器 - 提供智能文档索引和检索功能"""
 
+    _instance: Optional["LlamaIndexManager"] = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "LlamaIndexManager":
+        """进程级单例，首次获取时加载已持久化的索引，所有Agent共享同一份索引和嵌入矩阵缓存"""
+
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    manager = cls()
+                    manager.load_existing_indexes()
+                    cls._instance = manager
+        return cls._instance
+
+    @classmethod
+    async def ainstance(cls) -> "LlamaIndexManager":
+        """获取进程级单例的异步版本，首次获取时在线程池中加载索引，适合在事件循环中预热"""
+
+        if cls._instance is None:
+            manager = cls()
+            await manager.aload_existing_indexes()
+            with cls._instance_lock:
+                # 加载期间其他调用方可能已创建单例，以先完成的为准
+                if cls._instance is None:
+                    cls._instance = manager
+        return cls._instance
+
     def __init__(self, persist_dir: str = "./storage"):
         self.persist_dir = Path(persist_dir)
         self.persist_dir.mkdir(exist_ok=True)
@@ -48,6 +229,14 @@ class LlamaIndexManager:
         self.note_index: Optional[VectorStoreIndex] = None
         self.analysis_index: Optional[VectorStoreIndex] = None
 
+        # 批量检索用的嵌入矩阵缓存: 索引类型 -> (索引, 向量条数, 节点ID列表, 归一化嵌入矩阵)
+        self._embedding_matrices: Dict[str, tuple] = {}
+        # 构建索引用的文档嵌入持久化缓存，重建时内容未变的文档不再请求嵌入接口
+        self.embedding_cache = EmbeddingCache(self.persist_dir / "embedding_cache.sqlite")
+
+        # 非内存向量存储的检索器缓存: 索引类型 -> (索引, 检索器)，索引重建后自动失效
+        self._retrievers: Dict[str, Tuple[VectorStoreIndex, VectorIndexRetriever]] = {}
+
         # 配置LlamaIndex设置
         self._setup_llamaindex_settings()
 
@@ -57,12 +246,22 @@ class LlamaIndexManager:
     def _setup_llamaindex_settings(self):
         """配置LlamaIndex全局设置"""
 
+        # 异步请求复用LLM模型管理器的共享HTTP连接池，不再各自建立TLS连接
+        from app.agents.llm_manager import LLMModelManager
+
+        http_client = LLMModelManager.instance().http_client
+
         # 设置嵌入模型
         try:
             # 优先使用OpenAI嵌入模型
             if settings.OPENAI_KEY and OpenAIEmbedding:
+                # 构建索引时每次嵌入请求合并多条文本，多个批次并发请求
                 Settings.embed_model = OpenAIEmbedding(
-                    api_key=settings.OPENAI_KEY, model="text-embedding-3-small"
+                    api_key=settings.OPENAI_KEY,
+                    model="text-embedding-3-small",
+                    embed_batch_size=settings.EMBED_BATCH_SIZE,
+                    num_workers=settings.EMBED_NUM_WORKERS,
+                    async_http_client=http_client,
                 )
                 logger.info("✅ 使用OpenAI嵌入模型")
             else:
@@ -75,7 +274,9 @@ class LlamaIndexManager:
         try:
             if settings.OPENAI_KEY and OpenAI:
                 Settings.llm = OpenAI(
-                    api_key=settings.OPENAI_KEY, model="gpt-3.5-turbo"
+                    api_key=settings.OPENAI_KEY,
+                    model="gpt-3.5-turbo",
+                    async_http_client=http_client,
                 )
                 logger.info("✅ 使用OpenAI LLM")
         except Exception as e:
@@ -102,333 +303,479 @@ class LlamaIndexManager:
     async def build_comment_index(self, limit: int = 1000) -> bool:
         """构建评论数据索引"""
 
-        logger.info(f"🔍 开始构建评论数据索引 (限制: {limit}条)")
-
-        try:
-            # 从数据库获取评论数据
-            async with get_session_context() as session:
-                query = select(XhsComment).limit(limit)
-                result = await session.execute(query)
-                comments = result.scalars().all()
-
-            if not comments:
-                logger.warning("❌ 没有找到评论数据")
-                return False
-
-            # 转换为LlamaIndex文档
-            documents = []
-            for comment in comments:
-                content = f"""
-评论ID: {comment.comment_id}
-笔记ID: {comment.note_id}
-用户昵称: {comment.comment_user_nickname}
-评论内容: {comment.comment_content}
-点赞数: {comment.comment_like_count}
-创建时间: {comment.comment_create_time}
-"""
+        return await self._build_index(COMMENT_INDEX_SPEC, limit)
 
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "comment_id": comment.comment_id,
-                        "note_id": comment.note_id,
-                        "user_id": comment.comment_user_id,
-                        "user_nickname": comment.comment_user_nickname,
-                        "like_count": comment.comment_like_count,
-                        "create_time": str(comment.comment_create_time),
-                        "type": "comment",
-                    },
-                )
-                documents.append(doc)
+    async def build_note_index(self, limit: int = 500) -> bool:
+        """构建笔记数据索引"""
 
-            # 创建存储上下文
-            storage_context = StorageContext.from_defaults(
-                persist_dir=str(self.comment_storage_dir)
-            )
+        return await self._build_index(NOTE_INDEX_SPEC, limit)
 
-            # 构建索引
-            self.comment_index = VectorStoreIndex.from_documents(
-                documents, storage_context=storage_context, show_progress=True
-            )
+    async def build_analysis_index(self, limit: int = 1000) -> bool:
+        """构建LLM分析数据索引"""
 
-            # 持久化索引
-            self.comment_index.storage_context.persist(
-                persist_dir=str(self.comment_storage_dir)
-            )
+        return await self._build_index(ANALYSIS_INDEX_SPEC, limit)
 
-            logger.info(f"✅ 评论索引构建完成，共处理 {len(documents)} 条评论")
-            return True
+    async def _build_index(self, spec: IndexSpec, limit: int) -> bool:
+        """按规格从数据库读取数据、构建向量索引并持久化"""
 
-        except Exception as e:
-            logger.error(f"❌ 构建评论索引失败: {e}")
-            return False
-
-    async def build_note_index(self, limit: int = 500) -> bool:
-        """构建笔记数据索引"""
-
-        logger.info(f"📝 开始构建笔记数据索引 (限制: {limit}条)")
+        logger.info(f"{spec.emoji} 开始构建{spec.label}数据索引 (限制: {limit}条)")
 
         try:
-            # 从数据库获取笔记数据
-            async with get_session_context() as session:
-                query = select(XhsNote).limit(limit)
-                result = await session.execute(query)
-                notes = result.scalars().all()
-
-            if not notes:
-                logger.warning("❌ 没有找到笔记数据")
-                return False
-
-            # 转换为LlamaIndex文档
+            # 从数据库流式获取数据，只查询需要的列，省去ORM对象的构造开销，
+            # 按批读取的同时构造文档，不再一次性加载全部结果
             documents = []
-            for note in notes:
-                content = f"""
-笔记ID: {note.note_id}
-标题: {note.note_display_title}
-作者ID: {note.author_user_id}
-点赞数: {note.note_liked_count}
-卡片类型: {note.note_card_type}
-模型类型: {note.note_model_type}
-创建时间: {note.created_at if hasattr(note, 'created_at') else 'N/A'}
-"""
-
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "note_id": note.note_id,
-                        "title": note.note_display_title,
-                        "author_user_id": note.author_user_id,
-                        "liked_count": note.note_liked_count,
-                        "card_type": note.note_card_type,
-                        "model_type": note.note_model_type,
-                        "created_at": (
-                            str(note.created_at)
-                            if hasattr(note, "created_at")
-                            else "N/A"
-                        ),
-                        "type": "note",
-                    },
+            async with get_session_context() as session:
+                query = select(*spec.columns).limit(limit)
+                result = await session.stream(
+                    query.execution_options(yield_per=INDEX_BUILD_YIELD_PER)
                 )
-                documents.append(doc)
+                async for row in result.mappings():
+                    text, metadata = self._render_row(spec, row)
+                    documents.append(Document(text=text, metadata=metadata))
 
-            # 创建存储上下文
-            storage_context = StorageContext.from_defaults(
-                persist_dir=str(self.note_storage_dir)
-            )
+            if not documents:
+                logger.warning(f"❌ 没有找到{spec.label}数据")
+                return False
 
-            # 构建索引
-            self.note_index = VectorStoreIndex.from_documents(
-                documents, storage_context=storage_context, show_progress=True
-            )
+            # 使用新的存储上下文构建，重建时替换而不是追加到已持久化的旧索引
+            storage_dir = str(getattr(self, f"{spec.index_type}_storage_dir"))
+            index = await self._abuild_vector_index(documents, StorageContext.from_defaults())
+            setattr(self, f"{spec.index_type}_index", index)
 
             # 持久化索引
-            self.note_index.storage_context.persist(
-                persist_dir=str(self.note_storage_dir)
-            )
+            self._persist_index(index, Path(storage_dir))
 
-            logger.info(f"✅ 笔记索引构建完成，共处理 {len(documents)} 条笔记")
+            logger.info(f"✅ {spec.label}索引构建完成，共处理 {len(documents)} 条{spec.unit}")
             return True
 
         except Exception as e:
-            logger.error(f"❌ 构建笔记索引失败: {e}")
+            logger.error(f"❌ 构建{spec.label}索引失败: {e}")
             return False
 
-    async def build_analysis_index(self, limit: int = 1000) -> bool:
-        """构建LLM分析数据索引"""
-
-        logger.info(f"🧠 开始构建LLM分析数据索引 (限制: {limit}条)")
-
-        try:
-            # 从数据库获取LLM分析数据
-            async with get_session_context() as session:
-                query = select(LlmCommentAnalysis).limit(limit)
-                result = await session.execute(query)
-                analyses = result.scalars().all()
-
-            if not analyses:
-                logger.warning("❌ 没有找到LLM分析数据")
-                return False
-
-            # 转换为LlamaIndex文档
-            documents = []
-            for analysis in analyses:
-                content = f"""
-分析ID: {analysis.id}
-评论ID: {analysis.comment_id}
-笔记ID: {analysis.note_id}
-用户昵称: {analysis.comment_user_nickname}
-情感倾向: {analysis.emotional_preference}
-AIPS偏好: {analysis.aips_preference}
-是否去过: {analysis.has_visited}
-未满足需求: {analysis.unmet_preference}
-未满足需求描述: {analysis.unmet_desc}
-性别: {analysis.gender}
-年龄: {analysis.age}
-分析时间: {analysis.created_at}
-"""
-
-                doc = Document(
-                    text=content,
-                    metadata={
-                        "analysis_id": analysis.id,
-                        "comment_id": analysis.comment_id,
-                        "note_id": analysis.note_id,
-                        "user_id": analysis.comment_user_id,
-                        "user_nickname": analysis.comment_user_nickname,
-                        "emotional_preference": analysis.emotional_preference,
-                        "aips_preference": analysis.aips_preference,
-                        "has_visited": analysis.has_visited,
-                        "unmet_preference": analysis.unmet_preference,
-                        "gender": analysis.gender,
-                        "age": analysis.age,
-                        "created_at": str(analysis.created_at),
-                        "type": "analysis",
-                    },
-                )
-                documents.append(doc)
-
-            # 创建存储上下文
-            storage_context = StorageContext.from_defaults(
-                persist_dir=str(self.analysis_storage_dir)
+    @staticmethod
+    def _render_row(spec: IndexSpec, row: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """把一行查询结果渲染为 (文档文本, 元数据)"""
+
+        metadata = dict(row)
+        for key in spec.text_only:
+            del metadata[key]
+        for key in spec.str_fields:
+            metadata[key] = str(row[key])
+        metadata["type"] = spec.index_type
+        return spec.template.format_map(row), metadata
+
+    async def _abuild_vector_index(
+        self, documents: List[Document], storage_context: StorageContext
+    ) -> VectorStoreIndex:
+        """
+        异步构建向量索引
+
+        与 VectorStoreIndex.from_documents 等价，但嵌入通过异步接口按批并发请求，
+        不阻塞事件循环
+        """
+
+        for doc in documents:
+            storage_context.docstore.set_document_hash(doc.id_, doc.hash)
+
+        nodes = await arun_transformations(
+            documents, Settings.transformations, show_progress=True
+        )
+        if settings.EMBEDDING_CACHE_ENABLED:
+            await self._apply_embedding_cache(nodes)
+
+        index = VectorStoreIndex(
+            nodes=[], storage_context=storage_context, show_progress=True
+        )
+        await index.ainsert_nodes(nodes, show_progress=True)
+        return index
+
+    async def _apply_embedding_cache(self, nodes: List[Any]) -> None:
+        """为节点填充嵌入：命中缓存的直接复用，其余批量请求嵌入接口后写回缓存"""
+
+        embed_model = Settings.embed_model
+        model_name = getattr(embed_model, "model_name", None) or type(embed_model).__name__
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+
+        embeddings = await asyncio.to_thread(self.embedding_cache.get_many, model_name, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        logger.info(f"♻️ 嵌入缓存命中 {len(nodes) - len(missing)}/{len(nodes)} 个节点")
+
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = await embed_model.aget_text_embedding_batch(
+                missing_texts, show_progress=True
             )
-
-            # 构建索引
-            self.analysis_index = VectorStoreIndex.from_documents(
-                documents, storage_context=storage_context, show_progress=True
+            await asyncio.to_thread(
+                self.embedding_cache.put_many, model_name, missing_texts, new_embeddings
             )
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
 
-            # 持久化索引
-            self.analysis_index.storage_context.persist(
-                persist_dir=str(self.analysis_storage_dir)
-            )
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+
+    def load_existing_indexes(self) -> bool:
+        """加载已存在的索引"""
 
-            logger.info(f"✅ LLM分析索引构建完成，共处理 {len(documents)} 条分析")
+        logger.info("📂 加载已存在的索引")
+
+        try:
+            self.comment_index = self._load_index(self.comment_storage_dir, "评论索引")
+            self.note_index = self._load_index(self.note_storage_dir, "笔记索引")
+            self.analysis_index = self._load_index(self.analysis_storage_dir, "LLM分析索引")
             return True
 
         except Exception as e:
-            logger.error(f"❌ 构建LLM分析索引失败: {e}")
+            logger.error(f"❌ 加载索引失败: {e}")
             return False
 
-    def load_existing_indexes(self) -> bool:
-        """加载已存在的索引"""
+    async def aload_existing_indexes(self) -> bool:
+        """加载已存在的索引的异步版本 - 三个索引的磁盘读取和反序列化在线程池中并行执行，不阻塞事件循环"""
 
         logger.info("📂 加载已存在的索引")
 
         try:
-            # 加载评论索引
-            if (self.comment_storage_dir / "docstore.json").exists():
-                try:
-                    storage_context = StorageContext.from_defaults(
-                        persist_dir=str(self.comment_storage_dir)
-                    )
-                    self.comment_index = VectorStoreIndex.from_documents(
-                        [], storage_context=storage_context
-                    )
-                    logger.info("✅ 评论索引加载成功")
-                except Exception as e:
-                    logger.warning(f"⚠️ 评论索引加载失败: {e}")
-
-            # 加载笔记索引
-            if (self.note_storage_dir / "docstore.json").exists():
-                try:
-                    storage_context = StorageContext.from_defaults(
-                        persist_dir=str(self.note_storage_dir)
-                    )
-                    self.note_index = VectorStoreIndex.from_documents(
-                        [], storage_context=storage_context
-                    )
-                    logger.info("✅ 笔记索引加载成功")
-                except Exception as e:
-                    logger.warning(f"⚠️ 笔记索引加载失败: {e}")
-
-            # 加载分析索引
-            if (self.analysis_storage_dir / "docstore.json").exists():
-                try:
-                    storage_context = StorageContext.from_defaults(
-                        persist_dir=str(self.analysis_storage_dir)
-                    )
-                    self.analysis_index = VectorStoreIndex.from_documents(
-                        [], storage_context=storage_context
-                    )
-                    logger.info("✅ LLM分析索引加载成功")
-                except Exception as e:
-                    logger.warning(f"⚠️ LLM分析索引加载失败: {e}")
-
+            self.comment_index, self.note_index, self.analysis_index = await asyncio.gather(
+                asyncio.to_thread(self._load_index, self.comment_storage_dir, "评论索引"),
+                asyncio.to_thread(self._load_index, self.note_storage_dir, "笔记索引"),
+                asyncio.to_thread(self._load_index, self.analysis_storage_dir, "LLM分析索引"),
+            )
             return True
 
         except Exception as e:
             logger.error(f"❌ 加载索引失败: {e}")
             return False
 
+    @staticmethod
+    def _persist_index(index: VectorStoreIndex, storage_dir: Path) -> None:
+        """持久化索引，向量矩阵写为float32二进制文件，文档与索引结构仍用JSON"""
+
+        storage_context = index.storage_context
+        vector_store = storage_context.vector_store
+        if not isinstance(vector_store, SimpleVectorStore):
+            storage_context.persist(persist_dir=str(storage_dir))
+            return
+
+        storage_dir.mkdir(parents=True, exist_ok=True)
+        storage_context.docstore.persist(persist_path=str(storage_dir / "docstore.json"))
+        storage_context.index_store.persist(persist_path=str(storage_dir / "index_store.json"))
+
+        data = vector_store.data
+        node_ids = list(data.embedding_dict)
+        matrix = np.asarray([data.embedding_dict[node_id] for node_id in node_ids], dtype=np.float32)
+        np.savez(storage_dir / VECTOR_MATRIX_FILE, node_ids=np.array(node_ids, dtype=str), matrix=matrix)
+        (storage_dir / VECTOR_META_FILE).write_text(
+            json_utils.dumps(
+                {"text_id_to_ref_doc_id": data.text_id_to_ref_doc_id, "metadata_dict": data.metadata_dict}
+            ),
+            encoding="utf-8",
+        )
+
+        # 删除旧格式的JSON向量文件，避免加载时读到过期数据
+        (storage_dir / LEGACY_VECTOR_STORE_FILE).unlink(missing_ok=True)
+
+    @staticmethod
+    def _load_storage_context(storage_dir: Path) -> StorageContext:
+        """从持久化目录恢复存储上下文，兼容旧的纯JSON格式"""
+
+        matrix_path = storage_dir / VECTOR_MATRIX_FILE
+        if not matrix_path.exists():
+            return StorageContext.from_defaults(persist_dir=str(storage_dir))
+
+        with np.load(matrix_path) as arrays:
+            node_ids = arrays["node_ids"].tolist()
+            matrix = arrays["matrix"]
+        meta = json_utils.loads((storage_dir / VECTOR_META_FILE).read_text(encoding="utf-8"))
+        vector_store = SimpleVectorStore(
+            data=SimpleVectorStoreData(
+                embedding_dict=dict(zip(node_ids, matrix.tolist())),
+                text_id_to_ref_doc_id=meta["text_id_to_ref_doc_id"],
+                metadata_dict=meta["metadata_dict"],
+            )
+        )
+        return StorageContext.from_defaults(
+            docstore=SimpleDocumentStore.from_persist_dir(str(storage_dir)),
+            index_store=SimpleIndexStore.from_persist_dir(str(storage_dir)),
+            vector_store=vector_store,
+        )
+
+    @staticmethod
+    def _load_index(storage_dir: Path, label: str) -> Optional[VectorStoreIndex]:
+        """从持久化目录加载单个索引，目录中没有索引或加载失败时返回None"""
+
+        if not (storage_dir / "docstore.json").exists():
+            return None
+
+        try:
+            storage_context = LlamaIndexManager._load_storage_context(storage_dir)
+            index = VectorStoreIndex.from_documents([], storage_context=storage_context)
+            logger.info(f"✅ {label}加载成功")
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ {label}加载失败: {e}")
+            return None
+
     async def semantic_search(
         self,
         query: str,
         index_type: str = "all",
         top_k: int = 5,
         similarity_threshold: float = 0.7,
+        query_embedding: Optional[List[float]] = None,
     ) -> List[Dict[str, Any]]:
-        """语义搜索"""
+        """
+        语义搜索 - 与批量搜索共用嵌入矩阵，一次矩阵向量乘法完成打分
+        调用方已有查询向量时通过 query_embedding 传入，不再请求嵌入接口
+        """
 
         logger.info(f"🔍 执行语义搜索: '{query}' (类型: {index_type}, Top-K: {top_k})")
 
-        results = []
-
         try:
-            # 选择要搜索的索引
-            indexes_to_search = []
-
-            if index_type == "all" or index_type == "comment":
-                if self.comment_index:
-                    indexes_to_search.append(("comment", self.comment_index))
-
-            if index_type == "all" or index_type == "note":
-                if self.note_index:
-                    indexes_to_search.append(("note", self.note_index))
-
-            if index_type == "all" or index_type == "analysis":
-                if self.analysis_index:
-                    indexes_to_search.append(("analysis", self.analysis_index))
-
-            # 对每个索引执行搜索
-            for index_name, index in indexes_to_search:
-                try:
-                    # 创建检索器
-                    retriever = VectorIndexRetriever(
-                        index=index, similarity_top_k=top_k
-                    )
-
-                    # 执行检索
-                    nodes = retriever.retrieve(query)
-
-                    # 处理结果
-                    for node in nodes:
-                        # 修复: 处理 node.score 可能为 None 的情况
-                        if (
-                            node.score is not None
-                            and node.score >= similarity_threshold
-                        ):
-                            result = {
-                                "index_type": index_name,
-                                "content": node.text,
-                                "metadata": node.metadata,
-                                "score": node.score,
-                                "node_id": node.node_id,
-                            }
-                            results.append(result)
-
-                except Exception as e:
-                    logger.warning(f"⚠️ 搜索索引 {index_name} 失败: {e}")
-
-            # 按相似度分数排序
-            results.sort(key=lambda x: x["score"], reverse=True)
-
+            indexes_to_search = self._select_indexes(index_type)
+            if not indexes_to_search:
+                return []
+
+            if query_embedding is None:
+                query_embedding = await Settings.embed_model.aget_query_embedding(query)
+            results = self._retrieve_batch(
+                indexes_to_search, [query], [query_embedding], top_k, similarity_threshold
+            )[0]
             logger.info(f"✅ 语义搜索完成，找到 {len(results)} 个相关结果")
-            return results[:top_k]
+            return results
 
         except Exception as e:
             logger.error(f"❌ 语义搜索失败: {e}")
             return []
 
+    async def semantic_search_batch(
+        self,
+        queries: List[str],
+        index_type: str = "all",
+        top_k: int = 5,
+        similarity_threshold: float = 0.7,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量语义搜索，按查询顺序返回各自的结果列表
+        所有查询的向量通过一次批量嵌入请求计算，检索时直接使用预计算向量，不再逐条请求嵌入
+        """
+
+        if not queries:
+            return []
+
+        logger.info(f"🔍 执行批量语义搜索: {len(queries)} 个查询 (类型: {index_type}, Top-K: {top_k})")
+
+        indexes_to_search = self._select_indexes(index_type)
+        if not indexes_to_search:
+            return [[] for _ in queries]
+
+        try:
+            embeddings = await Settings.embed_model.aget_text_embedding_batch(queries)
+        except Exception as e:
+            # 批量嵌入失败时退回逐条搜索
+            logger.warning(f"⚠️ 批量嵌入失败，改为逐条语义搜索: {e}")
+            return list(await asyncio.gather(*(
+                self.semantic_search(query, index_type, top_k, similarity_threshold)
+                for query in queries
+            )))
+
+        all_results = self._retrieve_batch(
+            indexes_to_search, queries, embeddings, top_k, similarity_threshold
+        )
+
+        logger.info(f"✅ 批量语义搜索完成，共找到 {sum(map(len, all_results))} 个相关结果")
+        return all_results
+
+    def _select_indexes(self, index_type: str) -> List[tuple]:
+        """选择要搜索的索引，返回 (索引类型, 索引) 列表"""
+
+        indexes_to_search = []
+
+        if index_type == "all" or index_type == "comment":
+            if self.comment_index:
+                indexes_to_search.append(("comment", self.comment_index))
+
+        if index_type == "all" or index_type == "note":
+            if self.note_index:
+                indexes_to_search.append(("note", self.note_index))
+
+        if index_type == "all" or index_type == "analysis":
+            if self.analysis_index:
+                indexes_to_search.append(("analysis", self.analysis_index))
+
+        return indexes_to_search
+
+    def _retrieve_batch(
+        self,
+        indexes_to_search: List[tuple],
+        queries: List[str],
+        embeddings: List[List[float]],
+        top_k: int,
+        similarity_threshold: float,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        用预计算的查询向量批量检索：内存向量存储的索引做一次 (N, d) x (d, M) 矩阵乘法
+        得到全部查询的相似度，其他向量存储逐条走LlamaIndex检索器
+        """
+
+        query_matrix = self._normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        all_results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+
+        for index_name, index in indexes_to_search:
+            try:
+                entry = self._get_embedding_matrix(index_name, index)
+                if entry is None:
+                    for results, query, embedding in zip(all_results, queries, embeddings):
+                        results.extend(self._retrieve(
+                            [(index_name, index)],
+                            QueryBundle(query_str=query, embedding=embedding),
+                            top_k,
+                            similarity_threshold,
+                        ))
+                    continue
+
+                node_ids, matrix = entry
+                if not node_ids:
+                    continue
+
+                # 余弦相似度 (向量均已归一化)，每行只取前top_k个候选，阈值过滤用布尔掩码一次完成
+                scores = self._score_matrix(query_matrix, matrix)
+                k = min(top_k, len(node_ids))
+                candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+                passed = candidate_scores >= similarity_threshold
+
+                for results, top, top_scores, mask in zip(
+                    all_results, candidates, candidate_scores, passed
+                ):
+                    for j, score in zip(top[mask].tolist(), top_scores[mask].tolist()):
+                        node = index.docstore.get_node(node_ids[j])
+                        results.append({
+                            "index_type": index_name,
+                            "content": node.text,
+                            "metadata": node.metadata,
+                            "score": score,
+                            "node_id": node.node_id,
+                        })
+
+            except Exception as e:
+                logger.warning(f"⚠️ 搜索索引 {index_name} 失败: {e}")
+
+        # 按相似度分数排序
+        for results in all_results:
+            results.sort(key=lambda x: x["score"], reverse=True)
+            del results[top_k:]
+
+        return all_results
+
+    def _get_embedding_matrix(
+        self, index_name: str, index: VectorStoreIndex
+    ) -> Optional[Tuple[List[str], np.ndarray]]:
+        """
+        获取索引的 (节点ID列表, 归一化嵌入矩阵)，按索引对象和向量条数缓存，索引替换或新增节点后重建；
+        条数超过 settings.VECTOR_INT8_MIN_SIZE 时矩阵按int8量化存储；非内存向量存储时返回None
+        """
+
+        vector_store = index.vector_store
+        if not isinstance(vector_store, SimpleVectorStore):
+            return None
+
+        embedding_dict = vector_store.data.embedding_dict
+        cached = self._embedding_matrices.get(index_name)
+        if cached is not None and cached[0] is index and cached[1] == len(embedding_dict):
+            return cached[2], cached[3]
+
+        node_ids = list(embedding_dict)
+        matrix = self._normalize_rows(
+            np.asarray([embedding_dict[node_id] for node_id in node_ids], dtype=np.float32)
+        )
+        if 0 < settings.VECTOR_INT8_MIN_SIZE <= len(node_ids):
+            # 归一化后各分量在[-1, 1]内，统一按127缩放即可，无需逐行记录缩放系数
+            matrix = np.rint(matrix * 127).astype(np.int8)
+
+        self._embedding_matrices[index_name] = (index, len(embedding_dict), node_ids, matrix)
+        return node_ids, matrix
+
+    @staticmethod
+    def _score_matrix(query_matrix: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """计算查询与嵌入矩阵的相似度，int8矩阵分块反量化后计算，避免一次性展开整个矩阵"""
+
+        if matrix.dtype != np.int8:
+            return query_matrix @ matrix.T
+
+        scores = np.empty((len(query_matrix), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), INT8_SCORE_BLOCK_ROWS):
+            block = matrix[start : start + INT8_SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start : start + len(block)] = query_matrix @ block.T
+        scores /= 127
+        return scores
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        """按行L2归一化，零向量保持不变"""
+
+        if matrix.ndim != 2:
+            return matrix.reshape(0, 0)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _retrieve(
+        self,
+        indexes_to_search: List[tuple],
+        query_bundle: QueryBundle,
+        top_k: int,
+        similarity_threshold: float,
+    ) -> List[Dict[str, Any]]:
+        """在各索引中检索并合并结果，query_bundle已带向量时不再计算嵌入"""
+
+        results = []
+
+        # 对每个索引执行搜索
+        for index_name, index in indexes_to_search:
+            try:
+                retriever = self._get_retriever(index_name, index)
+                # 检索是同步调用，设置top_k与检索之间不会切换协程
+                retriever.similarity_top_k = top_k
+
+                # 执行检索
+                nodes = retriever.retrieve(query_bundle)
+
+                # 处理结果，node.score 可能为None，按NaN处理后不会通过阈值
+                scores = np.fromiter(
+                    (np.nan if node.score is None else node.score for node in nodes),
+                    dtype=np.float64,
+                    count=len(nodes),
+                )
+                results.extend(
+                    {
+                        "index_type": index_name,
+                        "content": nodes[i].text,
+                        "metadata": nodes[i].metadata,
+                        "score": nodes[i].score,
+                        "node_id": nodes[i].node_id,
+                    }
+                    for i in np.flatnonzero(scores >= similarity_threshold)
+                )
+
+            except Exception as e:
+                logger.warning(f"⚠️ 搜索索引 {index_name} 失败: {e}")
+
+        # 按相似度分数排序
+        results.sort(key=lambda x: x["score"], reverse=True)
+
+        return results[:top_k]
+
+    def _get_retriever(self, index_name: str, index: VectorStoreIndex) -> VectorIndexRetriever:
+        """获取索引的检索器，按索引对象缓存，避免每次检索重新构造"""
+
+        cached = self._retrievers.get(index_name)
+        if cached is not None and cached[0] is index:
+            return cached[1]
+
+        retriever = VectorIndexRetriever(index=index)
+        self._retrievers[index_name] = (index, retriever)
+        return retriever
+
     async def intelligent_query(
         self, question: str, context_type: str = "all", max_context_length: int = 2000
     ) -> Optional[str]:
@@ -437,36 +784,137 @@ AIPS偏好: {analysis.aips_preference}
         logger.info(f"❓ 智能问答: '{question}' (上下文类型: {context_type})")
 
         try:
-            # 首先进行语义搜索获取相关内容
-            search_results = await self.semantic_search(
-                query=question,
-                index_type=context_type,
-                top_k=3,
-                similarity_threshold=0.6,
-            )
+            answer = await self._answer_question(question, context_type, max_context_length)
 
-            if not search_results:
-                logger.warning("⚠️ 没有找到相关内容")
+            if answer:
+                logger.info("✅ 智能问答完成")
+                return answer
+            elif answer == "":
                 return "抱歉，没有找到与您问题相关的信息。"
+            else:
+                logger.warning("⚠️ LLM回答生成失败")
+                return "抱歉，无法生成回答，请稍后重试。"
+
+        except Exception as e:
+            logger.error(f"❌ 智能问答失败: {e}")
+            return f"查询过程中出现错误: {str(e)}"
+
+    async def stream_intelligent_query(
+        self, question: str, context_type: str = "all", max_context_length: int = 2000
+    ) -> AsyncIterator[str]:
+        """智能问答的流式版本 - 检索完成后逐块产出LLM回答，首个文本块到达即可展示"""
+
+        logger.info(f"❓ 流式智能问答: '{question}' (上下文类型: {context_type})")
 
-            # 构建上下文
-            context_parts = []
-            current_length = 0
+        try:
+            context = await self._build_answer_context(
+                question, context_type, max_context_length
+            )
+            if context is None:
+                yield "抱歉，没有找到与您问题相关的信息。"
+                return
+
+            from app.agents.llm_manager import stream_llm
+
+            answered = False
+            async for chunk in stream_llm(*self._answer_prompts(question, context)):
+                answered = True
+                yield chunk
+
+            if answered:
+                logger.info("✅ 流式智能问答完成")
+            else:
+                logger.warning("⚠️ LLM回答生成失败")
+                yield "抱歉，无法生成回答，请稍后重试。"
 
-            for result in search_results:
-                content = result["content"]
-                if current_length + len(content) <= max_context_length:
-                    context_parts.append(f"[{result['index_type']}] {content}")
-                    current_length += len(content)
-                else:
-                    break
+        except Exception as e:
+            logger.error(f"❌ 流式智能问答失败: {e}")
+            yield f"查询过程中出现错误: {str(e)}"
 
-            context = "\n\n".join(context_parts)
+    async def _build_answer_context(
+        self,
+        question: str,
+        context_type: str,
+        max_context_length: int,
+        query_embedding: Optional[List[float]] = None,
+    ) -> Optional[str]:
+        """检索与问题相关的内容并拼接为回答上下文，没有相关内容时返回None"""
+
+        # 首先进行语义搜索获取相关内容
+        search_results = await self.semantic_search(
+            query=question,
+            index_type=context_type,
+            top_k=3,
+            similarity_threshold=0.6,
+            query_embedding=query_embedding,
+        )
+
+        if not search_results:
+            logger.warning("⚠️ 没有找到相关内容")
+            return None
+
+        # 构建上下文
+        context_parts = []
+        current_length = 0
+
+        for result in search_results:
+            content = result["content"]
+            if current_length + len(content) <= max_context_length:
+                context_parts.append(f"[{result['index_type']}] {content}")
+                current_length += len(content)
+            else:
+                break
+
+        return "\n\n".join(context_parts)
+
+    @semantic_cached(
+        key_func=lambda self, question, context_type, max_context_length: (
+            (context_type, max_context_length),
+            question,
+        )
+    )
+    async def _answer_question(
+        self, question: str, context_type: str, max_context_length: int
+    ) -> Optional[str]:
+        """
+        检索上下文并生成回答，按问题语义缓存在检索之前，措辞不同的同义问题
+        命中时同时省去语义检索和LLM调用
 
-            # 使用LLM生成答案
-            from app.agents.llm_manager import call_llm
+        Returns:
+            回答文本；没有相关内容时返回空字符串，LLM调用失败时返回None（两者都不缓存）
+        """
 
-            system_prompt = """你是一个专业的数据分析助手，基于提供的上下文信息回答用户问题。
+        context = await self._build_answer_context(
+            question, context_type, max_context_length, self._reusable_query_embedding(question)
+        )
+        if context is None:
+            return ""
+
+        # 使用LLM生成答案
+        from app.agents.llm_manager import call_llm
+
+        return await call_llm(*self._answer_prompts(question, context))
+
+    @staticmethod
+    def _reusable_query_embedding(question: str) -> Optional[List[float]]:
+        """语义缓存已用与索引相同的嵌入模型计算过问题向量时直接复用，检索不再重复请求嵌入"""
+
+        current = semantic_query_vector.get()
+        if current is None:
+            return None
+
+        text, model_name, vector = current
+        if text != question or model_name is None:
+            return None
+        if model_name != getattr(Settings.embed_model, "model_name", None):
+            return None
+        return vector.tolist()
+
+    @staticmethod
+    def _answer_prompts(question: str, context: str) -> Tuple[str, str]:
+        """构建智能问答的系统提示词和用户提示词"""
+
+        system_prompt = """你是一个专业的数据分析助手，基于提供的上下文信息回答用户问题。
 
 请注意：
 1. 只基于提供的上下文信息回答
@@ -474,7 +922,7 @@ AIPS偏好: {analysis.aips_preference}
 3. 回答要准确、简洁、有用
 4. 可以进行合理的分析和推理"""
 
-            user_prompt = f"""基于以下上下文信息回答问题：
+        user_prompt = f"""基于以下上下文信息回答问题：
 
 上下文信息：
 {context}
@@ -483,18 +931,7 @@ AIPS偏好: {analysis.aips_preference}
 
 请提供详细、准确的回答。"""
 
-            answer = await call_llm(system_prompt, user_prompt)
-
-            if answer:
-                logger.info("✅ 智能问答完成")
-                return answer
-            else:
-                logger.warning("⚠️ LLM回答生成失败")
-                return "抱歉，无法生成回答，请稍后重试。"
-
-        except Exception as e:
-            logger.error(f"❌ 智能问答失败: {e}")
-            return f"查询过程中出现错误: {str(e)}"
+        return system_prompt, user_prompt
 
     async def get_user_insights(self, user_id: str) -> Dict[str, Any]:
         """获取特定用户的深度洞察"""
@@ -502,62 +939,136 @@ AIPS偏好: {analysis.aips_preference}
         logger.info(f"👤 获取用户洞察: {user_id}")
 
         try:
-            # 搜索该用户的所有相关信息
-            user_query = f"用户ID:{user_id} OR comment_user_id:{user_id}"
-
-            search_results = await self.semantic_search(
-                query=user_query, index_type="all", top_k=10, similarity_threshold=0.5
-            )
-
-            # 分类整理结果
-            comments = []
-            notes = []
-            analyses = []
-
-            for result in search_results:
-                if result["index_type"] == "comment":
-                    comments.append(result)
-                elif result["index_type"] == "note":
-                    notes.append(result)
-                elif result["index_type"] == "analysis":
-                    analyses.append(result)
-
-            # 生成用户洞察报告
-            insights = {
-                "user_id": user_id,
-                "total_records": len(search_results),
-                "comments_count": len(comments),
-                "notes_count": len(notes),
-                "analyses_count": len(analyses),
-                "comments": comments,
-                "notes": notes,
-                "analyses": analyses,
-                "summary": f"用户 {user_id} 共有 {len(search_results)} 条相关记录",
-                "generated_at": datetime.now().isoformat(),
-            }
+            search_results = (await self._fetch_user_records([user_id]))[user_id]
 
             logger.info(f"✅ 用户洞察获取完成: {len(search_results)} 条记录")
-            return insights
+            return self._build_user_insights(user_id, search_results)
 
         except Exception as e:
             logger.error(f"❌ 获取用户洞察失败: {e}")
             return {"error": str(e)}
 
-    async def build_all_indexes(self) -> Dict[str, bool]:
-        """构建所有索引"""
+    async def get_user_insights_batch(
+        self, user_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """批量获取多个用户的深度洞察，每种数据类型只查询一次数据库"""
 
-        logger.info("🏗️ 开始构建所有索引")
+        logger.info(f"👥 批量获取用户洞察: {len(user_ids)} 个用户")
 
-        results = {}
+        unique_ids = list(dict.fromkeys(user_ids))
+        if not unique_ids:
+            return {}
 
-        # 构建评论索引
-        results["comment_index"] = await self.build_comment_index()
+        try:
+            all_records = await self._fetch_user_records(unique_ids)
+            return {
+                user_id: self._build_user_insights(user_id, all_records[user_id])
+                for user_id in unique_ids
+            }
 
-        # 构建笔记索引
-        results["note_index"] = await self.build_note_index()
+        except Exception as e:
+            logger.error(f"❌ 批量获取用户洞察失败: {e}")
+            return {user_id: {"error": str(e)} for user_id in unique_ids}
+
+    async def _fetch_user_records(
+        self, user_ids: List[str]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        按用户ID精确查询评论、笔记和分析记录，三种数据并发查询，走用户ID列的数据库索引；
+        记录格式与语义搜索结果一致，分数固定为1.0
+        """
+
+        per_spec = await asyncio.gather(
+            *(self._fetch_spec_user_records(spec, user_ids) for spec in USER_RECORD_SPECS)
+        )
+        return {
+            user_id: [record for records in per_spec for record in records[user_id]]
+            for user_id in user_ids
+        }
+
+    async def _fetch_spec_user_records(
+        self, spec: IndexSpec, user_ids: List[str]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """查询单种数据中属于这些用户的记录，每个用户在SQL中只取最新的 USER_INSIGHT_RECORD_LIMIT 条"""
+
+        # 按用户分区编号，只读取每个用户最新的若干行，记录很多的用户也不会整表读出
+        rank = func.row_number().over(
+            partition_by=spec.user_column, order_by=spec.recency_order
+        ).label("record_rank")
+        ranked = select(*spec.columns, rank).where(spec.user_column.in_(user_ids)).subquery()
+        query = (
+            select(*(column for column in ranked.c if column is not ranked.c.record_rank))
+            .where(ranked.c.record_rank <= USER_INSIGHT_RECORD_LIMIT)
+            .order_by(ranked.c.record_rank)
+        )
+
+        async with get_session_context() as session:
+            result = await session.execute(query)
+            rows = result.mappings().all()
+
+        records: Dict[str, List[Dict[str, Any]]] = {user_id: [] for user_id in user_ids}
+        for row in rows:
+            user_records = records.get(row[spec.user_key])
+            if user_records is None:
+                continue
+            text, metadata = self._render_row(spec, row)
+            user_records.append({
+                "index_type": spec.index_type,
+                "content": text,
+                "metadata": metadata,
+                "score": 1.0,
+                "node_id": None,
+            })
+        return records
+
+    @staticmethod
+    def _build_user_insights(
+        user_id: str, search_results: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """按索引类型分类整理检索结果，生成用户洞察报告"""
+
+        # 分类整理结果
+        comments = []
+        notes = []
+        analyses = []
+
+        for result in search_results:
+            if result["index_type"] == "comment":
+                comments.append(result)
+            elif result["index_type"] == "note":
+                notes.append(result)
+            elif result["index_type"] == "analysis":
+                analyses.append(result)
+
+        return {
+            "user_id": user_id,
+            "total_records": len(search_results),
+            "comments_count": len(comments),
+            "notes_count": len(notes),
+            "analyses_count": len(analyses),
+            "comments": comments,
+            "notes": notes,
+            "analyses": analyses,
+            "summary": f"用户 {user_id} 共有 {len(search_results)} 条相关记录",
+            "generated_at": datetime.now().isoformat(),
+        }
 
-        # 构建分析索引
-        results["analysis_index"] = await self.build_analysis_index()
+    async def build_all_indexes(self) -> Dict[str, bool]:
+        """构建所有索引"""
+
+        logger.info("🏗️ 开始构建所有索引")
+
+        # 三个索引的数据库查询和嵌入请求互不依赖，并发构建；各构建方法内部已捕获异常并返回False
+        comment_ok, note_ok, analysis_ok = await asyncio.gather(
+            self.build_comment_index(),
+            self.build_note_index(),
+            self.build_analysis_index(),
+        )
+        results = {
+            "comment_index": comment_ok,
+            "note_index": note_ok,
+            "analysis_index": analysis_ok,
+        }
 
         success_count = sum(results.values())
         total_count = len(results)
@@ -567,5 +1078,9 @@ AIPS偏好: {analysis.aips_preference}
         return results
 
 
-# 全局LlamaIndex管理器实例
-llamaindex_manager = LlamaIndexManager()
+def __getattr__(name: str) -> Any:
+    """兼容旧的模块级 llamaindex_manager：访问时才返回进程级单例，导入本模块不再构建管理器"""
+
+    if name == "llamaindex_manager":
+        return LlamaIndexManager.instance()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,104 @@
+"""
+LLM请求微批处理
+在一个很短的时间窗口内收集并发提交的LLM请求，合并相同的请求后统一分派，
+同一窗口内重复的提示词只向模型服务发起一次调用
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from app.utils.logger import app_logger as logger
+
+
+class PromptBatcher:
+    """
+    微批处理器
+
+    Args:
+        executor: 批量执行函数，接收去重后的请求列表，按顺序返回结果（可包含异常对象）
+        max_batch: 单批最多包含的不同请求数，达到后立即分派
+        max_wait_ms: 收集窗口（毫秒），窗口内第一个请求到达后开始计时
+    """
+
+    def __init__(
+        self,
+        executor: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = 32,
+        max_wait_ms: float = 10,
+    ):
+        self._executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 请求键 -> (请求, 等待该结果的Future列表)
+        self._pending: Dict[Hashable, Tuple[Any, List[asyncio.Future]]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 持有执行中批次任务的引用，防止被垃圾回收
+        self._running: Set[asyncio.Task] = set()
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """提交请求并等待结果，相同键的请求在同一窗口内共享一次执行"""
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # 事件循环切换（如测试中每个用例新建循环）时丢弃旧循环的状态
+            self._loop = loop
+            self._pending = {}
+            self._timer = None
+
+        future = loop.create_future()
+        self._pending.setdefault(key, (item, []))[1].append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """分派当前窗口内收集的请求"""
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+
+        task = self._loop.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: Dict[Hashable, Tuple[Any, List[asyncio.Future]]]) -> None:
+        """执行一批请求并把结果分发给各等待方"""
+
+        entries = list(batch.values())
+        waiting = sum(len(futures) for _, futures in entries)
+        if waiting > len(entries):
+            logger.debug(f"🧺 微批处理合并了 {waiting - len(entries)} 个重复LLM请求")
+
+        try:
+            try:
+                results = await self._executor([item for item, _ in entries])
+            except Exception as e:
+                results = [e] * len(entries)
+
+            for (_, futures), result in zip(entries, results):
+                for future in futures:
+                    if future.done():
+                        continue
+                    if isinstance(result, asyncio.CancelledError):
+                        # gather(return_exceptions=True)返回的取消异常不能作为响应交给调用方
+                        future.cancel()
+                    elif isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            # 批次任务本身被取消（如关闭时）或结果数量不足时，取消仍在等待的调用方，避免永久挂起
+            for _, futures in entries:
+                for future in futures:
+                    if not future.done():
+                        future.cancel()
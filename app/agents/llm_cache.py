@@ -0,0 +1,359 @@
+"""
+LLM响应缓存
+按提示词内容哈希缓存LLM响应，相同的系统提示词、用户提示词和模型在TTL内直接复用结果，
+省去重复请求的预填充延迟和token成本；另提供基于嵌入相似度的语义缓存，
+用于文本不同但语义相同的提示词
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy为可选依赖，未安装时语义缓存不可用
+    np = None
+
+try:
+    from llama_index.embeddings.openai import OpenAIEmbedding
+except ImportError:
+    OpenAIEmbedding = None
+
+from app.config.settings import settings
+from app.utils.logger import app_logger as logger
+
+
+class LLMResponseCache:
+    """进程内TTL+LRU响应缓存"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的缓存项，命中时刷新LRU顺序"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """写入缓存项，超出容量时淘汰最久未使用的条目"""
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 全局响应缓存实例
+llm_response_cache = LLMResponseCache(settings.LLM_CACHE_SIZE)
+
+
+def make_cache_key(parts: Iterable[Any]) -> str:
+    """对各组成部分做sha256，部分之间用分隔符隔开避免拼接歧义"""
+
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is not None and hasattr(part, "value"):
+            part = part.value
+        digest.update(("" if part is None else str(part)).encode())
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def llm_cached(
+    ttl: Optional[int] = None,
+    key_func: Optional[Callable[..., Iterable[Any]]] = None,
+):
+    """
+    LLM调用结果缓存装饰器
+
+    Args:
+        ttl: 缓存有效期（秒），默认使用 settings.LLM_CACHE_TTL，为0时不缓存
+        key_func: 从调用参数中提取缓存键组成部分的函数，默认使用全部位置参数和关键字参数
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_ttl = settings.LLM_CACHE_TTL if ttl is None else ttl
+            if cache_ttl <= 0:
+                return await func(*args, **kwargs)
+
+            if key_func is not None:
+                parts = key_func(*args, **kwargs)
+            else:
+                parts = (*args, *sorted(kwargs.items()))
+            key = make_cache_key((func.__qualname__, *parts))
+
+            cached = llm_response_cache.get(key)
+            if cached is not None:
+                logger.debug(f"🎯 LLM响应缓存命中: {func.__qualname__}")
+                return cached
+
+            result = await func(*args, **kwargs)
+            # 调用失败返回None时不缓存，下次仍会重新请求
+            if result is not None:
+                llm_response_cache.set(key, result, cache_ttl)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class SemanticLLMCache:
+    """
+    基于嵌入相似度的LLM响应缓存
+    向量归一化后用矩阵内积求余弦相似度 (等价于FAISS的IndexFlatIP)，
+    最近邻相似度不低于阈值时直接返回缓存的响应
+
+    Args:
+        threshold: 命中所需的最低余弦相似度
+        max_size: 每个分区最多保留的条目数
+        embed_func: 文本嵌入函数，默认首次使用时按配置创建OpenAI嵌入模型
+        ttl: 条目有效期（秒），为0时不过期；过期时间按墙钟记录，持久化后重启仍然有效
+        embed_model_name: embed_func对应的嵌入模型名，用于判断向量能否被检索复用
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.93,
+        max_size: int = 512,
+        embed_func: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        ttl: float = 0,
+        embed_model_name: Optional[str] = None,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.embed_model_name = embed_model_name
+        self._embed_func = embed_func
+        self._embed_func_resolved = embed_func is not None
+        # 按分区（函数、模型等精确匹配字段）分别存放向量矩阵、对应响应和过期时间
+        self._vectors: Dict[str, "np.ndarray"] = {}
+        self._responses: Dict[str, List[Any]] = {}
+        self._expires: Dict[str, "np.ndarray"] = {}
+
+    def _get_embed_func(self) -> Optional[Callable[[str], Awaitable[List[float]]]]:
+        """首次使用时创建嵌入模型，未配置时返回None"""
+
+        if not self._embed_func_resolved:
+            self._embed_func_resolved = True
+            if settings.OPENAI_KEY and OpenAIEmbedding is not None:
+                # 延迟导入避免循环依赖，嵌入请求复用LLM模型管理器的共享HTTP连接池
+                from app.agents.llm_manager import LLMModelManager
+
+                embed_model = OpenAIEmbedding(
+                    api_key=settings.OPENAI_KEY,
+                    model="text-embedding-3-small",
+                    async_http_client=LLMModelManager.instance().http_client,
+                )
+                self._embed_func = embed_model.aget_text_embedding
+                self.embed_model_name = embed_model.model_name
+        return self._embed_func
+
+    @property
+    def enabled(self) -> bool:
+        """是否可用：需要numpy、有效阈值和可用的嵌入模型"""
+
+        return (
+            np is not None
+            and self.threshold < 1
+            and self._get_embed_func() is not None
+        )
+
+    async def embed(self, text: str) -> Optional["np.ndarray"]:
+        """计算归一化的嵌入向量，失败时返回None"""
+
+        try:
+            vector = np.asarray(await self._get_embed_func()(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"⚠️ 语义缓存嵌入失败，跳过缓存: {e}")
+            return None
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, partition: str, vector: "np.ndarray") -> Optional[Any]:
+        """查找最近邻，相似度达到阈值时返回其响应"""
+
+        matrix = self._vectors.get(partition)
+        if matrix is None:
+            return None
+
+        scores = matrix @ vector
+        # 已过期的条目不参与匹配
+        scores[self._expires[partition] <= time.time()] = -np.inf
+        best = int(scores.argmax())
+        if scores[best] >= self.threshold:
+            return self._responses[partition][best]
+        return None
+
+    def add(self, partition: str, vector: "np.ndarray", response: Any) -> None:
+        """写入缓存，先清理该分区已过期的条目，超出容量时再淘汰最早的条目"""
+
+        self._evict_expired(partition)
+        matrix = self._vectors.get(partition)
+        responses = self._responses.setdefault(partition, [])
+        expires = self._expires.get(partition, np.empty(0))
+        expires_at = time.time() + self.ttl if self.ttl > 0 else np.inf
+
+        matrix = vector[None, :] if matrix is None else np.vstack([matrix, vector])
+        expires = np.append(expires, expires_at)
+        responses.append(response)
+
+        if len(responses) > self.max_size:
+            matrix = matrix[1:]
+            expires = expires[1:]
+            del responses[0]
+        self._vectors[partition] = matrix
+        self._expires[partition] = expires
+
+    def _evict_expired(self, partition: str) -> None:
+        """删除分区内已过期的条目，分区清空时一并移除"""
+
+        expires = self._expires.get(partition)
+        if expires is None:
+            return
+
+        alive = expires > time.time()
+        if alive.all():
+            return
+        if not alive.any():
+            del self._vectors[partition], self._responses[partition], self._expires[partition]
+            return
+
+        self._vectors[partition] = self._vectors[partition][alive]
+        self._expires[partition] = expires[alive]
+        self._responses[partition] = [
+            response for response, keep in zip(self._responses[partition], alive) if keep
+        ]
+
+    def save(self, path: str) -> None:
+        """把未过期的条目持久化到文件，先写临时文件再替换，避免中途失败留下损坏的文件"""
+
+        for partition in list(self._expires):
+            self._evict_expired(partition)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {
+                    "vectors": self._vectors,
+                    "responses": self._responses,
+                    "expires": self._expires,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """从文件恢复缓存，文件不存在时返回False；文件以pickle读取，只应加载本进程保存的受信任文件"""
+
+        if not os.path.exists(path):
+            return False
+
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        self._vectors = data["vectors"]
+        self._responses = data["responses"]
+        self._expires = data["expires"]
+        for partition in list(self._expires):
+            self._evict_expired(partition)
+        return True
+
+    def clear(self) -> None:
+        """清空缓存"""
+
+        self._vectors.clear()
+        self._responses.clear()
+        self._expires.clear()
+
+    def __len__(self) -> int:
+        return sum(len(responses) for responses in self._responses.values())
+
+
+# 全局语义缓存实例
+semantic_llm_cache = SemanticLLMCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_size=settings.SEMANTIC_CACHE_SIZE,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+)
+
+
+# 当前语义缓存调用的 (提示词文本, 嵌入模型名, 归一化向量)，被装饰函数可据此复用同一次嵌入
+semantic_query_vector: ContextVar[Optional[Tuple[str, Optional[str], Any]]] = ContextVar(
+    "semantic_query_vector", default=None
+)
+
+
+def semantic_cached(
+    key_func: Callable[..., Tuple[Iterable[Any], str]],
+    cache: Optional[SemanticLLMCache] = None,
+):
+    """
+    语义缓存装饰器
+
+    Args:
+        key_func: 从调用参数中提取 (精确匹配的分区字段, 用于嵌入的提示词文本)
+        cache: 使用的语义缓存实例，默认为全局实例
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            semantic_cache = cache if cache is not None else semantic_llm_cache
+            if not semantic_cache.enabled:
+                return await func(*args, **kwargs)
+
+            partition_parts, text = key_func(*args, **kwargs)
+            partition = make_cache_key((func.__qualname__, *partition_parts))
+            vector = await semantic_cache.embed(text)
+            if vector is None:
+                return await func(*args, **kwargs)
+
+            cached = semantic_cache.lookup(partition, vector)
+            if cached is not None:
+                logger.debug(f"🎯 LLM语义缓存命中: {func.__qualname__}")
+                return cached
+
+            token = semantic_query_vector.set((text, semantic_cache.embed_model_name, vector))
+            try:
+                result = await func(*args, **kwargs)
+            finally:
+                semantic_query_vector.reset(token)
+            # 失败(None)或空结果不缓存，下次仍会重新执行
+            if result:
+                semantic_cache.add(partition, vector, result)
+            return result
+
+        return wrapper
+
+    return decorator
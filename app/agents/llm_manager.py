@@ -4,17 +4,67 @@ LLM模型管理器
 """
 
 import os
-from typing import Optional, Dict, Any, List
+import asyncio
+import functools
+import random
+import threading
+import weakref
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from enum import Enum
 
+import httpx
 from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
 from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
 
+from app.agents.llm_batcher import PromptBatcher
+from app.agents.llm_cache import llm_cached, semantic_cached
 from app.config.settings import settings
+from app.prompts import prompt_manager
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
+try:
+    import h2  # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    # h2为可选依赖，未安装时共享连接池使用HTTP/1.1长连接
+    _HTTP2_AVAILABLE = False
+
+
+class _LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    按事件循环分别持有连接池的HTTP传输层
+    连接绑定到建立它的事件循环，进程内多次asyncio.run（CLI、测试、worker重启）时
+    各循环使用各自的连接池，在该循环中首次发送请求时才创建
+    """
+
+    def __init__(self, **transport_kwargs: Any):
+        self._transport_kwargs = transport_kwargs
+        self._transports: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _current(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = self._transports[loop] = httpx.AsyncHTTPTransport(
+                **self._transport_kwargs
+            )
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池"""
+
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
 
 class ModelProvider(Enum):
     """模型提供商枚举"""
@@ -26,14 +76,66 @@ class ModelProvider(Enum):
     DEEPSEEK = "deepseek"
 
 
+# 限流重试参数：指数退避并加随机抖动，避免并发请求同时重试
+RATE_LIMIT_MAX_RETRIES = 3
+RATE_LIMIT_BASE_DELAY = 1.0  # 秒
+RATE_LIMIT_MAX_DELAY = 60.0  # 秒
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为模型服务的限流错误"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return "RateLimit" in type(error).__name__
+
+
+@functools.lru_cache(maxsize=256)
+def _system_message(system_prompt: str) -> SystemMessage:
+    """按文本复用系统消息对象，系统提示词来自固定模板，省去每次调用重复构造消息"""
+
+    return SystemMessage(content=system_prompt)
+
+
 class LLMModelManager:
     """LLM模型管理器 - 统一管理多种模型访问"""
 
+    _instance: Optional["LLMModelManager"] = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "LLMModelManager":
+        """进程级单例，所有调用器共享同一组模型客户端及其连接池"""
+
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
     def __init__(self):
         self.models: Dict[ModelProvider, Optional[BaseChatModel]] = {}
         self.default_provider = None
+        # 每个提供商独立限制在途请求数，所有调用器共享
+        self.max_concurrency = settings.LLM_MAX_CONCURRENCY
+        # 信号量绑定到首次发生竞争的事件循环，按事件循环分别创建，进程内多次asyncio.run互不影响
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # OpenAI兼容的各提供商共用一个HTTP客户端，复用TLS连接，安装h2时启用HTTP/2多路复用；
+        # 连接池由传输层在各事件循环中首次发送请求时才创建
+        self._transport = _LoopLocalTransport(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+        self.http_client = httpx.AsyncClient(transport=self._transport)
         self._initialize_models()
 
+    async def aclose(self) -> None:
+        """关闭当前事件循环的共享HTTP连接池，之后再发送请求时重新创建"""
+
+        await self._transport.aclose()
+
     def _initialize_models(self):
         """初始化所有可用的模型"""
 
@@ -62,6 +164,7 @@ class LLMModelManager:
                     model="anthropic/claude-3.5-sonnet",
                     temperature=0.7,
                     max_tokens=4000,
+                    http_async_client=self.http_client,
                 )
                 if not self.default_provider:
                     self.default_provider = ModelProvider.OPENROUTER
@@ -78,6 +181,7 @@ class LLMModelManager:
                     model="gpt-4o-mini",
                     temperature=0.7,
                     max_tokens=4000,
+                    http_async_client=self.http_client,
                 )
                 if not self.default_provider:
                     self.default_provider = ModelProvider.OPENAI
@@ -94,6 +198,7 @@ class LLMModelManager:
                     model=settings.QWEN_MODEL_NAME,
                     temperature=0.7,
                     max_tokens=4000,
+                    http_async_client=self.http_client,
                 )
                 if not self.default_provider:
                     self.default_provider = ModelProvider.QWEN
@@ -110,6 +215,7 @@ class LLMModelManager:
                     model=settings.DEEPSEEK_MODEL_NAME,
                     temperature=0.7,
                     max_tokens=4000,
+                    http_async_client=self.http_client,
                 )
                 if not self.default_provider:
                     self.default_provider = ModelProvider.DEEPSEEK
@@ -145,12 +251,181 @@ class LLMModelManager:
         self,
         messages: List[BaseMessage],
         preferred_provider: Optional[ModelProvider] = None,
+        max_tokens: Optional[int] = None,
+        hedge_after_ms: Optional[float] = None,
     ) -> Optional[str]:
         """
         使用备选机制调用模型
-        如果首选提供商失败，会自动尝试其他可用提供商
+        如果首选提供商失败，会自动尝试其他可用提供商；max_tokens 用于覆盖模型默认的输出上限
+
+        hedge_after_ms 为对冲等待时间（毫秒），默认使用 settings.LLM_HEDGE_AFTER_MS：
+        在途请求超过该时间仍未返回时，并发请求下一个提供商，先成功的结果胜出，其余请求取消；
+        不大于0时严格按顺序逐个备选
         """
 
+        if hedge_after_ms is None:
+            hedge_after_ms = settings.LLM_HEDGE_AFTER_MS
+        hedge_timeout = hedge_after_ms / 1000 if hedge_after_ms > 0 else None
+
+        remaining = [
+            provider
+            for provider in self._get_providers_to_try(preferred_provider)
+            if self.models.get(provider) is not None
+        ]
+        pending = set()
+        last_error = None
+
+        def launch_next() -> None:
+            provider = remaining.pop(0)
+            pending.add(
+                asyncio.create_task(self._invoke_provider(provider, messages, max_tokens))
+            )
+
+        if remaining:
+            launch_next()
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=hedge_timeout if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info(f"⏱️ 模型调用超过 {hedge_after_ms:.0f}ms 未返回，并发请求备选提供商")
+                    launch_next()
+                    continue
+
+                for task in done:
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+
+                # 没有在途请求时立即切换到下一个提供商
+                if not pending and remaining:
+                    launch_next()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        logger.error(f"💥 所有模型提供商都失败了，最后一个错误: {last_error}")
+        return None
+
+    async def _invoke_provider(
+        self,
+        provider: ModelProvider,
+        messages: List[BaseMessage],
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """调用单个提供商的模型并返回文本，失败时记录日志后抛出异常"""
+
+        model = self.models[provider]
+        if max_tokens:
+            model = model.bind(max_tokens=max_tokens)
+
+        try:
+            logger.info(f"🤖 尝试使用 {provider.value} 模型")
+            result = await self._ainvoke_with_retry(
+                model, self._with_prompt_caching(messages, provider), provider
+            )
+        except Exception as e:
+            logger.warning(f"❌ {provider.value} 模型调用失败: {e}")
+            raise
+
+        logger.info(f"✅ {provider.value} 模型调用成功")
+        self._log_prompt_cache_usage(result, provider)
+        return result.content if hasattr(result, "content") else str(result)
+
+    async def astream_with_fallback(
+        self,
+        messages: List[BaseMessage],
+        preferred_provider: Optional[ModelProvider] = None,
+    ) -> AsyncIterator[str]:
+        """
+        使用备选机制流式调用模型
+        只在尚未产出任何内容时切换提供商，已开始输出后出错则直接抛出
+        """
+
+        last_error = None
+
+        for provider in self._get_providers_to_try(preferred_provider):
+            model = self.models.get(provider)
+            if model is None:
+                continue
+
+            started = False
+            try:
+                logger.info(f"🤖 尝试流式使用 {provider.value} 模型")
+                async with self._get_semaphore(provider):
+                    async for chunk in model.astream(
+                        self._with_prompt_caching(messages, provider)
+                    ):
+                        text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                        if not isinstance(text, str) or not text:
+                            continue
+                        started = True
+                        yield text
+                logger.info(f"✅ {provider.value} 模型流式调用成功")
+                return
+
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+                logger.warning(f"❌ {provider.value} 模型流式调用失败: {e}")
+                continue
+
+        logger.error(f"💥 所有模型提供商都失败了，最后一个错误: {last_error}")
+
+    @staticmethod
+    def _log_prompt_cache_usage(result: Any, provider: ModelProvider) -> None:
+        """记录提供商侧前缀缓存命中的token数，用于确认静态前缀是否生效"""
+
+        usage = getattr(result, "usage_metadata", None) or {}
+        cache_read = (usage.get("input_token_details") or {}).get("cache_read")
+        if cache_read:
+            logger.debug(
+                f"🎯 {provider.value} 前缀缓存命中 {cache_read}/{usage.get('input_tokens')} 输入tokens"
+            )
+
+    def _get_semaphore(self, provider: ModelProvider) -> asyncio.Semaphore:
+        """获取当前事件循环中提供商的并发信号量，首次使用时创建"""
+
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        semaphore = semaphores.get(provider)
+        if semaphore is None:
+            semaphore = semaphores[provider] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _ainvoke_with_retry(
+        self, model: Runnable, messages: List[BaseMessage], provider: ModelProvider
+    ) -> Any:
+        """在提供商并发限制内调用模型，限流时释放名额后退避重试"""
+
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            try:
+                async with self._get_semaphore(provider):
+                    return await model.ainvoke(messages)
+            except Exception as e:
+                if attempt < RATE_LIMIT_MAX_RETRIES and _is_rate_limit_error(e):
+                    delay = random.uniform(
+                        0, min(RATE_LIMIT_MAX_DELAY, RATE_LIMIT_BASE_DELAY * (2**attempt))
+                    )
+                    logger.warning(
+                        f"⏳ {provider.value} 触发限流，{delay:.1f}秒后重试 (第{attempt + 1}次)"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+
+    def _get_providers_to_try(
+        self, preferred_provider: Optional[ModelProvider] = None
+    ) -> List[ModelProvider]:
+        """确定模型提供商的尝试顺序"""
+
         providers_to_try = []
 
         # 确定尝试顺序
@@ -168,47 +443,62 @@ class LLMModelManager:
             if provider not in providers_to_try and provider in self.models:
                 providers_to_try.append(provider)
 
-        last_error = None
-
-        for provider in providers_to_try:
-            model = self.models.get(provider)
-            if model is None:
-                continue
-
-            try:
-                logger.info(f"🤖 尝试使用 {provider.value} 模型")
-                result = await model.ainvoke(messages)
-                logger.info(f"✅ {provider.value} 模型调用成功")
-                return result.content if hasattr(result, "content") else str(result)
+        return providers_to_try
 
-            except Exception as e:
-                last_error = e
-                logger.warning(f"❌ {provider.value} 模型调用失败: {e}")
-                continue
+    def _with_prompt_caching(
+        self, messages: List[BaseMessage], provider: ModelProvider
+    ) -> List[BaseMessage]:
+        """
+        为系统提示词前缀开启提供商侧缓存
+        OpenAI兼容接口会自动缓存相同前缀，Anthropic需要显式标记cache_control
+        """
 
-        logger.error(f"💥 所有模型提供商都失败了，最后一个错误: {last_error}")
-        return None
+        if provider != ModelProvider.ANTHROPIC or not messages:
+            return messages
+
+        system_message = messages[0]
+        if not isinstance(system_message, SystemMessage) or not isinstance(
+            system_message.content, str
+        ):
+            return messages
+
+        cached_system = SystemMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": system_message.content,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        )
+        return [cached_system, *messages[1:]]
 
     def create_prompt_messages(
         self, system_prompt: str, user_prompt: str, context: Optional[str] = None
     ) -> List[BaseMessage]:
-        """创建标准的提示消息格式"""
+        """创建标准的提示消息格式，可变的背景信息放在最后以保持前缀稳定"""
 
-        messages = [SystemMessage(content=system_prompt)]
+        messages = [_system_message(system_prompt), HumanMessage(content=user_prompt)]
 
         if context:
             messages.append(HumanMessage(content=f"背景信息：\n{context}"))
 
-        messages.append(HumanMessage(content=user_prompt))
-
         return messages
 
 
 # 全局模型管理器实例
-llm_manager = LLMModelManager()
+llm_manager = LLMModelManager.instance()
 
 
 # 便捷函数
+@llm_cached(
+    key_func=lambda system_prompt, user_prompt, context=None, preferred_provider=None: (
+        system_prompt,
+        user_prompt,
+        context,
+        preferred_provider,
+    )
+)
 async def call_llm(
     system_prompt: str,
     user_prompt: str,
@@ -221,6 +511,19 @@ async def call_llm(
     return await llm_manager.invoke_with_fallback(messages, preferred_provider)
 
 
+async def stream_llm(
+    system_prompt: str,
+    user_prompt: str,
+    context: Optional[str] = None,
+    preferred_provider: Optional[ModelProvider] = None,
+) -> AsyncIterator[str]:
+    """便捷的LLM流式调用函数，逐块产出模型输出文本"""
+
+    messages = llm_manager.create_prompt_messages(system_prompt, user_prompt, context)
+    async for chunk in llm_manager.astream_with_fallback(messages, preferred_provider):
+        yield chunk
+
+
 async def call_llm_with_messages(
     messages: List[BaseMessage], preferred_provider: Optional[ModelProvider] = None
 ) -> Optional[str]:
@@ -229,34 +532,251 @@ async def call_llm_with_messages(
     return await llm_manager.invoke_with_fallback(messages, preferred_provider)
 
 
-from app.prompts import prompt_manager
-from app.utils.logger import app_logger as logger
+async def _invoke_prompt_batch(
+    items: List[
+        Tuple["LLMModelManager", List[BaseMessage], Optional[ModelProvider], Optional[int]]
+    ]
+) -> List[Any]:
+    """微批处理执行函数：并发调用批内各请求，提供商并发上限由模型管理器控制"""
+
+    return await asyncio.gather(
+        *(
+            manager.invoke_with_fallback(messages, provider, max_tokens)
+            for manager, messages, provider, max_tokens in items
+        ),
+        return_exceptions=True,
+    )
+
+
+# 全局微批处理器，所有Agent调用器共享
+prompt_batcher = PromptBatcher(
+    _invoke_prompt_batch,
+    max_batch=settings.LLM_BATCH_MAX_SIZE,
+    max_wait_ms=settings.LLM_BATCH_WINDOW_MS,
+)
 
 
 class AgentLLMCaller:
     """为Agent定制的LLM调用器"""
 
     def __init__(
-        self, agent_name: str, preferred_provider: Optional[ModelProvider] = None
+        self,
+        agent_name: str,
+        preferred_provider: Optional[ModelProvider] = None,
+        model_manager: Optional[LLMModelManager] = None,
     ):
         self.agent_name = agent_name
         self.preferred_provider = preferred_provider
+        # 默认复用进程级单例，避免每个调用器各自创建模型客户端
+        self.llm_manager = model_manager or LLMModelManager.instance()
+
+    @property
+    def model_name(self) -> str:
+        """当前Agent优先使用的模型提供商名称"""
+
+        provider = self.preferred_provider or self.llm_manager.default_provider
+        return provider.value if provider else "unknown"
+
+    def _build_messages(
+        self, prompt: str, system_prompt: Optional[str] = None
+    ) -> List[BaseMessage]:
+        """构建单轮提示消息，未提供系统提示词时只发送用户消息"""
+
+        if system_prompt:
+            return self.llm_manager.create_prompt_messages(system_prompt, prompt)
+        return [HumanMessage(content=prompt)]
+
+    @llm_cached(
+        key_func=lambda self, prompt, system_prompt=None, max_tokens=None: (
+            system_prompt,
+            prompt,
+            self.preferred_provider,
+            max_tokens,
+        )
+    )
+    async def call_llm(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Optional[str]:
+        """使用完整提示词直接调用LLM，max_tokens 为空时使用模型默认输出上限"""
+
+        messages = self._build_messages(prompt, system_prompt)
+        if settings.LLM_BATCH_WINDOW_MS <= 0:
+            return await self.llm_manager.invoke_with_fallback(
+                messages, self.preferred_provider, max_tokens
+            )
+
+        # 经过微批处理窗口，并发提交的相同提示词只调用一次模型
+        key = (
+            id(self.llm_manager),
+            system_prompt,
+            prompt,
+            self.preferred_provider,
+            max_tokens,
+        )
+        return await prompt_batcher.submit(
+            key, (self.llm_manager, messages, self.preferred_provider, max_tokens)
+        )
+
+    async def call_llm_batch(
+        self,
+        prompts: List[str],
+        system_prompt: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Optional[str]]:
+        """
+        并发调用LLM处理一批互不依赖的提示词，总耗时约为最慢的一次调用
+
+        Args:
+            prompts: 提示词列表
+            system_prompt: 所有提示词共用的系统提示词
+            max_concurrency: 最大并发数，默认使用 settings.LLM_BATCH_CONCURRENCY
+
+        Returns:
+            List[Optional[str]]: 与prompts一一对应的结果，失败的调用为None
+        """
+
+        semaphore = asyncio.Semaphore(max_concurrency or settings.LLM_BATCH_CONCURRENCY)
+
+        async def call_one(prompt: str) -> Optional[str]:
+            async with semaphore:
+                return await self.call_llm(prompt, system_prompt)
+
+        results = await asyncio.gather(
+            *(call_one(prompt) for prompt in prompts), return_exceptions=True
+        )
+
+        outputs = []
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning(f"❌ {self.agent_name} 批量调用中的单个请求失败: {result}")
+                result = None
+            outputs.append(result)
+        return outputs
+
+    async def stream_llm(
+        self, prompt: str, system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """使用完整提示词流式调用LLM"""
+
+        messages = self._build_messages(prompt, system_prompt)
+        async for chunk in self.llm_manager.astream_with_fallback(
+            messages, self.preferred_provider
+        ):
+            yield chunk
 
     async def analyze_users(self, user_data: str, criteria: str) -> Optional[str]:
-        """用户分析LLM调用"""
+        """
+        用户分析LLM调用
+        user_data可能只描述单个用户，画像相近的不同用户不能共享结果，
+        因此只经过call_llm的精确缓存，不做语义复用
+        """
+
+        system_prompt, user_prompt = self._analysis_prompts(user_data, criteria)
+        return await call_llm(
+            system_prompt, user_prompt, preferred_provider=self.preferred_provider
+        )
+
+    @semantic_cached(
+        key_func=lambda self, user_data, criteria: (
+            (self.agent_name, self.preferred_provider),
+            f"{criteria}\n{user_data}",
+        )
+    )
+    async def summarize_users(self, user_data: str, criteria: str) -> Optional[str]:
+        """
+        多用户汇总分析LLM调用，提示词相近时按语义缓存复用
+        语义缓存未命中时仍经过call_llm的精确缓存，该层在语义缓存关闭或嵌入失败时兜底
+        """
+
+        return await self.analyze_users(user_data, criteria)
+
+    async def analyze_users_batch(
+        self, user_data_list: List[str], criteria: str
+    ) -> List[Optional[str]]:
+        """
+        批量用户分析：多个互不依赖的用户共享同一份系统提示词和分析要求，合并为一次LLM调用，
+        要求模型按顺序返回JSON字符串数组；响应格式不符时回退为并发的逐个用户调用
+
+        Returns:
+            List[Optional[str]]: 与user_data_list一一对应的分析结果，失败的为None
+        """
+
+        if len(user_data_list) > 1:
+            system_prompt = prompt_manager.format_prompt(
+                "user_analyst_system", agent_name=self.agent_name
+            )
+            user_prompt = prompt_manager.format_prompt(
+                "user_analyst_batch_analysis",
+                count=len(user_data_list),
+                criteria=criteria,
+                user_inputs="\n\n".join(
+                    f"### 用户{i}\n{user_data}"
+                    for i, user_data in enumerate(user_data_list, 1)
+                ),
+            )
+            try:
+                response = await self.call_llm(user_prompt, system_prompt)
+                return self._parse_batch_response(response, len(user_data_list))
+            except Exception as e:
+                logger.warning(
+                    f"⚠️ {self.agent_name} 合并分析 {len(user_data_list)} 个用户失败，回退为逐个调用: {e}"
+                )
+
+        results = await asyncio.gather(
+            *(self.analyze_users(user_data, criteria) for user_data in user_data_list),
+            return_exceptions=True,
+        )
+        return [None if isinstance(result, BaseException) else result for result in results]
+
+    @staticmethod
+    def _parse_batch_response(response: Optional[str], count: int) -> List[str]:
+        """解析合并调用返回的JSON字符串数组，格式不符时抛出ValueError"""
+
+        if not response:
+            raise ValueError("LLM未返回内容")
+
+        start, end = response.find("["), response.rfind("]")
+        if start < 0 or end < start:
+            raise ValueError("响应中没有JSON数组")
+        items = json_utils.loads(response[start : end + 1])
+        if not isinstance(items, list) or len(items) != count:
+            raise ValueError(f"响应数组应包含 {count} 个元素")
+        if not all(isinstance(item, str) for item in items):
+            raise ValueError("响应数组元素不是字符串")
+        return [item.strip() for item in items]
+
+    async def stream_analyze_users(
+        self, user_data: str, criteria: str
+    ) -> AsyncIterator[str]:
+        """用户分析LLM流式调用，调用方只需要部分输出时可提前关闭以中止生成"""
+
+        system_prompt, user_prompt = self._analysis_prompts(user_data, criteria)
+        messages = self.llm_manager.create_prompt_messages(system_prompt, user_prompt)
+        async for chunk in self.llm_manager.astream_with_fallback(
+            messages, self.preferred_provider
+        ):
+            yield chunk
+
+    def _analysis_prompts(self, user_data: str, criteria: str) -> Tuple[str, str]:
+        """构建用户分析的系统提示词和任务提示词"""
 
         system_prompt = prompt_manager.format_prompt(
             "user_analyst_system", agent_name=self.agent_name
         )
-
         user_prompt = prompt_manager.format_prompt(
             "user_analyst_analysis", criteria=criteria, user_data=user_data
         )
+        return system_prompt, user_prompt
 
-        return await call_llm(
-            system_prompt, user_prompt, preferred_provider=self.preferred_provider
+    @semantic_cached(
+        key_func=lambda self, user_profiles, business_goals: (
+            (self.agent_name, self.preferred_provider),
+            f"{business_goals}\n{user_profiles}",
         )
-
+    )
     async def create_content_strategy(
         self, user_profiles: str, business_goals: str
     ) -> Optional[str]:
@@ -276,6 +796,12 @@ class AgentLLMCaller:
             system_prompt, user_prompt, preferred_provider=self.preferred_provider
         )
 
+    @semantic_cached(
+        key_func=lambda self, strategy, target_audience, themes: (
+            (self.agent_name, self.preferred_provider),
+            f"{strategy}\n{target_audience}\n{themes}",
+        )
+    )
     async def generate_content(
         self, strategy: str, target_audience: str, themes: str
     ) -> Optional[str]:
@@ -8,6 +8,8 @@ from dataclasses import dataclass
 from datetime import datetime
 import asyncio
 
+import numpy as np
+
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
@@ -170,9 +172,7 @@ class MultiAgentWorkflow:
                 raise ValueError("缺少用户分析结果，无法制定内容策略")
 
             # 分析用户特征，制定内容策略
-            strategy = await self._analyze_user_characteristics(
-                analysis_result.high_value_users
-            )
+            strategy = await self._analyze_user_characteristics(analysis_result)
             state["content_strategy"] = strategy
 
             result = AgentResult(
@@ -346,37 +346,23 @@ class MultiAgentWorkflow:
         return state
 
     async def _analyze_user_characteristics(
-        self, users: List[UserProfile]
+        self, analysis_result: AnalysisResult
     ) -> Dict[str, Any]:
         """分析用户特征，制定内容策略"""
 
+        users = analysis_result.high_value_users
         if not users:
             return {
                 "strategy_summary": "无用户数据，无法制定策略",
                 "target_segments": [],
             }
 
-        # 分析用户群体特征
-        emotional_dist = {}
-        aips_dist = {}
-        unmet_needs = []
-
-        for user in users:
-            # 情感分布
-            emotional_dist[user.emotional_preference] = (
-                emotional_dist.get(user.emotional_preference, 0) + 1
-            )
-            # AIPS分布
-            aips_dist[user.aips_preference] = aips_dist.get(user.aips_preference, 0) + 1
-            # 收集未满足需求
-            if user.unmet_desc:
-                unmet_needs.append(user.unmet_desc)
+        # 分析用户群体特征：基于分析结果的列式视图统计情感和AIPS分布
+        unmet_needs = [user.unmet_desc for user in users if user.unmet_desc]
 
         # 识别主要用户群体
-        primary_emotion = (
-            max(emotional_dist, key=emotional_dist.get) if emotional_dist else "未知"
-        )
-        primary_aips = max(aips_dist, key=aips_dist.get) if aips_dist else "未知"
+        primary_emotion = self._most_common_value(analysis_result.emotional_preferences)
+        primary_aips = self._most_common_value(analysis_result.aips_preferences)
 
         # 制定针对性策略
         strategy = {
@@ -388,8 +374,7 @@ class MultiAgentWorkflow:
                     "characteristics": {
                         "emotional_preference": primary_emotion,
                         "aips_preference": primary_aips,
-                        "avg_value_score": sum(u.value_score for u in users)
-                        / len(users),
+                        "avg_value_score": float(analysis_result.value_scores.mean()),
                     },
                     "content_themes": self._suggest_content_themes(
                         primary_emotion, primary_aips
@@ -403,6 +388,16 @@ class MultiAgentWorkflow:
 
         return strategy
 
+    @staticmethod
+    def _most_common_value(values: np.ndarray) -> str:
+        """返回出现次数最多的取值，并列时取最先出现的"""
+
+        uniques, first_index, counts = np.unique(
+            values, return_index=True, return_counts=True
+        )
+        # 先按次数降序，再按首次出现位置升序
+        return uniques[np.lexsort((first_index, -counts))[0]]
+
     def _suggest_content_themes(self, emotion: str, aips: str) -> List[str]:
         """根据用户特征建议内容主题"""
 
@@ -471,48 +466,61 @@ class MultiAgentWorkflow:
     ) -> Dict[str, Any]:
         """创建协调执行计划"""
 
-        plan = {
+        phases = (
+            self._user_outreach_phase(user_result),
+            self._content_delivery_phase(content),
+            self._monitoring_phase(),
+        )
+
+        return {
             "plan_summary": "Multi-Agent协调执行计划",
-            "execution_phases": [],
+            "execution_phases": [phase for phase in phases if phase is not None],
             "resource_allocation": {},
             "success_metrics": {},
             "timeline": "即时执行",
             "created_at": datetime.now(),
         }
 
-        # 阶段1：用户触达
-        if user_result and user_result.high_value_users:
-            plan["execution_phases"].append(
-                {
-                    "phase": "用户触达",
-                    "description": f"触达{len(user_result.high_value_users)}个高价值用户",
-                    "priority": "high",
-                    "estimated_impact": "high",
-                }
-            )
+    @staticmethod
+    def _user_outreach_phase(
+        user_result: Optional[AnalysisResult],
+    ) -> Optional[Dict[str, Any]]:
+        """阶段1：用户触达，没有高价值用户时跳过"""
 
-        # 阶段2：内容投放
-        if content and content.get("content_pieces"):
-            plan["execution_phases"].append(
-                {
-                    "phase": "内容投放",
-                    "description": f"投放{len(content['content_pieces'])}个针对性内容",
-                    "priority": "high",
-                    "estimated_impact": "medium",
-                }
-            )
+        if not (user_result and user_result.high_value_users):
+            return None
+        return {
+            "phase": "用户触达",
+            "description": f"触达{len(user_result.high_value_users)}个高价值用户",
+            "priority": "high",
+            "estimated_impact": "high",
+        }
 
-        # 阶段3：效果监控
-        plan["execution_phases"].append(
-            {
-                "phase": "效果监控",
-                "description": "监控用户反馈和转化效果",
-                "priority": "medium",
-                "estimated_impact": "high",
-            }
-        )
+    @staticmethod
+    def _content_delivery_phase(
+        content: Optional[Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        """阶段2：内容投放，没有生成内容时跳过"""
+
+        if not (content and content.get("content_pieces")):
+            return None
+        return {
+            "phase": "内容投放",
+            "description": f"投放{len(content['content_pieces'])}个针对性内容",
+            "priority": "high",
+            "estimated_impact": "medium",
+        }
 
-        return plan
+    @staticmethod
+    def _monitoring_phase() -> Dict[str, Any]:
+        """阶段3：效果监控，始终执行"""
+
+        return {
+            "phase": "效果监控",
+            "description": "监控用户反馈和转化效果",
+            "priority": "medium",
+            "estimated_impact": "high",
+        }
 
     async def execute_workflow(
         self, initial_input: Optional[Dict[str, Any]] = None
@@ -3,11 +3,11 @@
 负责整体内容策略制定、Agent间协调、工作流编排
 """
 
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Tuple, Union
 from dataclasses import dataclass, asdict
 from datetime import datetime
 import asyncio
-import json
+import functools
 from enum import Enum
 
 from app.agents.enhanced_user_analyst_agent import EnhancedUserAnalystAgent, EnhancedUserProfile
@@ -15,9 +15,24 @@ from app.agents.content_generator_agent import ContentGeneratorAgent, ContentGen
 from app.agents.llamaindex_manager import LlamaIndexManager
 from app.agents.llm_manager import AgentLLMCaller, ModelProvider
 from app.prompts.content_strategy_prompts import get_content_strategy_prompt
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
 
+@functools.lru_cache(maxsize=128)
+def _dumps_metrics(items: Tuple[Tuple[str, Any], ...]) -> str:
+    """序列化指标字典，相同的指标组合（如默认策略目标）只编码一次"""
+    return json_utils.dumps(dict(items))
+
+
+def serialize_target_metrics(target_metrics: Dict[str, Any]) -> str:
+    """序列化策略目标指标，值不可哈希时直接编码"""
+    try:
+        return _dumps_metrics(tuple(target_metrics.items()))
+    except TypeError:
+        return json_utils.dumps(target_metrics)
+
+
 class StrategyType(Enum):
     """策略类型"""
     ACQUISITION = "user_acquisition"  # 用户获取
@@ -94,7 +109,7 @@ class StrategyCoordinatorAgent:
         self.llm_caller = AgentLLMCaller(self.name, preferred_model_provider)
         self.user_analyst = EnhancedUserAnalystAgent(preferred_model_provider)
         self.content_generator = ContentGeneratorAgent(preferred_model_provider)
-        self.llamaindex_manager = LlamaIndexManager()
+        self.llamaindex_manager = LlamaIndexManager.instance()
         
         # 任务队列
         self.task_queue: List[AgentTask] = []
@@ -289,7 +304,7 @@ class StrategyCoordinatorAgent:
             # 构建策略变量
             variables = {
                 "strategy_type": objective.objective_type.value,
-                "target_metrics": json.dumps(objective.target_metrics, ensure_ascii=False),
+                "target_metrics": serialize_target_metrics(objective.target_metrics),
                 "timeline_days": str(objective.timeline_days),
                 "user_profile_summary": user_summary,
                 "budget_limit": str(objective.budget_limit or 0),
@@ -7,6 +7,9 @@ from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property
+
+import numpy as np
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, desc
@@ -18,9 +21,9 @@ from app.infra.models.note_models import XhsNote
 from app.utils.logger import app_logger as logger
 
 
-@dataclass
+@dataclass(slots=True)
 class UserProfile:
-    """用户画像数据结构"""
+    """用户画像数据结构 (slots数据类，批量分析时实例数量大，省去实例__dict__)"""
 
     user_id: str
     nickname: str
@@ -46,6 +49,28 @@ class AnalysisResult:
     analysis_time: datetime
     criteria_used: Dict[str, Any]
 
+    # 以下为高价值用户热点字段的列式 (SoA) 视图，首次访问时构建并缓存，
+    # 使聚合统计在NumPy中一次完成，而不是逐个用户访问属性；
+    # 视图不会随high_value_users变化而更新，修改用户列表后需构造新的AnalysisResult
+    @cached_property
+    def value_scores(self) -> np.ndarray:
+        """用户价值评分数组，使用float64与逐个求和的Python浮点结果保持一致"""
+        return np.fromiter(
+            (u.value_score for u in self.high_value_users),
+            dtype=np.float64,
+            count=len(self.high_value_users),
+        )
+
+    @cached_property
+    def emotional_preferences(self) -> np.ndarray:
+        """用户情感倾向数组"""
+        return np.array([u.emotional_preference for u in self.high_value_users], dtype=object)
+
+    @cached_property
+    def aips_preferences(self) -> np.ndarray:
+        """用户AIPS偏好数组"""
+        return np.array([u.aips_preference for u in self.high_value_users], dtype=object)
+
 
 class BaseAgent(ABC):
     """Agent基类"""
@@ -10,6 +10,7 @@ import logging
 
 from app.api.routers.agent_routes import router as agent_router
 from app.utils.logger import app_logger as logger
+from app.config.settings import settings
 
 
 # 创建FastAPI应用
@@ -97,11 +98,15 @@ async def startup_event():
     
     # 初始化Agent
     try:
+        from app.agents.llamaindex_manager import LlamaIndexManager
         from app.agents.strategy_coordinator_agent import StrategyCoordinatorAgent
         from app.agents.content_generator_agent import ContentGeneratorAgent
         from app.agents.enhanced_user_analyst_agent import EnhancedUserAnalystAgent
         from app.agents.enhanced_multi_agent_workflow import EnhancedMultiAgentWorkflow
         
+        # 先在线程池中加载共享的LlamaIndex索引，避免各Agent首次获取单例时同步读盘阻塞事件循环
+        await LlamaIndexManager.ainstance()
+        
         # 预加载Agent实例
         coordinator = StrategyCoordinatorAgent()
         content_gen = ContentGeneratorAgent()
@@ -113,6 +118,25 @@ async def startup_event():
     except Exception as e:
         logger.error(f"❌ Agent初始化失败: {e}")
         raise
+    
+    # 恢复上次运行持久化的语义缓存
+    if settings.SEMANTIC_CACHE_PATH:
+        try:
+            from app.agents.llm_cache import semantic_llm_cache
+            
+            if semantic_llm_cache.load(settings.SEMANTIC_CACHE_PATH):
+                logger.info(f"✅ 语义缓存已恢复，共{len(semantic_llm_cache)}条")
+        except Exception as e:
+            logger.warning(f"⚠️ 语义缓存恢复失败: {e}")
+    
+    # 预热数据库连接池，数据库不可用时不阻止应用启动
+    try:
+        from app.infra.db.async_database import warm_up_pool
+        
+        warmed = await warm_up_pool()
+        logger.info(f"✅ 数据库连接池预热完成，建立{warmed}个连接")
+    except Exception as e:
+        logger.warning(f"⚠️ 数据库连接池预热失败: {e}")
 
 
 @app.on_event("shutdown")
@@ -127,6 +151,22 @@ async def shutdown_event():
         logger.info("✅ 数据库连接已关闭")
     except Exception as e:
         logger.error(f"❌ 关闭数据库连接失败: {e}")
+    
+    try:
+        from app.agents.llm_manager import LLMModelManager
+        await LLMModelManager.instance().aclose()
+        logger.info("✅ LLM HTTP连接池已关闭")
+    except Exception as e:
+        logger.error(f"❌ 关闭LLM HTTP连接池失败: {e}")
+    
+    if settings.SEMANTIC_CACHE_PATH:
+        try:
+            from app.agents.llm_cache import semantic_llm_cache
+            
+            semantic_llm_cache.save(settings.SEMANTIC_CACHE_PATH)
+            logger.info("✅ 语义缓存已持久化")
+        except Exception as e:
+            logger.error(f"❌ 语义缓存持久化失败: {e}")
 
 
 # 运行应用的主函数
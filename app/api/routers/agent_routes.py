@@ -6,6 +6,7 @@ Multi-Agent系统的FastAPI接口
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import asyncio
 
@@ -15,6 +16,7 @@ from app.agents.enhanced_user_analyst_agent import EnhancedUserAnalystAgent
 from app.agents.enhanced_multi_agent_workflow import EnhancedMultiAgentWorkflow
 from app.agents.llamaindex_manager import LlamaIndexManager
 from app.agents.llm_manager import ModelProvider
+from app.utils import json_utils
 from app.utils.logger import app_logger as logger
 
 
@@ -371,6 +373,18 @@ async def get_user_insights(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/users/query/stream")
+async def stream_user_query(question: str):
+    """智能用户查询 - 以SSE逐块推送回答，首个文本块生成后即可展示"""
+    
+    async def event_stream():
+        async for chunk in user_analyst.stream_smart_user_query(question):
+            yield f"data: {json_utils.dumps({'delta': chunk})}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/strategy/optimize", response_model=Dict[str, Any])
 async def optimize_strategy(
     plan_id: str,
@@ -23,6 +23,10 @@ class Settings(BaseSettings):
     DB_USER: str = os.getenv("DB_USER", "root")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "password")
     DB_NAME: str = os.getenv("DB_NAME", "xhs-kos-agent")
+    # 连接池设置，启动时预先建立DB_POOL_WARMUP个连接
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_WARMUP: int = int(os.getenv("DB_POOL_WARMUP", "5"))
 
     # 安全设置
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
@@ -77,6 +81,49 @@ class Settings(BaseSettings):
     ANTHROPIC_KEY: str = os.getenv("ANTHROPIC_KEY", "")
     ANTHROPIC_URL: str = os.getenv("ANTHROPIC_URL", "")
 
+    # Agent并发设置
+    CONTENT_GEN_CONCURRENCY: int = int(os.getenv("CONTENT_GEN_CONCURRENCY", "8"))
+    # 批量生成时每次LLM调用合并的用户数 (1为不合并)
+    CONTENT_GEN_PACK_SIZE: int = int(os.getenv("CONTENT_GEN_PACK_SIZE", "8"))
+    LLM_BATCH_CONCURRENCY: int = int(os.getenv("LLM_BATCH_CONCURRENCY", "10"))
+    # 每个模型提供商的在途LLM请求上限，所有Agent共享
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "10"))
+    # LLM请求对冲：在途请求超过该时间（毫秒）未返回时并发请求下一个提供商 (0为关闭，严格顺序备选)
+    LLM_HEDGE_AFTER_MS: int = int(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+    # Agent LLM调用的微批处理窗口（毫秒，默认0即关闭，开启后每次调用至少等待一个窗口）及单批最大请求数
+    LLM_BATCH_WINDOW_MS: int = int(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+    LLM_BATCH_MAX_SIZE: int = int(os.getenv("LLM_BATCH_MAX_SIZE", "32"))
+    # 共享HTTP连接池的最大连接数及保持长连接数
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+    LLM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "50"))
+    # 并发获取和增强用户洞察的上限（工作流用户分析、增强版用户画像）
+    USER_INSIGHT_CONCURRENCY: int = int(os.getenv("USER_INSIGHT_CONCURRENCY", "8"))
+    # 生成增强用户画像AI洞察时每次LLM调用合并的用户数 (1为逐个用户流式生成)
+    USER_INSIGHT_BATCH_SIZE: int = int(os.getenv("USER_INSIGHT_BATCH_SIZE", "5"))
+
+    # LLM响应缓存设置 (TTL为0时关闭缓存)
+    LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", "3600"))
+    LLM_CACHE_SIZE: int = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+    # 语义缓存：提示词嵌入余弦相似度不低于阈值时复用响应 (阈值>=1时关闭)
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+    # 语义缓存条目有效期（秒，为0时不过期）及持久化文件，应用关闭时保存、启动时恢复
+    # (路径默认为空即不持久化；文件以pickle保存，只应指向受信任的位置)
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+    SEMANTIC_CACHE_PATH: str = os.getenv("SEMANTIC_CACHE_PATH", "")
+    # 工作流节点缓存：相同输入的节点在TTL内直接复用上次结果 (默认为0即关闭；策略规划和用户分析读取实时数据库数据，
+    # 开启后TTL内数据变化不会反映到结果中)
+    WORKFLOW_NODE_CACHE_TTL: int = int(os.getenv("WORKFLOW_NODE_CACHE_TTL", "0"))
+    # 工作流阶段检查点目录，中断后可从未完成的阶段继续 (默认为空即关闭；检查点以pickle保存，只应指向受信任的目录)
+    WORKFLOW_CHECKPOINT_DIR: str = os.getenv("WORKFLOW_CHECKPOINT_DIR", "")
+    # 构建索引时单次嵌入请求包含的文本数及并发请求的批次数
+    EMBED_BATCH_SIZE: int = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+    EMBED_NUM_WORKERS: int = int(os.getenv("EMBED_NUM_WORKERS", "8"))
+    # 构建索引时按文本内容哈希缓存文档嵌入（存放在索引目录的SQLite中），重建时只嵌入变化的文本
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    # 批量语义检索的嵌入矩阵超过该条数时按int8标量量化存储，内存减为1/4 (为0时不量化)
+    VECTOR_INT8_MIN_SIZE: int = int(os.getenv("VECTOR_INT8_MIN_SIZE", "10000"))
+
     # 日志设置
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
@@ -1,4 +1,4 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 import atexit
 import asyncio
 import weakref
@@ -22,8 +22,8 @@ async_engine = create_async_engine(
     pool_pre_ping=True,
     echo=False,  # Only echo SQL in debug mode
     pool_recycle=3600,  # Recycle connections every hour
-    pool_size=10,  # Connection pool size
-    max_overflow=20,  # Max overflow connections
+    pool_size=settings.DB_POOL_SIZE,  # Connection pool size
+    max_overflow=settings.DB_MAX_OVERFLOW,  # Max overflow connections
     pool_use_lifo=True,  # 使用 LIFO 策略，让最近使用的连接被优先返回，这样不活跃的连接更可能被自动清理
 )
 
@@ -102,6 +102,36 @@ class DatabaseManager:
 db_manager = DatabaseManager()
 
 
+async def warm_up_pool(connections: Optional[int] = None) -> int:
+    """
+    预先并发建立连接填充连接池，避免首批并发请求各自承担建连延迟
+
+    Args:
+        connections: 预建连接数，默认使用 settings.DB_POOL_WARMUP，不超过连接池大小
+
+    Returns:
+        int: 成功建立的连接数
+    """
+    count = settings.DB_POOL_WARMUP if connections is None else connections
+    count = min(count, settings.DB_POOL_SIZE)
+    if count <= 0:
+        return 0
+
+    # 同时持有count个连接，确保连接池中实际建立了count个不同的连接
+    results = await asyncio.gather(
+        *(async_engine.connect().start() for _ in range(count)),
+        return_exceptions=True,
+    )
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+
+    # 关闭连接即归还连接池
+    await asyncio.gather(*(conn.close() for conn in opened))
+
+    if not opened:
+        raise next(err for err in results if isinstance(err, BaseException))
+    return len(opened)
+
+
 # 异步数据库会话依赖
 async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
     """FastAPI dependency that provides an async database session."""
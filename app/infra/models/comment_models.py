@@ -24,7 +24,7 @@ class XhsComment(Base):
     comment_id = Column(String(64), primary_key=True, index=True, comment="评论ID")
     note_id = Column(String(64), ForeignKey("xhs_notes.note_id"), comment="笔记ID")
     parent_comment_id = Column(String(64), nullable=True, comment="父评论ID")
-    comment_user_id = Column(String(64), nullable=False, comment="评论用户ID")
+    comment_user_id = Column(String(64), nullable=False, index=True, comment="评论用户ID")
     comment_user_image = Column(String(255), nullable=True, comment="评论者头像URL")
     comment_user_nickname = Column(String(128), nullable=True, comment="评论用户昵称")
     comment_user_home_page_url = Column(
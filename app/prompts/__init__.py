@@ -3,9 +3,10 @@ Prompts管理模块
 统一管理所有LLM提示词，支持模板化和多语言
 """
 
-from typing import Dict, Any, Optional
+import string
+from typing import Dict, Any, List, Optional, Tuple
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class PromptType(Enum):
@@ -33,18 +34,66 @@ class PromptTemplate:
     template: str
     description: str
     variables: list
+    # 预拆分的模板片段 [(字面文本, 变量名或None)]，首次格式化时解析
+    _pieces: Optional[List[Tuple[str, Optional[str]]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
     
     def format(self, **kwargs) -> str:
         """格式化提示词模板"""
+        pieces = self._get_pieces()
         try:
-            return self.template.format(**kwargs)
+            if not pieces:
+                return self.template.format(**kwargs)
+            
+            # 直接拼接预拆分的片段，避免每次调用都重新解析整段模板
+            parts = []
+            for literal, name in pieces:
+                parts.append(literal)
+                if name is not None:
+                    parts.append(str(kwargs[name]))
+            return "".join(parts)
         except KeyError as e:
             missing_var = str(e).strip("'")
             raise ValueError(f"缺少必需的变量: {missing_var}。需要的变量: {self.variables}")
+    
+    def format_split(self, **kwargs) -> Tuple[str, str]:
+        """
+        格式化并拆分为 (静态指令, 输入部分)
+        静态指令取首个变量之前、最后一个空行之前的文本，不随请求变化，可作为系统提示词命中前缀缓存；
+        无法拆分时静态指令为空字符串
+        """
+        text = self.format(**kwargs)
+        pieces = self._get_pieces()
+        if not pieces or pieces[0][1] is None:
+            return "", text
+        
+        cut = pieces[0][0].rfind("\n\n")
+        if cut <= 0:
+            return "", text
+        return text[:cut], text[cut + 2:]
+    
+    def _get_pieces(self) -> List[Tuple[str, Optional[str]]]:
+        """解析模板为片段列表，含格式说明符等复杂占位符时返回空列表以回退到str.format"""
+        if self._pieces is None:
+            pieces = []
+            for literal, name, format_spec, conversion in string.Formatter().parse(self.template):
+                if name is not None and (
+                    format_spec or conversion or not name.isidentifier()
+                ):
+                    pieces = []
+                    break
+                pieces.append((literal, name))
+            self._pieces = pieces
+        return self._pieces
 
 
 class PromptManager:
-    """提示词管理器"""
+    """
+    提示词管理器
+    任务提示词统一把固定的任务说明放在前面、可变数据放在末尾，
+    使 系统提示词+任务说明 构成跨调用不变的前缀，便于提供商侧前缀缓存命中
+    """
     
     def __init__(self):
         self.prompts: Dict[str, PromptTemplate] = {}
@@ -75,21 +124,38 @@ class PromptManager:
             name="user_analyst_analysis",
             agent_type=AgentType.USER_ANALYST,
             prompt_type=PromptType.USER,
-            template="""请分析以下用户数据，根据给定条件识别高价值用户：
-
-筛选条件：{criteria}
-
-用户数据：{user_data}
+            template="""请分析下方用户数据，根据给定条件识别高价值用户。
 
 请提供：
 1. 用户价值评估
 2. 情感倾向分析  
 3. 未满足需求识别
-4. 营销建议""",
+4. 营销建议
+
+筛选条件：{criteria}
+
+用户数据：{user_data}""",
             description="用户分析的具体任务提示词",
             variables=["criteria", "user_data"]
         ))
         
+        self.register_prompt(PromptTemplate(
+            name="user_analyst_batch_analysis",
+            agent_type=AgentType.USER_ANALYST,
+            prompt_type=PromptType.USER,
+            template="""请按照给定要求，分别分析文末列出的{count}位用户。
+
+输出要求：只输出一个JSON字符串数组，按用户顺序每位用户一个元素，元素为该用户的分析结果文本，不要输出其他任何文字。
+
+分析要求：{criteria}
+
+各用户数据：
+
+{user_inputs}""",
+            description="多个用户合并为一次调用的用户分析提示词",
+            variables=["count", "criteria", "user_inputs"]
+        ))
+        
         # 内容策略Agent提示词
         self.register_prompt(PromptTemplate(
             name="content_strategy_system",
@@ -112,18 +178,18 @@ class PromptManager:
             name="content_strategy_creation",
             agent_type=AgentType.CONTENT_STRATEGY,
             prompt_type=PromptType.USER,
-            template="""基于以下用户画像数据，制定针对性的内容策略：
-
-目标用户画像：{user_profiles}
-
-业务目标：{business_goals}
+            template="""基于下方用户画像数据，制定针对性的内容策略。
 
 请制定包含以下内容的策略：
 1. 用户群体细分
 2. 内容主题建议
 3. 创作方向指导
 4. 投放策略建议
-5. 效果评估方法""",
+5. 效果评估方法
+
+业务目标：{business_goals}
+
+目标用户画像：{user_profiles}""",
             description="内容策略制定的具体任务提示词",
             variables=["user_profiles", "business_goals"]
         ))
@@ -150,20 +216,20 @@ class PromptManager:
             name="content_generator_creation",
             agent_type=AgentType.CONTENT_GENERATOR,
             prompt_type=PromptType.USER,
-            template="""根据以下策略和要求，生成具体的内容方案：
-
-内容策略：{strategy}
-
-目标受众：{target_audience}
-
-内容主题：{themes}
+            template="""根据下方策略和要求，生成具体的内容方案。
 
 请生成：
 1. 3-5个吸引人的内容标题
 2. 详细的内容大纲
 3. 关键话题和角度
 4. 互动引导方案
-5. 传播优化建议""",
+5. 传播优化建议
+
+内容策略：{strategy}
+
+目标受众：{target_audience}
+
+内容主题：{themes}""",
             description="内容生成的具体任务提示词",
             variables=["strategy", "target_audience", "themes"]
         ))
@@ -191,11 +257,7 @@ class PromptManager:
             name="strategy_coordinator_coordination",
             agent_type=AgentType.STRATEGY_COORDINATOR,
             prompt_type=PromptType.USER,
-            template="""整合以下所有Agent的分析结果，制定统一的执行计划：
-
-各Agent分析结果：{all_agent_results}
-
-业务背景：{business_context}
+            template="""整合下方所有Agent的分析结果，制定统一的执行计划。
 
 请制定包含以下内容的协调方案：
 1. 整体执行策略
@@ -203,7 +265,11 @@ class PromptManager:
 3. 资源分配建议
 4. 时间线规划
 5. 风险评估和应对
-6. 成功指标和监控方案""",
+6. 成功指标和监控方案
+
+业务背景：{business_context}
+
+各Agent分析结果：{all_agent_results}""",
             description="策略协调的具体任务提示词",
             variables=["all_agent_results", "business_context"]
         ))
@@ -231,14 +297,16 @@ class PromptManager:
             name="task_analyzer_analysis",
             agent_type=AgentType.TASK_ANALYZER,
             prompt_type=PromptType.USER,
-            template="""请分析以下Multi-Agent任务需求：{task_input}
+            template="""请分析下方的Multi-Agent任务需求。
 
 请提供：
 1. 任务目标分析
 2. 关键成功因素识别
 3. 资源需求评估
 4. 潜在风险和挑战
-5. 执行建议和优化方向""",
+5. 执行建议和优化方向
+
+任务需求：{task_input}""",
             description="任务分析的具体分析提示词",
             variables=["task_input"]
         ))
@@ -7,25 +7,15 @@ from app.prompts import PromptTemplate, AgentType, PromptType
 
 
 # 内容生成相关的专业提示词
+# 模板统一采用"静态指令在前、请求输入在后"的结构，品牌/限制等批次级输入紧随静态指令，
+# 主题、用户画像等单次请求输入放在末尾，便于模型服务商命中前缀缓存
 CONTENT_GENERATOR_PROMPTS = {
     
     "creative_content_generation": PromptTemplate(
         name="creative_content_generation",
         agent_type=AgentType.CONTENT_GENERATOR,
         prompt_type=PromptType.USER,
-        template="""作为创意内容专家，请基于以下要求生成高质量的原创内容：
-
-内容需求概述：
-{content_requirements}
-
-目标受众画像：
-{target_audience_profile}
-
-品牌调性指南：
-{brand_tone_guidelines}
-
-创意限制条件：
-{creative_constraints}
+        template="""作为创意内容专家，请基于文末给出的要求生成高质量的原创内容。
 
 请生成以下类型的创意内容：
 
@@ -59,7 +49,21 @@ CONTENT_GENERATOR_PROMPTS = {
    - 格式要求匹配
    - 算法友好优化
 
-输出要求：完整可用的内容方案，包含执行细节。""",
+输出要求：完整可用的内容方案，包含执行细节。
+
+以下是本次创作的输入信息：
+
+品牌调性指南：
+{brand_tone_guidelines}
+
+创意限制条件：
+{creative_constraints}
+
+内容需求概述：
+{content_requirements}
+
+目标受众画像：
+{target_audience_profile}""",
         description="创意内容生成的专业提示词",
         variables=["content_requirements", "target_audience_profile", "brand_tone_guidelines", "creative_constraints"]
     ),
@@ -68,19 +72,7 @@ CONTENT_GENERATOR_PROMPTS = {
         name="storytelling_content",
         agent_type=AgentType.CONTENT_GENERATOR,
         prompt_type=PromptType.USER,
-        template="""运用故事叙述技巧，创作引人入胜的故事性内容：
-
-故事主题：
-{story_theme}
-
-角色设定：
-{character_settings}
-
-情节要求：
-{plot_requirements}
-
-情感目标：
-{emotional_objectives}
+        template="""运用故事叙述技巧，基于文末给出的要求创作引人入胜的故事性内容。
 
 请创作故事性内容：
 
@@ -114,7 +106,21 @@ CONTENT_GENERATOR_PROMPTS = {
    - 行为引导暗示
    - 品牌价值植入
 
-输出要求：完整的故事内容，具备强烈的情感感染力。""",
+输出要求：完整的故事内容，具备强烈的情感感染力。
+
+以下是本次创作的输入信息：
+
+故事主题：
+{story_theme}
+
+角色设定：
+{character_settings}
+
+情节要求：
+{plot_requirements}
+
+情感目标：
+{emotional_objectives}""",
         description="故事性内容创作的专业提示词",
         variables=["story_theme", "character_settings", "plot_requirements", "emotional_objectives"]
     ),
@@ -123,19 +129,7 @@ CONTENT_GENERATOR_PROMPTS = {
         name="educational_content",
         agent_type=AgentType.CONTENT_GENERATOR,
         prompt_type=PromptType.USER,
-        template="""创作具有教育价值的知识性内容：
-
-知识主题：
-{knowledge_topic}
-
-受众知识水平：
-{audience_knowledge_level}
-
-学习目标：
-{learning_objectives}
-
-内容深度要求：
-{content_depth_requirements}
+        template="""基于文末给出的要求，创作具有教育价值的知识性内容。
 
 请创作教育性内容：
 
@@ -169,7 +163,21 @@ CONTENT_GENERATOR_PROMPTS = {
    - 视觉记忆辅助
    - 应用场景关联
 
-输出要求：系统完整的教育内容，易懂易记易应用。""",
+输出要求：系统完整的教育内容，易懂易记易应用。
+
+以下是本次创作的输入信息：
+
+知识主题：
+{knowledge_topic}
+
+受众知识水平：
+{audience_knowledge_level}
+
+学习目标：
+{learning_objectives}
+
+内容深度要求：
+{content_depth_requirements}""",
         description="教育性内容创作的专业提示词",
         variables=["knowledge_topic", "audience_knowledge_level", "learning_objectives", "content_depth_requirements"]
     ),
@@ -178,19 +186,7 @@ CONTENT_GENERATOR_PROMPTS = {
         name="entertainment_content",
         agent_type=AgentType.CONTENT_GENERATOR,
         prompt_type=PromptType.USER,
-        template="""创作具有娱乐性和趣味性的轻松内容：
-
-娱乐主题：
-{entertainment_theme}
-
-幽默风格偏好：
-{humor_style_preference}
-
-受众兴趣特点：
-{audience_interest_characteristics}
-
-内容时长要求：
-{content_duration_requirements}
+        template="""基于文末给出的要求，创作具有娱乐性和趣味性的轻松内容。
 
 请创作娱乐性内容：
 
@@ -224,7 +220,21 @@ CONTENT_GENERATOR_PROMPTS = {
    - 二次创作空间
    - 分享动机激发
 
-输出要求：轻松有趣的娱乐内容，具备高传播潜力。""",
+输出要求：轻松有趣的娱乐内容，具备高传播潜力。
+
+以下是本次创作的输入信息：
+
+娱乐主题：
+{entertainment_theme}
+
+幽默风格偏好：
+{humor_style_preference}
+
+受众兴趣特点：
+{audience_interest_characteristics}
+
+内容时长要求：
+{content_duration_requirements}""",
         description="娱乐性内容创作的专业提示词",
         variables=["entertainment_theme", "humor_style_preference", "audience_interest_characteristics", "content_duration_requirements"]
     ),
@@ -233,19 +243,7 @@ CONTENT_GENERATOR_PROMPTS = {
         name="promotional_content",
         agent_type=AgentType.CONTENT_GENERATOR,
         prompt_type=PromptType.USER,
-        template="""创作具有推广效果的营销性内容：
-
-产品/服务信息：
-{product_service_info}
-
-销售目标：
-{sales_objectives}
-
-目标客户特征：
-{target_customer_profile}
-
-竞争优势：
-{competitive_advantages}
+        template="""基于文末给出的要求，创作具有推广效果的营销性内容。
 
 请创作推广性内容：
 
@@ -279,9 +277,38 @@ CONTENT_GENERATOR_PROMPTS = {
    - 生活场景关联
    - 梦想愿景描绘
 
-输出要求：有说服力的推广内容，平衡商业性和用户价值。""",
+输出要求：有说服力的推广内容，平衡商业性和用户价值。
+
+以下是本次创作的输入信息：
+
+产品/服务信息：
+{product_service_info}
+
+销售目标：
+{sales_objectives}
+
+目标客户特征：
+{target_customer_profile}
+
+竞争优势：
+{competitive_advantages}""",
         description="推广性内容创作的专业提示词",
         variables=["product_service_info", "sales_objectives", "target_customer_profile", "competitive_advantages"]
+    ),
+    
+    "multi_user_batch": PromptTemplate(
+        name="multi_user_batch",
+        agent_type=AgentType.CONTENT_GENERATOR,
+        prompt_type=PromptType.USER,
+        template="""请按照上述创作要求，为文末列出的{count}位用户分别创作内容。
+
+输出要求：只输出一个JSON数组，按用户顺序每位用户一个对象，包含 "title" (标题) 和 "content" (完整正文，含话题标签) 两个字段，不要输出其他任何文字。
+
+以下是各用户的输入信息：
+
+{user_inputs}""",
+        description="多个用户合并为一次调用生成内容的提示词，与对应内容类型的系统提示词配合使用",
+        variables=["count", "user_inputs"]
     )
 }
 
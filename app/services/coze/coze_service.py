@@ -18,6 +18,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config.settings import settings
 from app.utils.logger import app_logger as logger
+from app.utils import json_utils
 from app.utils.file import save_json_response
 from app.infra.db.async_database import get_async_db
 from app.infra.models.topic_models import XhsTopicsResponse
@@ -144,7 +145,7 @@ class CozeService:
                 return None, {}
 
             # 替换中文逗号为英文逗号
-            data_json = json.loads(result["data"])
+            data_json = json_utils.loads(result["data"])
 
             # 检查resp_data字段
             if "resp_data" in data_json:
@@ -168,7 +169,7 @@ class CozeService:
                 )
                 return None, {}
 
-        except json.JSONDecodeError as e:
+        except json.JSONDecodeError as e:  # orjson.JSONDecodeError是其子类
             logger.error(f"data字段JSON解析错误: {e}")
             logger.error("data字段内容:", result["data"])  # 打印原始字符串以便调试
             return None, {}
@@ -0,0 +1,41 @@
+"""
+JSON序列化工具
+优先使用orjson (C扩展) 进行序列化，未安装时回退到标准库json
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    # orjson为可选依赖，未安装时使用标准库实现
+    orjson = None
+
+
+def dumps(data: Any, sort_keys: bool = False) -> str:
+    """
+    将数据序列化为紧凑的JSON字符串，保留非ASCII字符 (等价于 ensure_ascii=False)
+
+    Args:
+        data: 要序列化的数据
+        sort_keys: 是否按键排序，用于需要字节一致输出的场景
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, option=option).decode()
+        except TypeError:
+            # orjson不支持的类型交给标准库处理，保持与原有行为一致
+            pass
+
+    return json.dumps(data, ensure_ascii=False, sort_keys=sort_keys)
+
+
+def loads(text: Union[str, bytes]) -> Any:
+    """解析JSON字符串"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -5,7 +5,7 @@ ContentGeneratorAgent测试套件
 import asyncio
 import pytest
 from datetime import datetime
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 from app.agents.content_generator_agent import (
     ContentGeneratorAgent,
@@ -13,6 +13,7 @@ from app.agents.content_generator_agent import (
     GeneratedContent,
     ContentStrategy
 )
+from app.config.settings import settings
 
 
 class TestContentGeneratorAgent:
@@ -134,6 +135,31 @@ class TestContentGeneratorAgent:
             assert isinstance(content, GeneratedContent)
             assert "#新手化妆教程" in content.hashtags
     
+    @pytest.mark.asyncio
+    async def test_generate_content_stream(self):
+        """测试流式内容生成"""
+        request = ContentGenerationRequest(
+            user_profile=self.test_user_profile,
+            content_type="creative",
+            topic="夏季护肤心得",
+            platform="xhs",
+            requirements={"tone": "friendly"}
+        )
+        
+        async def mock_stream(prompt, system_prompt=None):
+            for chunk in ["夏日护肤", "秘籍\n防晒要做好 #夏日", "护肤 #护肤心得\n"]:
+                yield chunk
+        
+        with patch.object(self.agent.llm_caller, 'stream_llm', mock_stream):
+            events = [event async for event in self.agent.generate_content_stream(request)]
+        
+        assert events[0] == {"event": "title", "title": "夏日护肤秘籍"}
+        streamed_tags = [tag for e in events if e["event"] == "hashtags" for tag in e["hashtags"]]
+        assert streamed_tags == ["夏日护肤", "护肤心得"]
+        assert events[-1]["event"] == "completed"
+        assert events[-1]["content"].title == "夏日护肤秘籍"
+        assert events[-1]["content"].hashtags == streamed_tags
+    
     @pytest.mark.asyncio
     async def test_generate_content_batch(self):
         """测试批量内容生成"""
@@ -166,7 +192,145 @@ class TestContentGeneratorAgent:
             assert all(isinstance(c, GeneratedContent) for c in contents)
     
     @pytest.mark.asyncio
-    async def test_platform_optimization(self):
+    async def test_generate_content_batch_coalesces_duplicates(self):
+        """测试批量生成时合并相同请求"""
+        request = ContentGenerationRequest(
+            user_profile=self.test_user_profile,
+            content_type="creative",
+            topic="夏季穿搭",
+            platform="xhs",
+            requirements={"tone": "casual"}
+        )
+        mock_call = AsyncMock(return_value="夏日清爽穿搭分享～\n\n今天这套真的太凉快了！#夏日穿搭")
+        
+        with patch.object(self.agent.llm_caller, 'call_llm', mock_call):
+            contents = await self.agent.generate_content_batch([request, request])
+        
+        assert mock_call.await_count == 1
+        assert len(contents) == 2
+        assert contents[0].content_id != contents[1].content_id
+        assert contents[0].main_content == contents[1].main_content
+    
+    @pytest.mark.asyncio
+    async def test_generate_content_batch_reuses_cached_results(self):
+        """测试跨批次的相同请求复用缓存的生成结果"""
+        cached_request = ContentGenerationRequest(
+            user_profile=self.test_user_profile,
+            content_type="creative",
+            topic="夏季穿搭",
+            platform="xhs",
+            requirements={"tone": "casual"}
+        )
+        new_request = ContentGenerationRequest(
+            user_profile=self.test_user_profile,
+            content_type="creative",
+            topic="秋季穿搭",
+            platform="xhs",
+            requirements={"tone": "casual"}
+        )
+        mock_call = AsyncMock(side_effect=[
+            "夏日清爽穿搭分享～\n\n今天这套真的太凉快了！#夏日穿搭",
+            "秋日温柔穿搭～\n\n针织开衫yyds！#秋季穿搭"
+        ])
+        
+        with patch.object(self.agent.llm_caller, 'call_llm', mock_call):
+            first = await self.agent.generate_content_batch([cached_request])
+            original_hashtags = list(first[0].hashtags)
+            # 调用方修改首次返回的结果，不应影响缓存中的条目
+            first[0].hashtags.append("调用方追加")
+            first[0].main_content = "调用方改写"
+            second = await self.agent.generate_content_batch([cached_request, new_request])
+        
+        assert mock_call.await_count == 2
+        assert second[0].main_content == "夏日清爽穿搭分享～\n\n今天这套真的太凉快了！#夏日穿搭"
+        assert second[0].hashtags == original_hashtags
+        assert second[0].content_id != first[0].content_id
+        assert (self.agent.content_cache_hits, self.agent.content_cache_misses) == (1, 2)
+    
+    @pytest.mark.asyncio
+    async def test_generate_content_batch_packs_users(self):
+        """测试除用户画像外输入相同的请求合并为一次LLM调用，格式错误时逐个生成"""
+        requests = [
+            ContentGenerationRequest(
+                user_profile={**self.test_user_profile, "user_id": f"user_{i}", "nickname": f"用户{i}"},
+                content_type="creative",
+                topic="夏季穿搭",
+                platform="xhs",
+                requirements={"tone": "casual"}
+            )
+            for i in range(3)
+        ]
+        packed_response = """[
+            {"title": "标题0", "content": "正文0 #穿搭"},
+            {"title": "标题1", "content": "正文1 #夏日"},
+            {"title": "标题2", "content": "正文2 #日常"}
+        ]"""
+        mock_call = AsyncMock(return_value=packed_response)
+        
+        with patch.object(self.agent.llm_caller, 'call_llm', mock_call):
+            contents = await self.agent.generate_content_batch(requests)
+        
+        assert mock_call.await_count == 1
+        prompt, system_prompt = mock_call.await_args.args
+        assert "用户0" in prompt and "用户2" in prompt
+        assert system_prompt.startswith("作为创意内容专家")
+        assert mock_call.await_args.kwargs["max_tokens"] == 2048 * 3
+        assert [c.title for c in contents] == ["标题0", "标题1", "标题2"]
+        assert [c.metadata["user_id"] for c in contents] == ["user_0", "user_1", "user_2"]
+        assert contents[1].hashtags == ["夏日"]
+        
+        self.agent._content_cache.clear()
+        fallback_call = AsyncMock(side_effect=["不是JSON", "单独生成\n正文", "单独生成\n正文", "单独生成\n正文"])
+        with patch.object(self.agent.llm_caller, 'call_llm', fallback_call):
+            contents = await self.agent.generate_content_batch(requests)
+        
+        assert fallback_call.await_count == 4
+        assert [c.title for c in contents] == ["单独生成"] * 3
+    
+    def test_plan_packs_by_output_bucket(self):
+        """测试按预估输出长度分档：长文案档位的包更小，不同档位不混在同一包"""
+        def make_request(i, platform, content_type):
+            return ContentGenerationRequest(
+                user_profile={**self.test_user_profile, "user_id": f"user_{i}"},
+                content_type=content_type,
+                topic="夏季穿搭",
+                platform=platform,
+                requirements={}
+            )
+        
+        requests = [make_request(i, "douyin", "creative") for i in range(3)]
+        requests += [make_request(i, "weibo", "storytelling") for i in range(3, 8)]
+        assert self.agent._output_token_bucket(requests[0]) == 1024
+        assert self.agent._output_token_bucket(requests[3]) == 4096
+        
+        groups = {i: [i] for i in range(len(requests))}
+        packs = self.agent._plan_packs(list(groups), groups, requests)
+        assert packs == [[0, 1, 2], [3, 4], [5, 6], [7]]
+    
+    def test_plan_packs_groups_similar_prompt_shapes(self):
+        """测试同组请求按提示词长度档位排序后再切包，长画像用户集中在同一包"""
+        requests = [
+            ContentGenerationRequest(
+                user_profile={
+                    **self.test_user_profile,
+                    "user_id": f"user_{i}",
+                    "ai_insights": "详细洞察" * 600 if i % 2 else ""
+                },
+                content_type="creative",
+                topic="夏季穿搭",
+                platform="xhs",
+                requirements={}
+            )
+            for i in range(4)
+        ]
+        assert self.agent._shape_key(requests[0])[0] < self.agent._shape_key(requests[1])[0]
+        
+        groups = {i: [i] for i in range(len(requests))}
+        with patch.object(settings, "CONTENT_GEN_PACK_SIZE", 2):
+            packs = self.agent._plan_packs(list(groups), groups, requests)
+        assert packs == [[0, 2], [1, 3]]
+    
+    def test_platform_optimization(self):
         """测试平台特定优化"""
         content = GeneratedContent(
             content_id="test_123",
@@ -182,13 +346,13 @@ class TestContentGeneratorAgent:
         )
         
         # 测试小红书优化
-        optimized = await self.agent._optimize_for_platform(content, "xhs")
+        optimized = self.agent._optimize_for_platform(content, "xhs")
         assert len(optimized.main_content) <= 1000
         assert len(optimized.hashtags) <= 10
         assert "max_chars" in optimized.platform_specific
         
         # 测试微博优化
-        optimized = await self.agent._optimize_for_platform(content, "weibo")
+        optimized = self.agent._optimize_for_platform(content, "weibo")
         assert len(optimized.main_content) <= 2000
         assert len(optimized.hashtags) <= 20
     
@@ -202,6 +366,13 @@ class TestContentGeneratorAgent:
         assert "小红书" in hashtags
         assert len(hashtags) == 2
     
+    def test_extract_hashtags_order_and_default(self):
+        """测试话题标签按出现顺序去重及默认标签"""
+        content = "#旅行 #美食 #旅行 #穿搭 #美食"
+        
+        assert self.agent._extract_hashtags(content) == ["旅行", "美食", "穿搭"]
+        assert self.agent._extract_hashtags("没有标签的内容") == ["内容分享", "生活记录", "今日分享"]
+    
     @pytest.mark.asyncio
     async def test_content_quality_validation(self):
         """测试内容质量验证"""
@@ -242,6 +413,37 @@ class TestContentGeneratorAgent:
         assert "interests" in context
         assert len(context["interests"]) > 0
     
+    @pytest.mark.asyncio
+    async def test_user_context_cache(self):
+        """测试同一用户的上下文检索只执行一次，检索结束后不残留用户锁"""
+        insights = {"user_id": "test_user_123", "total_records": 1, "comments": [{"content": "喜欢美妆"}]}
+        mock_query = AsyncMock(return_value=insights)
+        
+        with patch.object(self.agent.llamaindex_manager, 'get_user_insights', mock_query):
+            contexts = await asyncio.gather(
+                self.agent._get_user_context(self.test_user_profile),
+                self.agent._get_user_context(self.test_user_profile)
+            )
+            await self.agent._get_user_context(self.test_user_profile)
+        
+        assert mock_query.await_count == 1
+        mock_query.assert_awaited_with(self.test_user_profile["user_id"])
+        assert all(c["user_insights"] == insights for c in contexts)
+        assert not self.agent._ctx_locks
+    
+    @pytest.mark.asyncio
+    async def test_user_context_cache_skips_failed_query(self):
+        """测试用户洞察查询失败时回退为默认上下文，不缓存结果也不残留用户锁"""
+        mock_query = AsyncMock(return_value={"error": "数据库不可用"})
+        
+        with patch.object(self.agent.llamaindex_manager, 'get_user_insights', mock_query):
+            first = await self.agent._get_user_context(self.test_user_profile)
+            await self.agent._get_user_context(self.test_user_profile)
+        
+        assert mock_query.await_count == 2
+        assert first == self.agent._get_default_context()
+        assert not self.agent._ctx_cache and not self.agent._ctx_locks
+    
     def test_format_user_profile(self):
         """测试用户画像格式化"""
         profile_data = {
@@ -6,16 +6,26 @@ AI增强版Multi-Agent工作流测试脚本
 import asyncio
 import sys
 import os
+import time
+import pytest
+from dataclasses import dataclass, replace
 from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from app.agents.enhanced_multi_agent_workflow import (
     EnhancedMultiAgentWorkflow, 
+    EnhancedAgentResult,
+    EnhancedMultiAgentState,
+    SuccessOnlyNodeCache,
     test_enhanced_multi_agent_workflow
 )
+from app.agents import llm_cache
 from app.agents.llm_manager import ModelProvider
+from app.config.settings import settings
 from app.utils.logger import app_logger as logger
 
 
@@ -303,6 +313,272 @@ async def test_error_handling_and_fallback():
         return False
 
 
+@pytest.mark.asyncio
+async def test_parallel_branches_after_user_analysis():
+    """测试用户分析完成后内容生成与策略执行在同一超步中并行运行"""
+    
+    @dataclass
+    class MockUser:
+        user_id: str
+    
+    workflow = EnhancedMultiAgentWorkflow()
+    users = [MockUser(user_id=f"user_{i}") for i in range(3)]
+    content_plan = Mock(target_users=users)
+    execution_result = Mock(
+        actual_metrics={"engagement_rate": 0.06},
+        success_indicators={"engagement_rate": True},
+        optimization_suggestions=[]
+    )
+    timings = {}
+    
+    async def timed(name, value):
+        timings[name] = [time.perf_counter()]
+        await asyncio.sleep(0.2)
+        timings[name].append(time.perf_counter())
+        return value
+    
+    async def mock_insights(user_id):
+        return await timed(f"analysis_{user_id}", MockUser(user_id=user_id))
+    
+    async def mock_execute(plan):
+        return await timed("execution", execution_result)
+    
+    async def mock_generate(requests):
+        return await timed("generation", ["c1", "c2", "c3"])
+    
+    workflow.strategy_coordinator.create_content_strategy = AsyncMock(return_value=content_plan)
+    workflow.strategy_coordinator.execute_content_plan = mock_execute
+    workflow.user_analyst.get_user_insights = mock_insights
+    workflow.content_generator.generate_content_batch = mock_generate
+    
+    result = await workflow.execute_complete_workflow()
+    
+    # 两条分支都在用户分析结束后开始，且执行时间相互重叠
+    analysis_end = max(end for name, (_, end) in timings.items() if name.startswith("analysis_"))
+    (gen_start, gen_end), (exec_start, exec_end) = timings["generation"], timings["execution"]
+    assert gen_start >= analysis_end and exec_start >= analysis_end
+    assert gen_start < exec_end and exec_start < gen_end
+    
+    assert result["success"]
+    assert len(result["agent_results"]) == 4
+    assert all(r.success for r in result["agent_results"])
+    assert [u.user_id for u in result["target_users"]] == ["user_0", "user_1", "user_2"]
+    assert result["generated_content"] == ["c1", "c2", "c3"]
+    assert "✅ 成功的Agent: 4" in result["messages"][-1]
+    assert result["messages"][-1].count("EnhancedUserAnalystAgent: 成功分析3个高价值用户") == 1
+    assert result["performance_metrics"]["successful_agents"] == 4
+    assert result["performance_metrics"]["failed_agents"] == 0
+    assert result["execution_summary"].startswith("增强版Multi-Agent工作流完成：4/4 个Agent成功执行")
+
+
+@pytest.mark.asyncio
+async def test_execute_complete_workflow_stream():
+    """测试流式执行按阶段产出结果，最后产出与非流式接口一致的最终结果"""
+    
+    @dataclass
+    class MockUser:
+        user_id: str
+    
+    workflow = EnhancedMultiAgentWorkflow()
+    users = [MockUser(user_id=f"user_{i}") for i in range(2)]
+    execution_result = Mock(
+        actual_metrics={"engagement_rate": 0.06},
+        success_indicators={"engagement_rate": True},
+        optimization_suggestions=[]
+    )
+    
+    async def mock_insights(user_id):
+        return MockUser(user_id=user_id)
+    
+    workflow.strategy_coordinator.create_content_strategy = AsyncMock(return_value=Mock(target_users=users))
+    workflow.strategy_coordinator.execute_content_plan = AsyncMock(return_value=execution_result)
+    workflow.user_analyst.get_user_insights = mock_insights
+    workflow.content_generator.generate_content_batch = AsyncMock(return_value=["c1", "c2"])
+    
+    events = [event async for event in workflow.execute_complete_workflow_stream()]
+    
+    stages = [event["stage"] for event in events if event["event"] == "stage"]
+    assert stages[:2] == ["initialize_workflow", "strategy_planning"]
+    assert stages.index("user_analysis") < stages.index("content_generation")
+    assert stages[-1] == "finalize_workflow"
+    assert len(stages) == 6
+    
+    assert events[-1]["event"] == "completed"
+    result = events[-1]["result"]
+    assert result["success"]
+    assert result["generated_content"] == ["c1", "c2"]
+    assert result["performance_metrics"]["successful_agents"] == 4
+
+
+@pytest.mark.asyncio
+async def test_resume_workflow_from_checkpoint(tmp_path):
+    """测试有阶段失败时保留检查点，恢复执行只重跑未成功的阶段"""
+    
+    workflow = EnhancedMultiAgentWorkflow()
+    users = [SimpleNamespace(user_id=f"resume_user_{i}") for i in range(2)]
+    workflow.strategy_coordinator.create_content_strategy = AsyncMock(
+        return_value=SimpleNamespace(target_users=users)
+    )
+    workflow.strategy_coordinator.execute_content_plan = AsyncMock(return_value=SimpleNamespace(
+        actual_metrics={"engagement_rate": 0.06},
+        success_indicators={"engagement_rate": True},
+        optimization_suggestions=[]
+    ))
+    workflow.user_analyst.get_user_insights = AsyncMock(side_effect=lambda user_id: SimpleNamespace(user_id=user_id))
+    workflow.content_generator.generate_content_batch = AsyncMock(side_effect=[RuntimeError("LLM不可用"), ["c1", "c2"]])
+    strategy_input = {"strategy_objective": {"type": "user_engagement", "audience_size": 2}}
+    
+    with patch.object(settings, "WORKFLOW_CHECKPOINT_DIR", str(tmp_path)):
+        first = await workflow.execute_complete_workflow(strategy_input)
+        assert first["performance_metrics"]["failed_agents"] == 1
+        assert (tmp_path / f"{first['workflow_id']}.jsonl").exists()
+        
+        resumed = await workflow.execute_complete_workflow(strategy_input, resume_from=first["workflow_id"])
+        invalid = await workflow.execute_complete_workflow(resume_from="../etc")
+    
+    assert resumed["workflow_id"] == first["workflow_id"]
+    assert resumed["generated_content"] == ["c1", "c2"]
+    assert resumed["performance_metrics"]["successful_agents"] == 4
+    assert workflow.strategy_coordinator.execute_content_plan.await_count == 1
+    assert workflow.content_generator.generate_content_batch.await_count == 2
+    assert not (tmp_path / f"{first['workflow_id']}.jsonl").exists()
+    assert not invalid["success"]
+    
+    # 未启用检查点时传入恢复ID直接失败，不会重新执行任何阶段
+    with patch.object(settings, "WORKFLOW_CHECKPOINT_DIR", ""):
+        disabled = await workflow.execute_complete_workflow(resume_from=first["workflow_id"])
+    assert not disabled["success"]
+    assert "WORKFLOW_CHECKPOINT_DIR" in disabled["error"]
+    assert workflow.strategy_coordinator.create_content_strategy.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_user_analysis_skips_failed_users():
+    """测试用户分析阶段跳过获取洞察失败的用户并保持顺序"""
+    
+    @dataclass
+    class MockUser:
+        user_id: str
+    
+    workflow = EnhancedMultiAgentWorkflow()
+    users = [MockUser(user_id=f"user_{i}") for i in range(4)]
+    
+    async def mock_insights(user_id):
+        await asyncio.sleep(0.01 if user_id == "user_0" else 0)
+        if user_id == "user_2":
+            raise RuntimeError("检索失败")
+        return MockUser(user_id=f"{user_id}_enhanced")
+    
+    workflow.user_analyst.get_user_insights = mock_insights
+    
+    update = await workflow._user_analysis(
+        EnhancedMultiAgentState(content_plan=Mock(target_users=users))
+    )
+    
+    assert [u.user_id for u in update["target_users"]] == [
+        "user_0_enhanced", "user_1_enhanced", "user_3_enhanced"
+    ]
+    assert update["agent_results"][0].success
+
+
+@pytest.mark.asyncio
+async def test_user_analysis_dedupes_insight_lookups():
+    """测试重复用户只获取一次洞察，再次运行时命中缓存"""
+    
+    @dataclass
+    class MockUser:
+        user_id: str
+    
+    workflow = EnhancedMultiAgentWorkflow()
+    users = [MockUser(user_id=uid) for uid in ("user_0", "user_1", "user_0")]
+    calls = []
+    
+    async def mock_insights(user_id):
+        calls.append(user_id)
+        return MockUser(user_id=f"{user_id}_enhanced")
+    
+    workflow.user_analyst.get_user_insights = mock_insights
+    state = EnhancedMultiAgentState(content_plan=Mock(target_users=users))
+    
+    update = await workflow._user_analysis(state)
+    assert [u.user_id for u in update["target_users"]] == [
+        "user_0_enhanced", "user_1_enhanced", "user_0_enhanced"
+    ]
+    assert calls == ["user_0", "user_1"]
+    
+    await workflow._user_analysis(state)
+    assert calls == ["user_0", "user_1"]
+
+
+def test_workflow_graph_compiled_once():
+    """测试不同实例复用同一个预编译的工作流图"""
+    
+    first = EnhancedMultiAgentWorkflow()
+    second = EnhancedMultiAgentWorkflow(preferred_model_provider=ModelProvider.OPENROUTER)
+    
+    assert first.graph is second.graph
+
+
+@pytest.mark.asyncio
+async def test_user_insight_semantic_cache_partitioned_by_user():
+    """测试用户洞察语义缓存按用户分区，提示词相近的不同用户不会拿到其他用户的洞察"""
+    
+    async def mock_embed(text):
+        # 所有提示词向量相同，模拟只有用户ID等少量字符不同的长模板提示词
+        return [1.0, 0.0]
+    
+    async def mock_stream(analysis_prompt, criteria):
+        yield f"洞察:{analysis_prompt}"
+    
+    agent = EnhancedMultiAgentWorkflow().user_analyst
+    with patch.object(llm_cache, "semantic_llm_cache", llm_cache.SemanticLLMCache(embed_func=mock_embed)), \
+            patch.object(agent.llm_caller, "stream_analyze_users", mock_stream):
+        first = await agent._stream_user_insights("用户A的提示词", "user_a")
+        other = await agent._stream_user_insights("用户B的提示词", "user_b")
+        again = await agent._stream_user_insights("用户A的新提示词", "user_a")
+    
+    assert first == again == "洞察:用户A的提示词"
+    assert other == "洞察:用户B的提示词"
+
+
+def test_retrieval_score_matches_python_mean():
+    """测试检索评分的相似度均值按float64计算，与逐个求和的结果一致"""
+    
+    scores = [0.1, 0.2, 0.7, None]
+    results = [{"score": score} for score in scores]
+    expected_avg = sum(score or 0.0 for score in scores) / len(scores)
+    
+    score = EnhancedMultiAgentWorkflow().user_analyst._calculate_retrieval_score(results)
+    
+    assert score == round(expected_avg * 0.7 + min(len(scores) / 5.0, 1.0) * 0.3, 3)
+
+
+def test_node_cache_skips_failed_results():
+    """测试节点缓存只保存执行成功的结果"""
+    
+    cache = SuccessOnlyNodeCache()
+    ok = EnhancedAgentResult(
+        agent_name="EnhancedUserAnalystAgent",
+        success=True,
+        data=["user_1"],
+        message="成功",
+        llm_analysis=None,
+        execution_time=0.1
+    )
+    failed = replace(ok, success=False, data=None, message="失败")
+    
+    cache.set({
+        (("user_analysis",), "ok"): ([("agent_results", [ok])], 60),
+        (("user_analysis",), "failed"): ([("agent_results", [failed])], 60),
+    })
+    cached = cache.get([(("user_analysis",), "ok"), (("user_analysis",), "failed")])
+    
+    assert len(cached) == 1
+    [(channel, results)] = next(iter(cached.values()))
+    assert channel == "agent_results"
+    assert results[0].data == ["user_1"]
+
+
 async def run_all_enhanced_multi_agent_tests():
     """运行所有AI增强版Multi-Agent测试"""
     
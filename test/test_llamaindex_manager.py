@@ -6,15 +6,56 @@ LlamaIndex集成测试脚本
 import asyncio
 import sys
 import os
-from datetime import datetime
+import pytest
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from app.agents.llamaindex_manager import LlamaIndexManager, llamaindex_manager
+from app.agents import llm_cache
+from app.agents.llamaindex_manager import LlamaIndexManager
+from app.config.settings import settings
+from app.infra.db.async_database import Base
+from app.infra.models.comment_models import XhsComment
+from app.infra.models.llm_models import LlmCommentAnalysis
+from app.infra.models.note_models import XhsNote
+from llama_index.core import Document, QueryBundle, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from sqlalchemy import create_engine, insert
 from app.utils.logger import app_logger as logger
 
 
+@pytest.fixture(autouse=True)
+def no_openai_key():
+    """测试中清空OpenAI密钥，构造管理器时不会把全局嵌入模型换成真实的OpenAI嵌入模型并发起网络请求"""
+    with patch.object(settings, "OPENAI_KEY", ""):
+        yield
+
+
+class CharEmbedding(MockEmbedding):
+    """按字符分桶计数的确定性嵌入，不同文本得到不同向量，便于比较检索排序"""
+    
+    def _embed(self, text: str):
+        vector = [0.0] * self.embed_dim
+        for ch in text:
+            vector[ord(ch) % self.embed_dim] += 1.0
+        return vector
+    
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+    
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+    
+    async def _aget_text_embedding(self, text):
+        return self._embed(text)
+    
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
 async def test_llamaindex_initialization():
     """测试LlamaIndex初始化"""
     
@@ -329,6 +370,321 @@ async def test_performance_and_memory():
         return False
 
 
+@pytest.mark.asyncio
+async def test_semantic_search_batch_embeds_once(tmp_path):
+    """测试批量语义搜索只发起一次批量嵌入，结果与逐条搜索一致"""
+    
+    embed_model = CharEmbedding(embed_dim=8)
+    with patch.object(Settings, "_embed_model", embed_model):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        manager.comment_index = VectorStoreIndex.from_documents(
+            [Document(text=f"评论内容{i}") for i in range(4)]
+        )
+        queries = ["旅游相关的评论", "用户的情感倾向"]
+        expected = [await manager.semantic_search(q, top_k=2, similarity_threshold=0) for q in queries]
+        
+        with patch.object(CharEmbedding, "aget_text_embedding_batch", wraps=embed_model.aget_text_embedding_batch) as batch_embed, \
+                patch.object(CharEmbedding, "_get_query_embedding") as query_embed:
+            results = await manager.semantic_search_batch(queries, top_k=2, similarity_threshold=0)
+    
+    assert batch_embed.call_count == 1
+    assert query_embed.call_count == 0
+    assert [[r["node_id"] for r in rs] for rs in results] == [[r["node_id"] for r in rs] for rs in expected]
+    assert await manager.semantic_search_batch([]) == []
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_matches_retriever(tmp_path):
+    """测试单条语义搜索走嵌入矩阵打分，结果与LlamaIndex检索器一致"""
+    
+    with patch.object(Settings, "_embed_model", CharEmbedding(embed_dim=8)):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        texts = ["旅游评论", "美食推荐内容", "评论内容很好", "用户喜欢旅游", "价格太贵了"]
+        manager.comment_index = VectorStoreIndex.from_documents(
+            [Document(text=text) for text in texts]
+        )
+        expected = manager._retrieve(
+            manager._select_indexes("all"), QueryBundle("旅游内容"), 3, 0
+        )
+        results = await manager.semantic_search("旅游内容", top_k=3, similarity_threshold=0)
+    
+    assert [r["node_id"] for r in results] == [r["node_id"] for r in expected]
+    assert [r["score"] for r in results] == pytest.approx([r["score"] for r in expected], abs=1e-5)
+    # 检索器按索引缓存复用
+    assert manager._get_retriever("comment", manager.comment_index) is manager._retrievers["comment"][1]
+    assert len(manager._retrieve(manager._select_indexes("all"), QueryBundle("旅游内容"), 1, 0)) == 1
+
+
+@pytest.mark.asyncio
+async def test_build_all_indexes_concurrently(tmp_path):
+    """测试三个索引并发构建"""
+    
+    manager = LlamaIndexManager(persist_dir=str(tmp_path))
+    active = 0
+    max_active = 0
+    
+    async def mock_build(result):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return result
+    
+    with patch.object(manager, "build_comment_index", lambda: mock_build(True)), \
+            patch.object(manager, "build_note_index", lambda: mock_build(False)), \
+            patch.object(manager, "build_analysis_index", lambda: mock_build(True)):
+        results = await manager.build_all_indexes()
+    
+    assert results == {"comment_index": True, "note_index": False, "analysis_index": True}
+    assert max_active == 3
+
+
+
+def test_openai_clients_share_llm_http_client(tmp_path):
+    """测试LlamaIndex的OpenAI嵌入模型和LLM复用LLM模型管理器的HTTP连接池"""
+    
+    from app.agents.llm_manager import LLMModelManager
+    
+    with patch.object(settings, "OPENAI_KEY", "sk-test"), \
+            patch.object(Settings, "_embed_model", None), \
+            patch.object(Settings, "_llm", None):
+        LlamaIndexManager(persist_dir=str(tmp_path))
+        embed_model, llm = Settings.embed_model, Settings.llm
+    
+    http_client = LLMModelManager.instance().http_client
+    assert embed_model._async_http_client is http_client
+    assert llm._async_http_client is http_client
+
+
+@pytest.mark.asyncio
+async def test_build_index_reuses_cached_embeddings(tmp_path):
+    """测试重建索引时内容未变的文档复用缓存的嵌入，只为新文本请求嵌入接口"""
+    
+    embed_model = CharEmbedding(embed_dim=8)
+    with patch.object(Settings, "_embed_model", embed_model):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        documents = [Document(text=f"评论内容{i}") for i in range(3)]
+        first = await manager._abuild_vector_index(documents, StorageContext.from_defaults())
+        
+        rebuilt = LlamaIndexManager(persist_dir=str(tmp_path))
+        with patch.object(CharEmbedding, "aget_text_embedding_batch", wraps=embed_model.aget_text_embedding_batch) as batch_embed:
+            second = await rebuilt._abuild_vector_index(
+                [*documents, Document(text="新评论")], StorageContext.from_defaults()
+            )
+    
+    # LlamaIndex插入节点时对已有嵌入的节点会以空列表调用一次批量嵌入
+    assert [call.args[0] for call in batch_embed.call_args_list if call.args[0]] == [["新评论"]]
+    first_vectors = sorted(first.vector_store.data.embedding_dict.values())
+    second_vectors = second.vector_store.data.embedding_dict.values()
+    assert len(second_vectors) == 4
+    assert all(vector in second_vectors for vector in first_vectors)
+
+
+def test_instance_loads_indexes_once():
+    """测试进程级单例只构建并加载一次已有索引"""
+    
+    with patch.object(LlamaIndexManager, "_instance", None), \
+            patch.object(LlamaIndexManager, "load_existing_indexes") as load:
+        first = LlamaIndexManager.instance()
+        second = LlamaIndexManager.instance()
+    
+    assert first is second
+    assert load.call_count == 1
+
+
+def test_module_alias_is_process_singleton():
+    """测试模块级 llamaindex_manager 只是单例的别名，不会另建管理器"""
+    
+    import app.agents.llamaindex_manager as module
+    
+    assert "llamaindex_manager" not in vars(module)
+    with patch.object(LlamaIndexManager, "_instance", None), \
+            patch.object(LlamaIndexManager, "load_existing_indexes"):
+        assert module.llamaindex_manager is LlamaIndexManager.instance()
+
+@pytest.mark.asyncio
+async def test_aload_existing_indexes(tmp_path):
+    """测试异步加载已持久化的索引，与同步加载结果一致"""
+    
+    with patch.object(Settings, "_embed_model", CharEmbedding(embed_dim=8)):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        index = VectorStoreIndex.from_documents([Document(text=f"评论{i}") for i in range(3)])
+        index.storage_context.persist(persist_dir=str(manager.comment_storage_dir))
+        
+        loaded = LlamaIndexManager(persist_dir=str(tmp_path))
+        assert await loaded.aload_existing_indexes()
+        results = await loaded.semantic_search("评论1", top_k=1, similarity_threshold=0)
+    
+    assert len(loaded.comment_index.docstore.docs) == 3
+    assert loaded.note_index is None and loaded.analysis_index is None
+    assert results[0]["content"] == "评论1"
+
+
+@pytest.mark.asyncio
+async def test_persist_index_binary_vectors(tmp_path):
+    """测试索引向量以二进制矩阵持久化，重新加载后检索结果不变"""
+
+    with patch.object(Settings, "_embed_model", CharEmbedding(embed_dim=8)):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        index = VectorStoreIndex.from_documents([Document(text=f"评论{i}") for i in range(3)])
+        manager._persist_index(index, manager.comment_storage_dir)
+
+        loaded = LlamaIndexManager(persist_dir=str(tmp_path))
+        assert loaded.load_existing_indexes()
+        results = await loaded.semantic_search("评论2", top_k=1, similarity_threshold=0)
+
+    assert (manager.comment_storage_dir / "vectors.npz").exists()
+    assert not (manager.comment_storage_dir / "default__vector_store.json").exists()
+    assert loaded.comment_index.vector_store.data.embedding_dict.keys() == (
+        index.vector_store.data.embedding_dict.keys()
+    )
+    assert results[0]["content"] == "评论2"
+
+
+@pytest.mark.asyncio
+async def test_semantic_search_batch_int8_matrix(tmp_path):
+    """测试嵌入矩阵int8量化后批量检索的相似度与float32矩阵基本一致"""
+    
+    with patch.object(Settings, "_embed_model", CharEmbedding(embed_dim=16)):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        manager.comment_index = VectorStoreIndex.from_documents(
+            [Document(text=f"评论内容{i}" * (i + 1)) for i in range(6)]
+        )
+        queries = ["评论内容", "内容3"]
+        expected = await manager.semantic_search_batch(queries, top_k=3, similarity_threshold=0)
+        
+        manager._embedding_matrices.clear()
+        with patch.object(settings, "VECTOR_INT8_MIN_SIZE", 1):
+            results = await manager.semantic_search_batch(queries, top_k=3, similarity_threshold=0)
+    
+    assert manager._embedding_matrices["comment"][3].dtype == "int8"
+    for rs, expected_rs in zip(results, expected):
+        assert [r["score"] for r in rs] == pytest.approx([r["score"] for r in expected_rs], abs=0.02)
+
+@pytest.mark.asyncio
+async def test_get_user_insights_batch(tmp_path):
+    """测试用户洞察按用户ID在SQL中只取最新的记录，批量查询与逐个查询结果一致，重复用户只查询一次"""
+    
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(
+        engine, tables=[XhsComment.__table__, XhsNote.__table__, LlmCommentAnalysis.__table__]
+    )
+    with engine.begin() as conn:
+        conn.execute(insert(XhsComment), [
+            {"comment_id": f"c{i:02d}", "note_id": "n1", "comment_user_id": f"u{i % 2}",
+             "comment_user_nickname": "昵称", "comment_content": f"评论{i}", "comment_like_count": i,
+             # 创建时间与插入顺序相反，编号越小越新
+             "comment_create_time": datetime(2024, 1, 1) - timedelta(hours=i)}
+            for i in range(25)
+        ])
+    executed = []
+    
+    class FakeSession:
+        def __init__(self, conn):
+            self.conn = conn
+        
+        async def execute(self, query):
+            executed.append(query)
+            return self.conn.execute(query)
+    
+    @asynccontextmanager
+    async def fake_session_context():
+        with engine.connect() as conn:
+            yield FakeSession(conn)
+    
+    manager = LlamaIndexManager(persist_dir=str(tmp_path))
+    with patch("app.agents.llamaindex_manager.get_session_context", fake_session_context):
+        single = await manager.get_user_insights("u1")
+        executed.clear()
+        results = await manager.get_user_insights_batch(["u1", "u2", "u1"])
+    
+    # 评论、笔记、分析各查询一次
+    assert len(executed) == 3
+    assert list(results) == ["u1", "u2"]
+    assert results["u2"]["total_records"] == 0
+    assert results["u1"]["comments_count"] == single["comments_count"] == 10
+    # 保留的是u1最新的10条评论（c01, c03, ..., c19），按时间从新到旧排列
+    kept = [comment["metadata"]["comment_id"] for comment in results["u1"]["comments"]]
+    assert kept == [f"c{i:02d}" for i in range(1, 21, 2)]
+    assert [c["content"] for c in single["comments"]] == [c["content"] for c in results["u1"]["comments"]]
+    assert "评论内容: 评论1\n" in results["u1"]["comments"][0]["content"]
+    assert "comment_content" not in results["u1"]["comments"][0]["metadata"]
+
+@pytest.mark.asyncio
+async def test_intelligent_query_semantic_cache(tmp_path):
+    """测试同义问题命中语义缓存，只调用一次LLM"""
+    
+    async def mock_embed(text):
+        # 以字符集合作为向量，措辞顺序不同但用字相同的问题相似度为1
+        return [1.0 if ch in text else 0.0 for ch in "用户评论类型高价值"]
+    
+    manager = LlamaIndexManager(persist_dir=str(tmp_path))
+    search_results = [{"index_type": "comment", "content": "评论内容", "score": 0.9}]
+    mock_llm = AsyncMock(side_effect=["缓存的回答", "另一个回答"])
+    mock_search = AsyncMock(return_value=search_results)
+    
+    with patch.object(llm_cache, "semantic_llm_cache", llm_cache.SemanticLLMCache(embed_func=mock_embed)), \
+            patch.object(manager, "semantic_search", mock_search), \
+            patch("app.agents.llm_manager.call_llm", mock_llm):
+        first = await manager.intelligent_query("用户评论什么类型")
+        second = await manager.intelligent_query("用户什么类型评论")
+        other = await manager.intelligent_query("高价值用户")
+    
+    assert first == second == "缓存的回答"
+    assert other == "另一个回答"
+    assert mock_llm.await_count == 2
+    # 缓存命中时连语义检索也一并跳过
+    assert mock_search.await_count == 2
+
+
+
+@pytest.mark.asyncio
+async def test_intelligent_query_reuses_cache_embedding(tmp_path):
+    """测试语义缓存与索引使用同一嵌入模型时，问题只嵌入一次"""
+    
+    embed_model = CharEmbedding(embed_dim=8)
+    cache = llm_cache.SemanticLLMCache(
+        embed_func=embed_model.aget_text_embedding, embed_model_name=embed_model.model_name
+    )
+    
+    with patch.object(Settings, "_embed_model", embed_model), \
+            patch.object(llm_cache, "semantic_llm_cache", cache), \
+            patch("app.agents.llm_manager.call_llm", AsyncMock(return_value="回答")):
+        manager = LlamaIndexManager(persist_dir=str(tmp_path))
+        manager.comment_index = VectorStoreIndex.from_documents(
+            [Document(text=text) for text in ["旅游评论", "美食推荐内容"]]
+        )
+        with patch.object(CharEmbedding, "_aget_query_embedding") as query_embed:
+            answer = await manager.intelligent_query("旅游评论", context_type="comment")
+    
+    assert answer == "回答"
+    assert query_embed.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_intelligent_query(tmp_path):
+    """测试流式智能问答逐块产出LLM回答，没有相关内容时直接提示"""
+    
+    async def mock_stream_llm(system_prompt, user_prompt):
+        assert "评论内容" in user_prompt
+        for chunk in ["用户", "喜欢", "旅游"]:
+            yield chunk
+    
+    manager = LlamaIndexManager(persist_dir=str(tmp_path))
+    search_results = [{"index_type": "comment", "content": "评论内容", "score": 0.9}]
+    
+    with patch.object(manager, "semantic_search", AsyncMock(return_value=search_results)), \
+            patch("app.agents.llm_manager.stream_llm", mock_stream_llm):
+        chunks = [chunk async for chunk in manager.stream_intelligent_query("用户喜欢什么")]
+    
+    assert chunks == ["用户", "喜欢", "旅游"]
+    
+    with patch.object(manager, "semantic_search", AsyncMock(return_value=[])):
+        chunks = [chunk async for chunk in manager.stream_intelligent_query("用户喜欢什么")]
+    
+    assert chunks == ["抱歉，没有找到与您问题相关的信息。"]
+
 async def run_all_llamaindex_tests():
     """运行所有LlamaIndex测试"""
     
@@ -6,8 +6,13 @@ LLM模型管理器测试脚本
 import asyncio
 import sys
 import os
+import pytest
+import time
 from datetime import datetime
 from typing import List, Dict, Any
+from unittest.mock import AsyncMock, patch
+
+import httpx
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -18,8 +23,12 @@ from app.agents.llm_manager import (
     llm_manager,
     call_llm,
     call_llm_with_messages,
-    AgentLLMCaller
+    AgentLLMCaller,
+    prompt_batcher
 )
+from app.agents.llm_batcher import PromptBatcher
+from app.agents.llm_cache import llm_response_cache, SemanticLLMCache, semantic_cached
+from app.config.settings import settings
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from app.utils.logger import app_logger as logger
 
@@ -345,6 +354,370 @@ async def test_error_handling():
         return False
 
 
+@pytest.mark.asyncio
+async def test_call_llm_response_cache():
+    """测试相同提示词的LLM调用命中响应缓存"""
+    
+    llm_response_cache.clear()
+    mock_invoke = AsyncMock(side_effect=[None, "缓存的回答", "另一个回答"])
+    
+    with patch.object(llm_manager, "invoke_with_fallback", mock_invoke):
+        # 调用失败返回None时不写入缓存
+        assert await call_llm("系统提示", "用户问题") is None
+        first = await call_llm("系统提示", "用户问题")
+        second = await call_llm("系统提示", "用户问题")
+        other = await call_llm("系统提示", "另一个问题")
+    
+    assert first == second == "缓存的回答"
+    assert other == "另一个回答"
+    assert mock_invoke.await_count == 3
+    llm_response_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_near_duplicate_prompts():
+    """测试语义相近的提示词命中语义缓存"""
+    
+    async def mock_embed(text):
+        # 以字符集合作为向量，顺序不同但内容相同的文本相似度为1
+        return [1.0 if ch in text else 0.0 for ch in "ABCDEFGHIJ"]
+    
+    cache = SemanticLLMCache(threshold=0.93, embed_func=mock_embed)
+    mock_llm = AsyncMock(side_effect=["第一次回答", "第二次回答"])
+    
+    @semantic_cached(key_func=lambda prompt: (("test",), prompt), cache=cache)
+    async def ask(prompt):
+        return await mock_llm(prompt)
+    
+    assert await ask("用户A B C") == "第一次回答"
+    assert await ask("用户C A B") == "第一次回答"
+    assert await ask("用户F G H") == "第二次回答"
+    assert mock_llm.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_analyze_users_skips_semantic_cache():
+    """测试单用户分析不做语义复用，多用户汇总分析按语义缓存复用"""
+
+    async def mock_embed(text):
+        # 所有提示词向量相同，模拟只有用户ID不同的相近画像
+        return [1.0, 0.0]
+
+    caller = AgentLLMCaller("TestAgent")
+    mock_llm = AsyncMock(side_effect=lambda system_prompt, user_prompt, **kwargs: user_prompt)
+
+    with patch("app.agents.llm_cache.semantic_llm_cache", SemanticLLMCache(embed_func=mock_embed)), \
+            patch("app.agents.llm_manager.call_llm", mock_llm):
+        user_a = await caller.analyze_users("用户A", "分析")
+        user_b = await caller.analyze_users("用户B", "分析")
+        summary = await caller.summarize_users("用户A、B汇总", "汇总")
+        similar = await caller.summarize_users("用户A、C汇总", "汇总")
+
+    assert "用户A" in user_a and "用户B" in user_b
+    assert similar == summary
+    assert mock_llm.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_ttl_and_persistence(tmp_path):
+    """测试语义缓存条目过期后不再命中，持久化后可在新实例中恢复"""
+    
+    async def mock_embed(text):
+        return [1.0 if ch in text else 0.0 for ch in "ABCDEFGHIJ"]
+    
+    cache = SemanticLLMCache(embed_func=mock_embed, ttl=60)
+    vector = await cache.embed("A B C")
+    cache.add("p", vector, "回答")
+    
+    path = str(tmp_path / "semantic_cache.pkl")
+    cache.save(path)
+    restored = SemanticLLMCache(embed_func=mock_embed, ttl=60)
+    assert restored.load(path)
+    assert restored.lookup("p", await restored.embed("C B A")) == "回答"
+    
+    with patch("app.agents.llm_cache.time.time", return_value=time.time() + 61):
+        assert restored.lookup("p", vector) is None
+        restored.add("p", await restored.embed("F G H"), "新回答")
+    assert len(restored) == 1
+
+
+@pytest.mark.asyncio
+async def test_call_llm_batch():
+    """测试批量并发调用，单个失败不影响其他结果"""
+    
+    caller = AgentLLMCaller("TestAgent")
+    active = 0
+    max_active = 0
+    
+    async def mock_call_llm(prompt, system_prompt=None):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        if prompt == "失败":
+            raise RuntimeError("模型调用失败")
+        return f"回答:{prompt}"
+    
+    with patch.object(caller, "call_llm", mock_call_llm):
+        results = await caller.call_llm_batch(["主题1", "失败", "主题2", "主题3"], max_concurrency=2)
+    
+    assert results == ["回答:主题1", None, "回答:主题2", "回答:主题3"]
+    assert max_active == 2
+
+
+@pytest.mark.asyncio
+async def test_analyze_users_batch():
+    """测试多个用户合并为一次调用，响应格式不符时回退为逐个用户调用"""
+    
+    caller = AgentLLMCaller("TestAgent")
+    packed = AsyncMock(return_value='```json\n["洞察A", "洞察B", "洞察C"]\n```')
+    
+    with patch.object(caller, "call_llm", packed):
+        results = await caller.analyze_users_batch(["用户A", "用户B", "用户C"], "深度分析")
+    
+    assert results == ["洞察A", "洞察B", "洞察C"]
+    assert packed.await_count == 1
+    assert "用户A" in packed.call_args.args[0] and "用户C" in packed.call_args.args[0]
+    
+    single = AsyncMock(side_effect=["单独A", RuntimeError("模型调用失败")])
+    with patch.object(caller, "call_llm", AsyncMock(return_value='["只有一条"]')), \
+            patch.object(caller, "analyze_users", single):
+        results = await caller.analyze_users_batch(["用户A", "用户B"], "深度分析")
+    
+    assert results == ["单独A", None]
+    assert single.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_call_llm_coalesces_concurrent_duplicates():
+    """测试微批处理窗口内并发的相同提示词只调用一次模型"""
+    
+    llm_response_cache.clear()
+    caller = AgentLLMCaller("TestAgent")
+    
+    async def mock_invoke(messages, preferred_provider=None, max_tokens=None):
+        await asyncio.sleep(0.01)
+        return f"回答:{messages[-1].content}"
+    
+    mock = AsyncMock(side_effect=mock_invoke)
+    with patch.object(llm_manager, "invoke_with_fallback", mock), \
+            patch.object(settings, "LLM_BATCH_WINDOW_MS", 10), \
+            patch.object(prompt_batcher, "max_wait", 0.01):
+        results = await asyncio.gather(
+            caller.call_llm("问题A"),
+            caller.call_llm("问题A"),
+            caller.call_llm("问题B"),
+            caller.call_llm("问题A"),
+        )
+    
+    assert results == ["回答:问题A", "回答:问题A", "回答:问题B", "回答:问题A"]
+    assert mock.await_count == 2
+    
+    # 默认关闭微批处理，调用直接请求模型，不经过批处理器
+    llm_response_cache.clear()
+    mock.reset_mock()
+    with patch.object(llm_manager, "invoke_with_fallback", mock), \
+            patch.object(prompt_batcher, "submit", AsyncMock()) as mock_submit:
+        assert await caller.call_llm("问题A") == "回答:问题A"
+    assert mock.await_count == 1
+    assert mock_submit.await_count == 0
+    llm_response_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_prompt_batcher_propagates_cancellation():
+    """测试批内请求被取消或批次任务被取消时，等待方得到取消异常而不是挂起或拿到异常对象"""
+    
+    async def executor(items):
+        return [asyncio.CancelledError() if item == "取消" else f"回答:{item}" for item in items]
+    
+    batcher = PromptBatcher(executor, max_wait_ms=1)
+    cancelled, answered = await asyncio.gather(
+        batcher.submit("a", "取消"), batcher.submit("b", "问题"), return_exceptions=True
+    )
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert answered == "回答:问题"
+    
+    started = asyncio.Event()
+    
+    async def hanging_executor(items):
+        started.set()
+        await asyncio.sleep(60)
+    
+    batcher = PromptBatcher(hanging_executor, max_wait_ms=1)
+    waiter = asyncio.create_task(batcher.submit("a", "问题"))
+    await started.wait()
+    for task in list(batcher._running):
+        task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(waiter, timeout=1)
+
+
+def test_llm_model_manager_singleton():
+    """测试模型管理器为进程级单例，并被所有Agent调用器共享"""
+    
+    assert LLMModelManager.instance() is llm_manager
+    assert AgentLLMCaller("AgentA").llm_manager is AgentLLMCaller("AgentB").llm_manager is llm_manager
+
+
+def test_provider_semaphores_per_event_loop():
+    """测试提供商信号量按事件循环创建，单例在多次asyncio.run中都可以使用"""
+
+    manager = LLMModelManager.instance()
+
+    async def contend():
+        semaphore = manager._get_semaphore(ModelProvider.OPENROUTER)
+        for _ in range(manager.max_concurrency):
+            await semaphore.acquire()
+        # 信号量耗尽后再等待一次，使其绑定到当前事件循环
+        waiter = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        semaphore.release()
+        await waiter
+        for _ in range(manager.max_concurrency):
+            semaphore.release()
+        return semaphore
+
+    first = asyncio.run(contend())
+    second = asyncio.run(contend())
+
+    assert first is not second
+
+
+def test_http_client_pool_per_event_loop():
+    """测试共享HTTP客户端在各事件循环中分别创建连接池，关闭后客户端仍可在新循环中使用"""
+
+    created = []
+
+    class FakeTransport(httpx.AsyncBaseTransport):
+        def __init__(self, **kwargs):
+            self.loop = asyncio.get_running_loop()
+            self.closed = False
+            created.append(self)
+
+        async def handle_async_request(self, request):
+            assert asyncio.get_running_loop() is self.loop
+            return httpx.Response(200, text="ok")
+
+        async def aclose(self):
+            self.closed = True
+
+    async def request(manager):
+        response = await manager.http_client.get("https://example.com")
+        await manager.aclose()
+        return response.text
+
+    with patch("app.agents.llm_manager.httpx.AsyncHTTPTransport", FakeTransport):
+        manager = LLMModelManager()
+        # 构造时不创建连接池
+        assert not created
+        assert asyncio.run(request(manager)) == "ok"
+        assert asyncio.run(request(manager)) == "ok"
+
+    assert len(created) == 2
+    assert all(transport.closed for transport in created)
+
+
+def test_openai_compatible_models_share_http_client():
+    """测试OpenAI兼容的各提供商共用模型管理器的HTTP连接池"""
+    
+    from app.config.settings import settings
+    
+    with patch.object(settings, "OPENAI_KEY", "sk-test"), \
+            patch.object(settings, "OPENROUTER_KEY", "sk-test"):
+        manager = LLMModelManager()
+    
+    models = [manager.models[ModelProvider.OPENAI], manager.models[ModelProvider.OPENROUTER]]
+    assert all(model.http_async_client is manager.http_client for model in models)
+
+
+@pytest.mark.asyncio
+async def test_invoke_with_fallback_concurrency_and_rate_limit_retry():
+    """测试同一提供商的并发上限，以及限流错误的退避重试"""
+    
+    class RateLimitError(Exception):
+        pass
+    
+    active = 0
+    max_active = 0
+    rate_limited = False
+    
+    class FakeModel:
+        async def ainvoke(self, messages):
+            nonlocal active, max_active, rate_limited
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            if not rate_limited:
+                rate_limited = True
+                raise RateLimitError("429 Too Many Requests")
+            return AIMessage(content="ok")
+    
+    manager = LLMModelManager()
+    manager.models = {ModelProvider.OPENAI: FakeModel()}
+    manager.max_concurrency = 2
+    messages = [HumanMessage(content="你好")]
+    
+    with patch("app.agents.llm_manager.RATE_LIMIT_BASE_DELAY", 0.01):
+        results = await asyncio.gather(
+            *(manager.invoke_with_fallback(messages, ModelProvider.OPENAI) for _ in range(5))
+        )
+    
+    assert results == ["ok"] * 5
+    assert max_active == 2
+
+
+def test_create_prompt_messages_reuses_system_message():
+    """测试相同系统提示词复用同一个系统消息对象"""
+    
+    first = llm_manager.create_prompt_messages("系统提示", "问题一")
+    second = llm_manager.create_prompt_messages("系统提示", "问题二", context="背景")
+    
+    assert first[0] is second[0]
+    assert first[0].content == "系统提示"
+    assert second[2].content == "背景信息：\n背景"
+
+
+@pytest.mark.asyncio
+async def test_invoke_with_fallback_hedges_slow_provider():
+    """测试首选提供商超过对冲时间未返回时并发请求备选提供商，先返回的结果胜出并取消慢请求"""
+    
+    cancelled = False
+    
+    class SlowModel:
+        async def ainvoke(self, messages):
+            nonlocal cancelled
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return AIMessage(content="slow")
+    
+    class FastModel:
+        async def ainvoke(self, messages):
+            return AIMessage(content="fast")
+    
+    class FailingModel:
+        async def ainvoke(self, messages):
+            raise ValueError("boom")
+    
+    manager = LLMModelManager()
+    messages = [HumanMessage(content="你好")]
+    
+    manager.models = {ModelProvider.ANTHROPIC: SlowModel(), ModelProvider.OPENAI: FastModel()}
+    assert await manager.invoke_with_fallback(messages, hedge_after_ms=10) == "fast"
+    assert cancelled
+    
+    # 不对冲时失败后按顺序切换到下一个提供商
+    manager.models = {ModelProvider.ANTHROPIC: FailingModel(), ModelProvider.OPENAI: FastModel()}
+    assert await manager.invoke_with_fallback(messages, hedge_after_ms=0) == "fast"
+    manager.models = {ModelProvider.ANTHROPIC: FailingModel()}
+    assert await manager.invoke_with_fallback(messages, hedge_after_ms=0) is None
+
+
 async def run_all_llm_tests():
     """运行所有LLM模型管理器测试"""
     
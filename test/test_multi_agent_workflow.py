@@ -6,12 +6,15 @@ Multi-Agent工作流测试脚本
 import asyncio
 import sys
 import os
+import pytest
+import numpy as np
 from datetime import datetime
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from app.agents.multi_agent_workflow import MultiAgentWorkflow, test_multi_agent_workflow
+from app.agents.user_analyst_agent import UserProfile, AnalysisResult
 from app.utils.logger import app_logger as logger
 
 
@@ -169,6 +172,90 @@ async def test_individual_components():
         return False
 
 
+def _make_user(user_id, emotion, aips, score, unmet_desc=""):
+    """构造测试用户画像"""
+    return UserProfile(
+        user_id=user_id,
+        nickname=f"用户{user_id}",
+        emotional_preference=emotion,
+        aips_preference=aips,
+        has_visited="否",
+        unmet_preference="是" if unmet_desc else "否",
+        unmet_desc=unmet_desc,
+        gender="女",
+        age="25",
+        value_score=score,
+        interaction_count=1,
+        latest_activity=datetime.now(),
+        notes_engaged=[]
+    )
+
+
+@pytest.mark.asyncio
+async def test_analyze_user_characteristics():
+    """测试用户群体特征统计"""
+    
+    workflow = MultiAgentWorkflow()
+    users = [
+        _make_user("1", "中性", "兴趣", 60.0),
+        _make_user("2", "正向", "注意", 80.0, "想要平价推荐"),
+        _make_user("3", "正向", "兴趣", 70.0),
+    ]
+    
+    analysis_result = AnalysisResult(
+        high_value_users=users,
+        total_analyzed=len(users),
+        analysis_time=datetime.now(),
+        criteria_used={}
+    )
+    
+    strategy = await workflow._analyze_user_characteristics(analysis_result)
+    characteristics = strategy["target_segments"][0]["characteristics"]
+    
+    assert characteristics["emotional_preference"] == "正向"
+    assert characteristics["aips_preference"] == "兴趣"
+    assert characteristics["avg_value_score"] == pytest.approx(70.0)
+    assert strategy["unmet_needs_analysis"] == ["想要平价推荐"]
+    assert strategy["user_count"] == 3
+
+
+def test_value_scores_keep_float64_precision():
+    """测试价值评分数组保持float64精度，平均分与Python浮点计算结果一致"""
+    
+    scores = [0.1, 0.2, 0.7]
+    analysis_result = AnalysisResult(
+        high_value_users=[_make_user(str(i), "正向", "兴趣", score) for i, score in enumerate(scores)],
+        total_analyzed=len(scores),
+        analysis_time=datetime.now(),
+        criteria_used={}
+    )
+    
+    assert analysis_result.value_scores.dtype == np.float64
+    assert float(analysis_result.value_scores.mean()) == sum(scores) / len(scores)
+
+
+@pytest.mark.asyncio
+async def test_create_coordination_plan_phases():
+    """测试协调计划只包含满足条件的执行阶段"""
+    
+    workflow = MultiAgentWorkflow()
+    analysis_result = AnalysisResult(
+        high_value_users=[_make_user("1", "正向", "兴趣", 80.0)],
+        total_analyzed=1,
+        analysis_time=datetime.now(),
+        criteria_used={}
+    )
+    
+    full_plan = await workflow._create_coordination_plan(
+        analysis_result, None, {"content_pieces": [{"title": "标题"}]}
+    )
+    empty_plan = await workflow._create_coordination_plan(None, None, {"content_pieces": []})
+    
+    assert [p["phase"] for p in full_plan["execution_phases"]] == ["用户触达", "内容投放", "效果监控"]
+    assert full_plan["execution_phases"][1]["description"] == "投放1个针对性内容"
+    assert [p["phase"] for p in empty_plan["execution_phases"]] == ["效果监控"]
+
+
 async def run_all_multi_agent_tests():
     """运行所有Multi-Agent测试"""
     